@@ -0,0 +1,406 @@
+import argparse
+from datetime import datetime, timezone
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import re
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSPECTOR = os.path.join(REPO_DIR, 'inspector', 'inspector.py')
+LOGPARSE = os.path.join(REPO_DIR, 'logparse', 'logparse.py')
+
+# Classic little-endian pcap with microsecond timestamps and Ethernet frames.
+PCAP_HEADER = struct.Struct('<IHHiIII')
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_ETHERNET = 1
+RECORD_HEADER = struct.Struct('<IIII')
+ETHERNET_HEADER = bytes.fromhex('020000000002' '020000000001' '0800')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+UDP_HEADER = struct.Struct('!HHHH')
+UDP = 17
+# Records are written in batches of this many.
+WRITE_BATCH = 4096
+
+DEFAULT_SOURCE = '192.168.1.1'
+DEFAULT_DESTINATION = '192.168.1.2'
+DEFAULT_START_TIME = 1700000000.0
+# Delay distributions between the two capture points: each takes the random
+# generator, the mean and the spread (both in ms).
+DELAY_DISTRIBUTIONS = {
+    'constant': lambda rng, mean, spread: mean,
+    'uniform': lambda rng, mean, spread: rng.uniform(mean - spread, mean + spread),
+    'normal': lambda rng, mean, spread: rng.gauss(mean, spread),
+    'exponential': lambda rng, mean, spread: rng.expovariate(1 / mean),
+    'lognormal': lambda rng, mean, spread: rng.lognormvariate(
+        math.log(mean) - math.log1p((spread / mean) ** 2) / 2, math.sqrt(math.log1p((spread / mean) ** 2))),
+}
+
+DEFAULT_SEVERITY_MIX = 'INFO=70,DEBUG=15,WARN=8,ERROR=5,FATAL=2'
+LOG_MESSAGES = [
+    'User {user} logged in.',
+    'User {user} logged out of the system.',
+    'User {user} attempted to log in with an incorrect key.',
+    'Request {number} served in {millis} ms.',
+    'Connection from 10.{a}.{b}.{c} refused.',
+    'Disk usage at {percent}% on /var.',
+    'Cache miss for key session:{number}.',
+    'System is analyzing login patterns.',
+    'Job {number} finished with status {status}.',
+    'Retrying upstream call, attempt {attempt}.',
+]
+CONTINUATION_LINES = ['Traceback (most recent call last):', '  File "app.py", line {number}, in handle',
+                      'ValueError: unexpected value {number}']
+
+# Input sizes of the runner: captured packets, and bytes of log.
+SCALES = {
+    'small': {'packets': 10000, 'log_bytes': 10 * 1024 ** 2},
+    'medium': {'packets': 1000000, 'log_bytes': 512 * 1024 ** 2},
+    'large': {'packets': 50000000, 'log_bytes': 4 * 1024 ** 3},
+}
+DEFAULT_REPEAT = 3
+# A case regresses when it is this much slower, or uses this much more
+# memory, than in the baseline.
+DEFAULT_TOLERANCE = 0.2
+
+def parse_size(value, base=1000):
+    # "10k", "50M", "2G" (or a plain number) as a number; base 1024 for bytes.
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kKmMgG]?)', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid size "{value}", expected e.g. 10k, 50M or 2G')
+    return int(float(match.group(1)) * base ** ' kmg'.index(match.group(2).lower() or ' '))
+
+def parse_bytes(value):
+    return parse_size(value, 1024)
+
+def parse_severity_mix(value):
+    # "INFO=70,ERROR=5" as {severity: weight}.
+    mix = {}
+    for part in value.split(','):
+        severity, _, weight = part.partition('=')
+        try:
+            mix[severity.strip().upper()] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid severity mix "{value}", expected e.g. INFO=70,ERROR=5')
+    if not mix or sum(mix.values()) <= 0 or not all(severity.isalpha() for severity in mix):
+        raise argparse.ArgumentTypeError(f'invalid severity mix "{value}", expected e.g. INFO=70,ERROR=5')
+    return mix
+
+def _ipv4_packet(src, dst, ip_id, sequence, payload_bytes):
+    # Ethernet + IPv4 + UDP frame whose payload starts with the sequence
+    # number, so reused IP IDs still carry different payloads.
+    payload = struct.pack('!Q', sequence).ljust(payload_bytes, b'\0')
+    length = 20 + 8 + len(payload)
+    return (ETHERNET_HEADER + IPV4_HEADER.pack(0x45, 0, length, ip_id, 0, 64, UDP, 0, src, dst)
+            + UDP_HEADER.pack(40000 + sequence % 1000, 9000, 8 + len(payload), 0) + payload)
+
+def _record(timestamp, frame):
+    seconds = int(timestamp)
+    return RECORD_HEADER.pack(seconds, int((timestamp - seconds) * 1e6), len(frame), len(frame)) + frame
+
+def generate_pcaps(path1, path2, packets, seed=0, rate=10000.0, delay='lognormal', delay_ms=5.0, jitter_ms=2.0,
+                   max_delay_ms=100.0, loss=0.0, id_space=65536, payload_bytes=(18, 1400), noise=0.0,
+                   source=DEFAULT_SOURCE, destination=DEFAULT_DESTINATION, start_time=DEFAULT_START_TIME):
+    # Writes the same traffic as seen at two capture points: packets leave
+    # the first at Poisson times (rate per second) and reach the second after
+    # a delay drawn from the delay distribution, clipped to [0, max_delay_ms].
+    # IP IDs count up modulo id_space, so any id_space below packets makes
+    # them wrap. loss is the fraction of packets missing from the second
+    # capture, noise the fraction sent between other addresses. The output
+    # depends on the arguments only. Memory stays bounded by the packets in
+    # flight. Returns counts and sizes of both captures.
+    rng = random.Random(seed)
+    draw_delay = DELAY_DISTRIBUTIONS[delay]
+    src = bytes(map(int, source.split('.')))
+    dst = bytes(map(int, destination.split('.')))
+    header = PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET)
+    stats = {'packets': packets, 'matched': 0, 'bytes': [len(header), len(header)]}
+    in_flight = []
+    batches = ([], [])
+
+    with open(path1, 'wb') as file1, open(path2, 'wb') as file2:
+        files = (file1, file2)
+        for file in files:
+            file.write(header)
+
+        def flush(side, force=False):
+            if len(batches[side]) >= WRITE_BATCH or force and batches[side]:
+                data = b''.join(batches[side])
+                files[side].write(data)
+                stats['bytes'][side] += len(data)
+                batches[side].clear()
+
+        now = start_time
+        for sequence in range(packets):
+            now += rng.expovariate(rate)
+            if noise and rng.random() < noise:
+                addresses = bytes((10, rng.randrange(256), rng.randrange(256), 1)), bytes((10, 0, 0, 2))
+            else:
+                addresses = src, dst
+            size = rng.randint(*payload_bytes) if isinstance(payload_bytes, tuple) else payload_bytes
+            frame = _ipv4_packet(*addresses, sequence % id_space, sequence, size)
+            batches[0].append(_record(now, frame))
+            flush(0)
+
+            # The second capture is in arrival order: packets wait in a heap
+            # until nothing sent later can arrive before them.
+            while in_flight and in_flight[0][0] <= now:
+                batches[1].append(heapq.heappop(in_flight)[2])
+                flush(1)
+            if loss and rng.random() < loss:
+                continue
+            packet_delay = min(max(draw_delay(rng, delay_ms, jitter_ms), 0.0), max_delay_ms)
+            if addresses[0] == src:
+                stats['matched'] += 1
+            heapq.heappush(in_flight, (now + packet_delay / 1000, sequence, _record(now + packet_delay / 1000, frame)))
+        while in_flight:
+            batches[1].append(heapq.heappop(in_flight)[2])
+        flush(0, True)
+        flush(1, True)
+    return stats
+
+def generate_log(path, size_bytes=None, lines=None, seed=0, severity_mix=None, lines_per_second=100.0,
+                 continuation=0.0, disorder_seconds=0, start_time=DEFAULT_START_TIME):
+    # Writes a log in the "YYYY-MM-DD HH:MM:SS SEVERITY: message" format of
+    # logparse until it holds size_bytes bytes or lines entries. Severities
+    # follow severity_mix ({severity: weight}); continuation is the fraction
+    # of entries followed by an untimestamped traceback, and disorder_seconds
+    # shifts timestamps back by up to that many seconds. The output depends
+    # on the arguments only. Returns the number of entries and bytes written.
+    rng = random.Random(seed)
+    severity_mix = severity_mix or parse_severity_mix(DEFAULT_SEVERITY_MIX)
+    severities = list(severity_mix)
+    weights = list(severity_mix.values())
+    entries = 0
+    written = 0
+    clock = start_time
+    stamps = {}
+
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        while (size_bytes is None or written < size_bytes) and (lines is None or entries < lines):
+            batch = []
+            for severity in rng.choices(severities, weights, k=WRITE_BATCH):
+                if lines is not None and entries >= lines:
+                    break
+                clock += rng.expovariate(lines_per_second)
+                second = int(clock) - (rng.randint(0, disorder_seconds) if disorder_seconds else 0)
+                stamp = stamps.get(second)
+                if stamp is None:
+                    if len(stamps) > 1024:
+                        stamps.clear()
+                    stamp = stamps[second] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(second))
+                number = rng.randrange(1000000)
+                message = rng.choice(LOG_MESSAGES).format(
+                    user=f'user{number % 5000}', number=number, millis=number % 2000, a=number % 256,
+                    b=number // 256 % 256, c=number // 65536 % 256, percent=number % 100, status=number % 3,
+                    attempt=number % 5 + 1)
+                batch.append(f'{stamp} {severity}: {message}\n')
+                if continuation and rng.random() < continuation:
+                    batch.extend(line.format(number=number) + '\n' for line in CONTINUATION_LINES)
+                entries += 1
+            data = ''.join(batch)
+            file.write(data)
+            written += len(data.encode('utf-8'))
+    return {'entries': entries, 'bytes': written}
+
+def measure(command, repeat=DEFAULT_REPEAT):
+    # Runs command repeat times and returns its wall times and the largest
+    # peak RSS of a run. Each run is waited for with wait4, so its resource
+    # usage is its own and not that of every child so far.
+    seconds = []
+    peak_rss = 0
+    for _ in range(repeat):
+        with tempfile.TemporaryFile() as errors:
+            start = time.perf_counter()
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=errors)
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds.append(time.perf_counter() - start)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            if process.returncode:
+                errors.seek(0)
+                raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}: "
+                                   f"{errors.read().decode(errors='replace').strip()}")
+        # ru_maxrss is in KiB on Linux and in bytes on macOS.
+        peak_rss = max(peak_rss, usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024))
+    return {'seconds': seconds, 'median_seconds': statistics.median(seconds), 'min_seconds': min(seconds),
+            'peak_rss_bytes': peak_rss}
+
+def prepare_inputs(work_dir, packets, log_bytes, seed=0):
+    # Generates the runner's inputs unless the same ones are already there.
+    os.makedirs(work_dir, exist_ok=True)
+    pcap1 = os.path.join(work_dir, f'paired-{packets}-{seed}-1.pcap')
+    pcap2 = os.path.join(work_dir, f'paired-{packets}-{seed}-2.pcap')
+    log = os.path.join(work_dir, f'app-{log_bytes}-{seed}.log')
+    if not (os.path.exists(pcap1) and os.path.exists(pcap2)):
+        generate_pcaps(pcap1 + '.tmp', pcap2 + '.tmp', packets, seed=seed, noise=0.1, loss=0.01)
+        os.replace(pcap1 + '.tmp', pcap1)
+        os.replace(pcap2 + '.tmp', pcap2)
+    if not os.path.exists(log):
+        generate_log(log + '.tmp', size_bytes=log_bytes, seed=seed, continuation=0.01)
+        os.replace(log + '.tmp', log)
+    return pcap1, pcap2, log
+
+def default_cases(pcap1, pcap2, log, packets):
+    # (name, command, items processed) of each benchmarked command. Packet
+    # table caches are disabled, so every run parses its captures.
+    python = sys.executable
+    single = [python, INSPECTOR, pcap1, '--no-cache']
+    pair = [python, INSPECTOR, pcap1, pcap2, '--source', DEFAULT_SOURCE, '--destination', DEFAULT_DESTINATION,
+            '--no-cache']
+    with open(log, 'rb') as file:
+        log_lines = sum(chunk.count(b'\n') for chunk in iter(lambda: file.read(1024 * 1024), b''))
+    return [
+        ('inspector.analyze_file', single + ['--source', DEFAULT_SOURCE], packets),
+        ('inspector.calculate_delays', pair + ['--top', '10'], 2 * packets),
+        ('inspector.calculate_delays_streaming', pair + ['--streaming', '--max-delay', '100'], 2 * packets),
+        ('inspector.flows', single + ['--flows'], packets),
+        ('logparse.count_severity', [python, LOGPARSE, 'count', '--severity', 'ERROR', log], log_lines),
+        ('logparse.count_text', [python, LOGPARSE, 'count', '--text', '*refused*', log], log_lines),
+        ('logparse.first', [python, LOGPARSE, 'first', '--severity', 'FATAL', log], log_lines),
+        ('logparse.last', [python, LOGPARSE, 'last', '--text', 'User*', log], log_lines),
+        ('logparse.histogram', [python, LOGPARSE, 'histogram', '--bucket', '1h', log], log_lines),
+    ]
+
+def run_cases(cases, repeat=DEFAULT_REPEAT, only=None):
+    # {name: measurement plus throughput} of each case whose name contains
+    # one of the only substrings (every case when only is empty).
+    results = {}
+    for name, command, items in cases:
+        if only and not any(part in name for part in only):
+            continue
+        paths = [part for part in command if os.path.isfile(part) and part not in (INSPECTOR, LOGPARSE)]
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+        result = measure(command, repeat)
+        result.update(items=items, input_bytes=input_bytes,
+                      items_per_second=items / result['median_seconds'],
+                      bytes_per_second=input_bytes / result['median_seconds'],
+                      command=[os.path.basename(part) if os.path.isabs(part) else part for part in command[1:]])
+        results[name] = result
+        print(f"{name}: {result['median_seconds']:.3f} s, {result['items_per_second']:.0f} items/s, "
+              f"{result['bytes_per_second'] / 1024 ** 2:.1f} MiB/s, "
+              f"peak RSS {result['peak_rss_bytes'] / 1024 ** 2:.1f} MiB", flush=True)
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, rss_tolerance=DEFAULT_TOLERANCE):
+    # [(case, metric, baseline value, current value)] of every case that is
+    # slower or uses more memory than the baseline allows. Cases missing on
+    # either side are not compared.
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['median_seconds'] > before['median_seconds'] * (1 + tolerance):
+            regressions.append((name, 'median_seconds', before['median_seconds'], result['median_seconds']))
+        if result['peak_rss_bytes'] > before['peak_rss_bytes'] * (1 + rss_tolerance):
+            regressions.append((name, 'peak_rss_bytes', before['peak_rss_bytes'], result['peak_rss_bytes']))
+    return regressions
+
+def run(args):
+    scale = dict(SCALES[args.scale])
+    if args.packets:
+        scale['packets'] = args.packets
+    if args.log_size:
+        scale['log_bytes'] = args.log_size
+    pcap1, pcap2, log = prepare_inputs(args.work_dir, scale['packets'], scale['log_bytes'], args.seed)
+    results = run_cases(default_cases(pcap1, pcap2, log, scale['packets']), args.repeat, args.only)
+    report = {'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+              'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'seed': args.seed, 'scale': scale, 'cases': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    if baseline.get('scale') != scale:
+        print(f"Warning: the baseline was recorded at scale {baseline.get('scale')}, not {scale}.")
+    regressions = compare(results, baseline.get('cases', {}), args.tolerance, args.rss_tolerance)
+    for name, metric, before, after in regressions:
+        print(f"REGRESSION {name}: {metric} {before:.6g} -> {after:.6g} ({(after / before - 1) * 100:+.1f}%)")
+    if not regressions:
+        print(f"No regressions against {args.baseline}.")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates benchmark inputs and benchmarks inspector and logparse.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pcap = commands.add_parser('pcap', help='Write two captures of the same traffic at two capture points')
+    pcap.add_argument('output1')
+    pcap.add_argument('output2')
+    pcap.add_argument('--packets', type=parse_size, default=10000, help='Packets sent, e.g. 10k or 50M')
+    pcap.add_argument('--seed', type=int, default=0)
+    pcap.add_argument('--rate', type=float, default=10000.0, help='Mean packets per second')
+    pcap.add_argument('--delay', choices=sorted(DELAY_DISTRIBUTIONS), default='lognormal',
+                      help='Distribution of the delay between the capture points')
+    pcap.add_argument('--delay-ms', type=float, default=5.0, help='Mean delay in ms')
+    pcap.add_argument('--jitter-ms', type=float, default=2.0,
+                      help='Spread of the delay in ms (standard deviation, or half width for uniform)')
+    pcap.add_argument('--max-delay-ms', type=float, default=100.0, help='Delays are clipped to this many ms')
+    pcap.add_argument('--loss', type=float, default=0.0, help='Fraction of packets missing from the second capture')
+    pcap.add_argument('--id-space', type=int, default=65536,
+                      help='IP IDs count up modulo this; smaller values make them reused sooner')
+    pcap.add_argument('--payload-bytes', type=int, help='Fixed UDP payload size (default: random 18-1400)')
+    pcap.add_argument('--noise', type=float, default=0.0, help='Fraction of packets between other addresses')
+    pcap.add_argument('--source', default=DEFAULT_SOURCE)
+    pcap.add_argument('--destination', default=DEFAULT_DESTINATION)
+
+    log = commands.add_parser('log', help='Write a synthetic log in the logparse format')
+    log.add_argument('output')
+    log.add_argument('--size', type=parse_bytes, help='Bytes to write, e.g. 500M or 4G')
+    log.add_argument('--lines', type=parse_size, help='Entries to write, e.g. 10M')
+    log.add_argument('--seed', type=int, default=0)
+    log.add_argument('--severity-mix', type=parse_severity_mix, default=DEFAULT_SEVERITY_MIX,
+                     help=f'Relative weights of the severities (default: {DEFAULT_SEVERITY_MIX})')
+    log.add_argument('--lines-per-second', type=float, default=100.0, help='Mean entries per second of log time')
+    log.add_argument('--continuation', type=float, default=0.0,
+                     help='Fraction of entries followed by an untimestamped traceback')
+    log.add_argument('--disorder-seconds', type=int, default=0,
+                     help='Shift timestamps back by up to this many seconds')
+
+    runner = commands.add_parser('run', help='Benchmark the tools and compare against a baseline')
+    runner.add_argument('--scale', choices=list(SCALES), default='small',
+                        help=', '.join(f"{name}: {scale['packets']} packets, {scale['log_bytes'] // 1024 ** 2} MiB log"
+                                       for name, scale in SCALES.items()))
+    runner.add_argument('--packets', type=parse_size, help='Override the packets of the scale')
+    runner.add_argument('--log-size', type=parse_bytes, help='Override the log size of the scale')
+    runner.add_argument('--seed', type=int, default=0)
+    runner.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'benchmark-inputs'),
+                        help='Where generated inputs are kept between runs')
+    runner.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per case; the median is reported')
+    runner.add_argument('--only', nargs='+', help='Only run cases whose names contain one of these')
+    runner.add_argument('--output', help='Write the results as JSON, e.g. to use as a baseline')
+    runner.add_argument('--baseline', help='Results JSON to compare against; exits with 1 on a regression')
+    runner.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown against the baseline (default: 0.2 for 20%%)')
+    runner.add_argument('--rss-tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed growth of peak RSS against the baseline')
+
+    args = parser.parse_args()
+    if args.command == 'pcap':
+        stats = generate_pcaps(args.output1, args.output2, args.packets, args.seed, args.rate, args.delay,
+                               args.delay_ms, args.jitter_ms, args.max_delay_ms, args.loss, args.id_space,
+                               args.payload_bytes or (18, 1400), args.noise, args.source, args.destination)
+        print(json.dumps(stats))
+    elif args.command == 'log':
+        if args.size is None and args.lines is None:
+            parser.error('log needs --size or --lines')
+        print(json.dumps(generate_log(args.output, args.size, args.lines, args.seed, args.severity_mix,
+                                      args.lines_per_second, args.continuation, args.disorder_seconds)))
+    else:
+        sys.exit(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import unittest
+import os
+import re
+import struct
+import sys
+import tempfile
+from benchmark import generate_pcaps, generate_log, measure, compare, parse_size, parse_bytes, parse_severity_mix
+
+def read_pcap(path):
+    # (timestamp, IP ID, source, sequence number) of each packet.
+    packets = []
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 24
+    while offset < len(data):
+        seconds, micros, length, _ = struct.unpack_from('<IIII', data, offset)
+        frame = data[offset + 16:offset + 16 + length]
+        ip_id, = struct.unpack_from('!H', frame, 18)
+        sequence, = struct.unpack_from('!Q', frame, 42)
+        packets.append((seconds + micros / 1e6, ip_id, frame[26:30], sequence))
+        offset += 16 + length
+    return packets
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_generate_pcaps(self):
+        stats = generate_pcaps(self.path('a.pcap'), self.path('b.pcap'), 5000, seed=1, delay='uniform',
+                               delay_ms=10, jitter_ms=5, loss=0.1, id_space=1000, noise=0.2)
+        sent = read_pcap(self.path('a.pcap'))
+        received = read_pcap(self.path('b.pcap'))
+        self.assertEqual(len(sent), 5000)
+        self.assertEqual(stats['bytes'], [os.path.getsize(self.path('a.pcap')), os.path.getsize(self.path('b.pcap'))])
+        self.assertAlmostEqual(len(received) / len(sent), 0.9, delta=0.02)
+        # Both captures are in time order, and IP IDs wrap at id_space.
+        for packets in (sent, received):
+            self.assertEqual([packet[0] for packet in packets], sorted(packet[0] for packet in packets))
+        self.assertEqual({packet[1] for packet in sent}, set(range(1000)))
+
+        sent_times = {packet[3]: packet[0] for packet in sent}
+        delays = [(time - sent_times[sequence]) * 1000 for time, _, _, sequence in received]
+        self.assertGreaterEqual(min(delays), 5 - 0.002)
+        self.assertLessEqual(max(delays), 15 + 0.002)
+        self.assertAlmostEqual(sum(delays) / len(delays), 10, delta=0.3)
+        self.assertEqual(stats['matched'], sum(1 for packet in received if packet[2] == bytes((192, 168, 1, 1))))
+
+        # The same arguments write the same bytes.
+        generate_pcaps(self.path('c.pcap'), self.path('d.pcap'), 5000, seed=1, delay='uniform', delay_ms=10,
+                       jitter_ms=5, loss=0.1, id_space=1000, noise=0.2)
+        for first, second in (('a.pcap', 'c.pcap'), ('b.pcap', 'd.pcap')):
+            with open(self.path(first), 'rb') as file1, open(self.path(second), 'rb') as file2:
+                self.assertEqual(file1.read(), file2.read())
+
+    def test_generate_log(self):
+        stats = generate_log(self.path('app.log'), size_bytes=200000, seed=3,
+                             severity_mix={'INFO': 3, 'ERROR': 1}, continuation=0.1)
+        with open(self.path('app.log')) as file:
+            lines = file.read().splitlines()
+        self.assertGreaterEqual(stats['bytes'], 200000)
+        self.assertEqual(stats['bytes'], os.path.getsize(self.path('app.log')))
+        entries = [re.match(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) ([A-Z]+): ', line) for line in lines]
+        entries = [entry for entry in entries if entry]
+        self.assertEqual(len(entries), stats['entries'])
+        self.assertLess(len(entries), len(lines))
+        self.assertEqual([entry.group(1) for entry in entries], sorted(entry.group(1) for entry in entries))
+        errors = sum(1 for entry in entries if entry.group(2) == 'ERROR')
+        self.assertAlmostEqual(errors / len(entries), 0.25, delta=0.03)
+
+        generate_log(self.path('again.log'), lines=stats['entries'], seed=3, severity_mix={'INFO': 3, 'ERROR': 1},
+                     continuation=0.1)
+        with open(self.path('again.log')) as file:
+            self.assertEqual(file.read().splitlines(), lines)
+
+    def test_measure_and_compare(self):
+        result = measure([sys.executable, '-c', 'bytearray(50 * 1024 * 1024)'], repeat=2)
+        self.assertEqual(len(result['seconds']), 2)
+        self.assertGreater(result['peak_rss_bytes'], 50 * 1024 * 1024)
+        with self.assertRaises(RuntimeError):
+            measure([sys.executable, '-c', 'raise SystemExit(3)'], repeat=1)
+
+        baseline = {'count': {'median_seconds': 1.0, 'peak_rss_bytes': 100},
+                    'first': {'median_seconds': 1.0, 'peak_rss_bytes': 100}}
+        results = {'count': {'median_seconds': 1.1, 'peak_rss_bytes': 150},
+                   'first': {'median_seconds': 1.5, 'peak_rss_bytes': 100},
+                   'new': {'median_seconds': 9.0, 'peak_rss_bytes': 900}}
+        self.assertEqual(compare(results, baseline, tolerance=0.2, rss_tolerance=0.2),
+                         [('count', 'peak_rss_bytes', 100, 150), ('first', 'median_seconds', 1.0, 1.5)])
+
+    def test_parse_sizes(self):
+        self.assertEqual(parse_size('10k'), 10000)
+        self.assertEqual(parse_size('50M'), 50000000)
+        self.assertEqual(parse_bytes('2G'), 2 * 1024 ** 3)
+        self.assertEqual(parse_severity_mix('info=70,ERROR=5'), {'INFO': 70.0, 'ERROR': 5.0})
+
+if __name__ == '__main__':
+    unittest.main()
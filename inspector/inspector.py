@@ -1,23 +1,418 @@
 import argparse
-from scapy.all import rdpcap
+import bz2
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import ipaddress
+import lzma
+import math
 import numpy as np
 import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# The --stats, --profile and --trace-memory instrumentation is shared with logparse.
+RUNSTATS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'runstats')
+if RUNSTATS_DIR not in sys.path:
+    sys.path.insert(0, RUNSTATS_DIR)
+from runstats import RunStats, instrumented
+
+# Only the fields later stages need; keeping these instead of whole scapy
+# packets is what lets large captures be processed in constant memory.
+# Addresses are kept as integers (see address_to_int) so filters compare ints.
+# Ports are 0 for protocols without them and for non-first fragments. digest is
+# a CRC of the start of the IP payload, which routers along the path leave alone.
+PacketRecord = namedtuple('PacketRecord', ['time', 'src', 'dst', 'ip_id', 'proto', 'fragment', 'sport', 'dport',
+                                           'digest', 'length'])
+
+# Columnar form of PacketRecord. 128-bit addresses are split into two words.
+PACKET_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('src_hi', '<u8'), ('src_lo', '<u8'),
+    ('dst_hi', '<u8'), ('dst_lo', '<u8'),
+    ('ip_id', '<u4'),
+    ('proto', 'u1'),
+    ('fragment', '?'),
+    ('sport', '<u2'), ('dport', '<u2'),
+    ('digest', '<u4'),
+    ('length', '<u4'),
+])
+TABLE_MAGIC = b'INSPTBL2'
+TABLE_HEADER = struct.Struct('<8sQ')
+TABLE_CHUNK_ROWS = 65536
+# Packets at two capture points are considered the same packet when all of
+# these agree (see match_within_window).
+MATCH_KEY_COLUMNS = ('ip_id', 'src_hi', 'src_lo', 'dst_hi', 'dst_lo', 'proto', 'digest')
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+# Window used to follow packets across more than two capture points when
+# --max-delay is not given, in ms.
+DEFAULT_HOP_WINDOW = 1000
+# Flow mode: entries kept by each heavy-hitter summary, and how many of the
+# heaviest are printed when --top is not given.
+DEFAULT_FLOW_CAPACITY = 100000
+DEFAULT_FLOW_TOP = 10
+# Follow mode: seconds between printed updates, and the most bytes decoded
+# from one capture per poll.
+DEFAULT_FOLLOW_INTERVAL = 5
+FOLLOW_READ_BYTES = 16 * 1024 * 1024
+# A capture that has written nothing new for this many seconds of wall-clock
+# time stops holding back the other capture's packets in follow mode.
+FOLLOW_QUIET_SECONDS = 30
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'inspector')
+# --geo reads the offline country database of ipfind, which sits next to inspector.
+IPFIND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'ipfind')
+# Filled in by the stages of a run when --stats is given.
+STATS = RunStats('packets')
+
+# Classic pcap magic numbers: byte order and timestamp fraction units per second.
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000000),
+    b'\xa1\xb2\xc3\xd4': ('>', 1000000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1000000000),
+    b'\xa1\xb2\x3c\x4d': ('>', 1000000000),
+}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+# pcapng block types and the interface description options we use.
+PCAPNG_OPB = 2
+PCAPNG_SPB = 3
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_OPT_TSRESOL = 9
+PCAPNG_OPT_TSOFFSET = 14
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+CAPTURE_FORMATS = ['.pcap', '.cap', '.pcapng']
+# tcpdump -C numbers the files after the first one: cap.pcap, cap.pcap1, cap.pcap2, ...
+CAPTURE_NAME = re.compile('(' + '|'.join(re.escape(fmt) for fmt in CAPTURE_FORMATS) + r')\d*$')
+# Compressed captures are decompressed on the fly by a background thread.
+COMPRESSED_FORMATS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+DECOMPRESS_QUEUE_CHUNKS = 8
+
+# A large pcap is split into byte ranges of at least this size for parallel
+# decoding; each worker gets a few ranges so uneven ones balance out.
+MIN_SPLIT_BYTES = 32 * 1024 * 1024
+RANGES_PER_WORKER = 4
+# Ranges of one capture decoding or waiting to be written, per worker. The
+# parent holds no more than this many range tables of a capture at a time.
+RANGES_AHEAD_PER_WORKER = 2
+# How far past a rough split point to look for a record boundary, and how many
+# consecutive plausible record headers it takes to trust one.
+RESYNC_WINDOW = 4 * 1024 * 1024
+RESYNC_CHAIN = 8
+MAX_RECORD_BYTES = 1 << 20
+
+DECODED_LINKTYPES = {LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LOOP,
+                     LINKTYPE_LINUX_SLL, LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_LINUX_SLL2}
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+VLAN_ETHERTYPES = {0x8100, 0x88a8, 0x9100}
+IPV6_FAMILIES = {10, 24, 28, 30}
+IPV6_EXTENSION_HEADERS = {0, 43, 44, 51, 60}
+
+# Scapy layer names that can be answered from the IP protocol number alone.
+# Any other --protocol value is checked by dissecting the packet with scapy.
+PROTOCOL_NUMBERS = {'ICMP': 1, 'TCP': 6, 'UDP': 17, 'GRE': 47, 'ESP': 50, 'AH': 51, 'SCTP': 132}
+PROTOCOL_NAMES = {number: name for name, number in PROTOCOL_NUMBERS.items()}
+PORT_PROTOCOLS = {6, 17, 132}
+
+DIGEST_BYTES = 32
+
+IPV4_MAPPED = 0xffff << 32
+MASK64 = (1 << 64) - 1
+
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_IPV4_HEADER = struct.Struct('!BBHHHBBHII')
 
 class ArgumentException(Exception):
     """Custom exception for argument errors."""
     pass
 
-def analyze_file(file_path, source=None, destination=None, protocol=None):
+class RecordBoundaryError(ValueError):
+    """A byte range of a split capture does not end on a record boundary."""
+    pass
+
+class BackgroundDecompressor(io.RawIOBase):
+    """Read-only stream of a compressed file, decompressed by a background thread.
+
+    The thread stays up to DECOMPRESS_QUEUE_CHUNKS chunks ahead of the reader,
+    so decompression overlaps with decoding. Wrap it in io.BufferedReader for
+    small reads.
+    """
+
+    def __init__(self, file_path, opener):
+        self.source = opener(file_path, 'rb')
+        self.chunks = queue.Queue(DECOMPRESS_QUEUE_CHUNKS)
+        self.stopped = threading.Event()
+        self.pending = memoryview(b'')
+        self.done = False
+        self.thread = threading.Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def _decompress(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.source.read(DECOMPRESS_CHUNK_BYTES)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # Gives up once the reader is closed instead of blocking on a full queue.
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and not self.done:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.done = True
+                raise chunk
+            if not chunk:
+                self.done = True
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.source.close()
+        super().close()
+
+class CaptureFollower:
+    """Reads the records appended to a growing pcap since the last poll.
+
+    path may be a file, a directory or a glob of rotated captures. Following
+    starts at the newest file. When that file stops growing and a newer one
+    appears, the follower moves on to it. Only complete records are consumed;
+    a partly written record is picked up by the next poll.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.current = None
+        self.inode = None
+        self.offset = 0
+        self.header = None
+
+    def _open(self, file_path):
+        self.current = file_path
+        self.inode = None
+        self.offset = 0
+        self.header = None
+
+    def _read_new(self):
+        try:
+            stat = os.stat(self.current)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # First look at this file, or it was replaced or truncated.
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.header = None
+
+        with open(self.current, 'rb') as file:
+            if self.header is None:
+                header = file.read(24)
+                if len(header) < 24:
+                    return []
+                if header[:4] not in PCAP_MAGIC:
+                    raise ValueError(f"{self.current}: only pcap files can be followed")
+                endian, scale = PCAP_MAGIC[header[:4]]
+                linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+                self.header = (struct.Struct(endian + 'IIII'), scale, linktype)
+                self.offset = 24
+
+            file.seek(self.offset)
+            data = file.read(min(stat.st_size - self.offset, FOLLOW_READ_BYTES))
+        STATS.add_input_bytes(len(data))
+
+        record_header, scale, linktype = self.header
+        records = []
+        offset = 0
+        while offset + 16 <= len(data):
+            sec, frac, caplen, wirelen = record_header.unpack_from(data, offset)
+            if offset + 16 + caplen > len(data):
+                break
+            records.append(((sec * scale + frac) / scale, wirelen, linktype, data[offset + 16:offset + 16 + caplen]))
+            offset += 16 + caplen
+        self.offset += offset
+        return records
+
+    def poll(self):
+        # Returns raw (timestamp, wire_length, linktype, data) records.
+        records = []
+        while True:
+            if self.current is None:
+                files = expand_capture_paths(self.path)
+                files = [file_path for file_path in files if os.path.exists(file_path)]
+                if not files:
+                    return records
+                self._open(files[-1])
+
+            new_records = self._read_new()
+            records.extend(new_records)
+            if new_records:
+                continue
+
+            current_key = _natural_key(self.current)
+            newer = [file_path for file_path in expand_capture_paths(self.path)
+                     if _natural_key(file_path) > current_key and os.path.exists(file_path)]
+            if not newer:
+                return records
+            self._open(newer[0])
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter summary over at most capacity keys.
+
+    While fewer than capacity keys have been seen the counts are exact. After
+    that a new key takes over the smallest entry and inherits its weight as
+    an error bound, so every reported weight overestimates the true one by at
+    most its error, and any key heavier than total / capacity is kept.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        self.heap = []
+        self.total = 0
+
+    def add(self, key, weight, packets=1, time=None):
+        # Each entry is [weight, error, packets, first time, last time].
+        self.total += weight
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += weight
+            entry[2] += packets
+            entry[4] = time
+            return
+        error = 0
+        if len(self.entries) >= self.capacity:
+            error = self._evict()
+        self.entries[key] = [error + weight, error, packets, time, time]
+        heapq.heappush(self.heap, (error + weight, key))
+
+    def _evict(self):
+        # Heap entries are not updated when weights grow; an outdated one is
+        # pushed back with its current weight until the true minimum surfaces.
+        while True:
+            weight, key = heapq.heappop(self.heap)
+            current = self.entries[key][0]
+            if current == weight:
+                del self.entries[key]
+                return weight
+            heapq.heappush(self.heap, (current, key))
+
+    def top(self, n):
+        # (key, [weight, error, packets, first time, last time]) heaviest first.
+        return heapq.nlargest(n, self.entries.items(), key=lambda item: item[1][0])
+
+class WindowedMatcher:
+    """Pairs packets seen at two capture points that share a key and lie within
+    max_delay seconds of each other.
+
+    Packets must be added in time order. Only packets still inside the window
+    are kept, so memory follows the window rather than the capture.
+    """
+
+    def __init__(self, max_delay):
+        self.max_delay = max_delay
+        self.pending = ({}, {})
+        self.arrivals = (deque(), deque())
+
+    def expire(self, now):
+        limit = now - self.max_delay
+        for pending, arrivals in zip(self.pending, self.arrivals):
+            while arrivals and arrivals[0][0] < limit:
+                time, key = arrivals.popleft()
+                times = pending.get(key)
+                if times and times[0] == time:
+                    times.popleft()
+                    if not times:
+                        del pending[key]
+
+    def add(self, side, key, time):
+        # Returns (time at the first capture point, time at the second) when this
+        # packet completes a pair, otherwise None.
+        self.expire(time)
+        other_pending = self.pending[1 - side]
+        times = other_pending.get(key)
+        if times:
+            other_time = times.popleft()
+            if not times:
+                del other_pending[key]
+            return (time, other_time) if side == 0 else (other_time, time)
+        self.pending[side].setdefault(key, deque()).append(time)
+        self.arrivals[side].append((time, key))
+        return None
+
+def address_to_int(address):
+    ip = ipaddress.ip_address(address)
+    if ip.version == 4:
+        return IPV4_MAPPED | int(ip)
+    return int(ip)
+
+def int_to_address(value):
+    if value >> 32 == 0xffff:
+        return str(ipaddress.IPv4Address(value & 0xffffffff))
+    return str(ipaddress.IPv6Address(value))
+
+# scapy is imported where it is used: loading it takes longer than answering
+# a query from a cached packet table.
+
+def read_packets(file_path):
+    from scapy.all import PcapReader
+
     try:
-        packets = rdpcap(file_path)
+        reader = PcapReader(file_path)
     except FileNotFoundError:
         print(f"File not found: {file_path}")
-        return []
+        return
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
-        return []
+        return
 
-    packet_info = []
+    with reader:
+        try:
+            for packet in reader:
+                yield packet
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+
+def filter_packets(packets, source=None, destination=None, protocol=None):
     for packet in packets:
         if packet.haslayer('IP'):
             if source and packet['IP'].src != source:
@@ -26,126 +421,1465 @@ def analyze_file(file_path, source=None, destination=None, protocol=None):
                 continue
             if protocol and not packet.haslayer(protocol):
                 continue
-            packet_info.append(packet)
+            yield packet
+
+def _read_pcap_records(file, magic, start=None, end=None):
+    # start/end, when given, must be record boundaries (see split_capture);
+    # a record running past end shows that end is not one.
+    endian, scale = PCAP_MAGIC[magic]
+    header = file.read(20)
+    if len(header) < 20:
+        return
+    linktype = struct.unpack(endian + 'I', header[16:20])[0] & 0x0fffffff
+    record_header = struct.Struct(endian + 'IIII')
+    if start is not None:
+        file.seek(start)
+    # Compressed streams cannot tell(), so the position is tracked by hand.
+    position = 24 if start is None else start
+    read = file.read
+    while end is None or position < end:
+        head = read(16)
+        if len(head) < 16:
+            break
+        sec, frac, caplen, wirelen = record_header.unpack(head)
+        data = read(caplen)
+        if len(data) < caplen:
+            break
+        position += 16 + caplen
+        if end is not None and position > end:
+            raise RecordBoundaryError(f"a record crosses offset {end}")
+        yield (sec * scale + frac) / scale, wirelen, linktype, data
+
+def _pcapng_interface(body, endian):
+    # (linktype, snaplen, ticks per second, offset in seconds) from an interface description.
+    linktype, _, snaplen = struct.unpack_from(endian + 'HHI', body)
+    ticks, offset = 1000000, 0
+    position = 8
+    while position + 4 <= len(body):
+        code, length = struct.unpack_from(endian + 'HH', body, position)
+        if code == 0:
+            break
+        value = body[position + 4:position + 4 + length]
+        if code == PCAPNG_OPT_TSRESOL and length >= 1:
+            # High bit set: a negative power of two, otherwise of ten.
+            ticks = 2 ** (value[0] & 0x7f) if value[0] & 0x80 else 10 ** value[0]
+        elif code == PCAPNG_OPT_TSOFFSET and length >= 8:
+            offset = struct.unpack(endian + 'q', value[:8])[0]
+        position += 4 + (length + 3) // 4 * 4
+    return linktype, snaplen, ticks, offset
+
+def _read_pcapng_records(file):
+    # The block type of the first section header has already been read. Each
+    # section header sets the byte order and starts a new list of interfaces.
+    interfaces = []
+    endian = '<'
+    block_type = PCAPNG_MAGIC
+    timestamp = 0.0
+    while True:
+        if block_type == PCAPNG_MAGIC:
+            head = file.read(8)
+            if len(head) < 8:
+                return
+            if struct.unpack('<I', head[4:])[0] == PCAPNG_BYTE_ORDER:
+                endian = '<'
+            elif struct.unpack('>I', head[4:])[0] == PCAPNG_BYTE_ORDER:
+                endian = '>'
+            else:
+                raise ValueError("bad pcapng byte-order magic")
+            length = struct.unpack(endian + 'I', head[:4])[0]
+            if length < 28 or len(file.read(length - 12)) < length - 12:
+                return
+            interfaces = []
+        else:
+            head = file.read(4)
+            if len(head) < 4:
+                return
+            length = struct.unpack(endian + 'I', head)[0]
+            if length < 12 or length % 4:
+                raise ValueError(f"bad pcapng block length {length}")
+            body = file.read(length - 8)
+            if len(body) < length - 8:
+                return
+            block = struct.unpack(endian + 'I', block_type)[0]
+            if block == PCAPNG_EPB:
+                interface, high, low, caplen, wirelen = struct.unpack_from(endian + 'IIIII', body)
+                linktype, _, ticks, offset = interfaces[interface]
+                timestamp = ((high << 32) | low) / ticks + offset
+                yield timestamp, wirelen, linktype, body[20:20 + caplen]
+            elif block == PCAPNG_SPB:
+                # Simple packets carry no timestamp; they inherit the last one seen.
+                wirelen = struct.unpack_from(endian + 'I', body)[0]
+                linktype, snaplen, _, _ = interfaces[0]
+                caplen = min(wirelen, snaplen or wirelen, len(body) - 8)
+                yield timestamp, wirelen, linktype, body[4:4 + caplen]
+            elif block == PCAPNG_OPB:
+                interface, _, high, low, caplen, wirelen = struct.unpack_from(endian + 'HHIIII', body)
+                linktype, _, ticks, offset = interfaces[interface]
+                timestamp = ((high << 32) | low) / ticks + offset
+                yield timestamp, wirelen, linktype, body[20:20 + caplen]
+            elif block == PCAPNG_IDB:
+                interfaces.append(_pcapng_interface(body[:-4], endian))
+        block_type = file.read(4)
+        if len(block_type) < 4:
+            return
+
+def compression_opener(file_path):
+    # The decompressing open() for a compressed capture, or None.
+    return COMPRESSED_FORMATS.get(os.path.splitext(file_path)[1].lower())
+
+def is_capture_file(file_path):
+    name = file_path.lower()
+    if compression_opener(name):
+        name = os.path.splitext(name)[0]
+    return CAPTURE_NAME.search(name) is not None
+
+def is_pcap_file(file_path):
+    # True for an uncompressed classic pcap, the only format CaptureFollower reads.
+    if compression_opener(file_path):
+        return False
+    with open(file_path, 'rb') as file:
+        return file.read(4) in PCAP_MAGIC
+
+def open_capture(file_path):
+    opener = compression_opener(file_path)
+    if opener is None:
+        return open(file_path, 'rb')
+    return io.BufferedReader(BackgroundDecompressor(file_path, opener), DECOMPRESS_CHUNK_BYTES)
+
+def read_records(file_path):
+    # Yields (timestamp, wire_length, linktype, raw_bytes) without dissecting anything.
+    with open_capture(file_path) as file:
+        magic = file.read(4)
+        if magic in PCAP_MAGIC:
+            yield from _read_pcap_records(file, magic)
+        elif magic == PCAPNG_MAGIC:
+            yield from _read_pcapng_records(file)
+        else:
+            raise ValueError("not a pcap or pcapng file")
+
+def read_record_range(file_path, start, end):
+    with open(file_path, 'rb') as file:
+        magic = file.read(4)
+        if magic not in PCAP_MAGIC:
+            raise ValueError("only pcap files can be read by byte range")
+        yield from _read_pcap_records(file, magic, start, end)
+
+def _is_record_chain(data, offset, record_header, scale, at_eof, first_sec):
+    # True when offset starts a run of plausible pcap record headers. Empty
+    # records and ones from well before the first record of the file are not
+    # plausible, which keeps runs of zero bytes in payloads from passing.
+    previous_sec = None
+    for validated in range(RESYNC_CHAIN):
+        if offset + 16 > len(data):
+            # The chain ran off the buffer: at the end of the file it must end
+            # exactly there, elsewhere a shorter chain is trusted.
+            if at_eof:
+                return validated > 0 and offset == len(data)
+            return validated >= 2
+        sec, frac, caplen, wirelen = record_header.unpack_from(data, offset)
+        if frac >= scale or caplen == 0 or caplen > wirelen or wirelen > MAX_RECORD_BYTES:
+            return False
+        if sec < first_sec - 3600:
+            return False
+        if previous_sec is not None and abs(sec - previous_sec) > 3600:
+            return False
+        previous_sec = sec
+        offset += 16 + caplen
+    return True
+
+def split_capture(file_path, parts):
+    # Record-aligned (start, end) byte ranges covering every record of a pcap,
+    # or None when the file cannot be split (pcapng, compressed, or too small
+    # to bother).
+    if compression_opener(file_path):
+        return None
+    size = os.path.getsize(file_path)
+    parts = min(parts, size // MIN_SPLIT_BYTES)
+    with open(file_path, 'rb') as file:
+        magic = file.read(4)
+        if magic not in PCAP_MAGIC or parts < 2:
+            return None
+        endian, scale = PCAP_MAGIC[magic]
+        record_header = struct.Struct(endian + 'IIII')
+        file.seek(24)
+        first = file.read(record_header.size)
+        if len(first) < record_header.size:
+            return None
+        first_sec = record_header.unpack(first)[0]
+
+        boundaries = [24]
+        for part in range(1, parts):
+            rough = 24 + (size - 24) * part // parts
+            file.seek(rough)
+            data = file.read(RESYNC_WINDOW)
+            at_eof = rough + len(data) >= size
+            start = next((rough + offset for offset in range(len(data))
+                          if _is_record_chain(data, offset, record_header, scale, at_eof, first_sec)), None)
+            if start is None:
+                return None
+            if start > boundaries[-1]:
+                boundaries.append(start)
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def expand_capture_paths(path):
+    # A capture point is a file, a directory of rotated captures or a glob;
+    # the files come back in natural order (capture2 before capture10, and
+    # cap.pcap, cap.pcap1, cap.pcap2, ... for tcpdump -C).
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in os.listdir(path) if is_capture_file(name)]
+    elif glob.has_magic(path):
+        files = [name for name in glob.glob(path) if os.path.isfile(name)]
+    else:
+        return [path]
+    return sorted(files, key=_natural_key)
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def _decode_ports(data, offset, proto, fragment):
+    if fragment or proto not in PORT_PROTOCOLS or len(data) < offset + 4:
+        return 0, 0
+    return _U16.unpack_from(data, offset)[0], _U16.unpack_from(data, offset + 2)[0]
+
+def _payload_digest(data, offset, end):
+    # Bounded by the IP length so link-layer padding never changes the digest.
+    return zlib.crc32(data[offset:min(end, offset + DIGEST_BYTES)])
+
+def _decode_ipv4(data, offset):
+    if len(data) < offset + 20:
+        return None
+    version_ihl, _, total_length, ip_id, flags_fragment, _, proto, _, src, dst = _IPV4_HEADER.unpack_from(data, offset)
+    fragment = flags_fragment & 0x1fff != 0
+    payload = offset + (version_ihl & 0x0f) * 4
+    sport, dport = _decode_ports(data, payload, proto, fragment)
+    digest = _payload_digest(data, payload, offset + total_length)
+    return IPV4_MAPPED | src, IPV4_MAPPED | dst, ip_id, proto, fragment, sport, dport, digest
+
+def _decode_ipv6(data, offset):
+    if len(data) < offset + 40:
+        return None
+    next_header = data[offset + 6]
+    end = offset + 40 + _U16.unpack_from(data, offset + 4)[0]
+    src = int.from_bytes(data[offset + 8:offset + 24], 'big')
+    dst = int.from_bytes(data[offset + 24:offset + 40], 'big')
+    offset += 40
+    ip_id = 0
+    fragment = False
+    while next_header in IPV6_EXTENSION_HEADERS and len(data) >= offset + 8:
+        if next_header == 44:
+            fragment = _U16.unpack_from(data, offset + 2)[0] >> 3 != 0
+            ip_id = _U32.unpack_from(data, offset + 4)[0]
+            length = 8
+        elif next_header == 51:
+            length = (data[offset + 1] + 2) * 4
+        else:
+            length = (data[offset + 1] + 1) * 8
+        next_header = data[offset]
+        offset += length
+    sport, dport = _decode_ports(data, offset, next_header, fragment)
+    digest = _payload_digest(data, offset, end)
+    return src, dst, ip_id, next_header, fragment, sport, dport, digest
+
+def decode_ip(linktype, data):
+    # Returns (src, dst, ip_id, proto, fragment, sport, dport, digest) straight
+    # from the header bytes, or None when the frame does not carry IPv4/IPv6.
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        ethertype = _U16.unpack_from(data, 12)[0]
+        offset = 14
+        while ethertype in VLAN_ETHERTYPES and len(data) >= offset + 4:
+            ethertype = _U16.unpack_from(data, offset + 2)[0]
+            offset += 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None
+        ethertype = ETHERTYPE_IPV6 if data[0] >> 4 == 6 else ETHERTYPE_IPV4
+        offset = 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        ethertype = _U16.unpack_from(data, 14)[0]
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return None
+        ethertype = _U16.unpack_from(data, 0)[0]
+        offset = 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if len(data) < 4:
+            return None
+        # The family is in the capturing host's byte order; either end holds it.
+        family = data[0] | data[3]
+        ethertype = ETHERTYPE_IPV6 if family in IPV6_FAMILIES else ETHERTYPE_IPV4 if family == 2 else None
+        offset = 4
+    else:
+        return None
+
+    if ethertype == ETHERTYPE_IPV4:
+        return _decode_ipv4(data, offset)
+    if ethertype == ETHERTYPE_IPV6:
+        return _decode_ipv6(data, offset)
+    return None
+
+def dissect(linktype, data):
+    from scapy.all import conf
+
+    return conf.l2types.get(linktype, conf.raw_layer)(data)
+
+def dissect_ip(linktype, data):
+    packet = dissect(linktype, data)
+    if not packet.haslayer('IP'):
+        return None
+    ip = packet['IP']
+    fragment = ip.frag != 0
+    sport = getattr(ip.payload, 'sport', 0) if not fragment else 0
+    dport = getattr(ip.payload, 'dport', 0) if not fragment else 0
+    digest = zlib.crc32(bytes(ip.payload)[:DIGEST_BYTES])
+    return address_to_int(ip.src), address_to_int(ip.dst), ip.id, ip.proto, fragment, sport, dport, digest
+
+def filter_records(raw_records, source=None, destination=None, protocol=None):
+    # Decodes raw (timestamp, wire_length, linktype, data) records and yields
+    # the PacketRecords that pass the filters.
+    source = address_to_int(source) if source else None
+    destination = address_to_int(destination) if destination else None
+    protocol_number = PROTOCOL_NUMBERS.get(protocol)
+
+    for timestamp, length, linktype, data in raw_records:
+        if linktype in DECODED_LINKTYPES:
+            fields = decode_ip(linktype, data)
+        else:
+            fields = dissect_ip(linktype, data)
+        if fields is None:
+            continue
+        src, dst, ip_id, proto, fragment, sport, dport, digest = fields
+        if source is not None and src != source:
+            continue
+        if destination is not None and dst != destination:
+            continue
+        if protocol:
+            if protocol_number is not None:
+                if proto != protocol_number or fragment:
+                    continue
+            elif not dissect(linktype, data).haslayer(protocol):
+                continue
+        yield PacketRecord(timestamp, src, dst, ip_id, proto, fragment, sport, dport, digest, length)
+
+def stream_packets(file_path, source=None, destination=None, protocol=None):
+    try:
+        yield from filter_records(read_records(file_path), source, destination, protocol)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+
+def _table_rows(records):
+    for record in records:
+        yield (record.time, record.src >> 64, record.src & MASK64, record.dst >> 64, record.dst & MASK64,
+               record.ip_id, record.proto, record.fragment, record.sport, record.dport, record.digest, record.length)
+
+def iter_table_chunks(records):
+    rows = []
+    for row in _table_rows(records):
+        rows.append(row)
+        if len(rows) == TABLE_CHUNK_ROWS:
+            yield np.array(rows, dtype=PACKET_DTYPE)
+            rows = []
+    if rows:
+        yield np.array(rows, dtype=PACKET_DTYPE)
+
+def build_packet_table(records):
+    return build_packet_table_from_chunks(iter_table_chunks(records))
+
+def table_addresses(table, column):
+    return [int_to_address((int(hi) << 64) | int(lo)) for hi, lo in zip(table[column + '_hi'], table[column + '_lo'])]
+
+def open_country_database(path):
+    if IPFIND_DIR not in sys.path:
+        sys.path.insert(0, IPFIND_DIR)
+    from ipfind import CountryDatabase
+    return CountryDatabase(path)
+
+def table_countries(table, column, database):
+    # Country codes of one address column of a packet table, as an array of
+    # bytes (b'' when unknown), in one vectorized lookup.
+    return database.lookup_words(table[column + '_hi'], table[column + '_lo'])
+
+def address_countries(addresses, database):
+    # Country codes of integer addresses ('??' when unknown).
+    countries = database.lookup_words(np.array([address >> 64 for address in addresses], dtype=np.uint64),
+                                      np.array([address & MASK64 for address in addresses], dtype=np.uint64))
+    return [country.decode() or '??' for country in countries.tolist()]
+
+def country_counts(table, column, database):
+    # [(country, packets)] for one address column, most packets first.
+    countries, counts = np.unique(table_countries(table, column, database), return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    return [(countries[i].decode() or '??', int(counts[i])) for i in order]
+
+def _print_addresses(table, column, geo):
+    addresses = table_addresses(table, column)
+    if geo is None:
+        for address in addresses:
+            print(address)
+        return
+    for address, country in zip(addresses, table_countries(table, column, geo).tolist()):
+        print(f"{address} ({country.decode() or '??'})")
+
+def cache_path(file_path, cache_dir=None):
+    # Named <capture>.<path hash>.<size/mtime hash>.pkt, so a rewritten capture
+    # never hits a stale table and older tables of the same capture are easy to find.
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    path_digest = hashlib.sha1(file_path.encode()).hexdigest()[:12]
+    stat_digest = hashlib.sha1(f"{stat.st_size}\0{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+    name = f"{os.path.basename(file_path)}.{path_digest}.{stat_digest}.pkt"
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, name)
+
+def read_packet_table(path):
+    with open(path, 'rb') as file:
+        magic, rows = TABLE_HEADER.unpack(file.read(TABLE_HEADER.size))
+    if magic != TABLE_MAGIC:
+        raise ValueError(f"{path} is not a packet table")
+    if rows == 0:
+        return np.zeros(0, dtype=PACKET_DTYPE)
+    return np.memmap(path, dtype=PACKET_DTYPE, mode='r', offset=TABLE_HEADER.size, shape=(rows,))
+
+def write_packet_table(path, chunks):
+    # Rows are streamed to disk chunk by chunk, so building the cache never
+    # holds more than one chunk of the capture in memory.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(TABLE_HEADER.pack(TABLE_MAGIC, 0))
+            rows = 0
+            for chunk in chunks:
+                chunk.tofile(file)
+                rows += len(chunk)
+            file.seek(0)
+            file.write(TABLE_HEADER.pack(TABLE_MAGIC, rows))
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    prefix = os.path.basename(path).rsplit('.', 2)[0] + '.'
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(prefix) and name.endswith('.pkt') and name != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), name))
+
+def _table_records(file_path, start=None, end=None):
+    # Unlike stream_packets, read errors propagate so a partial table is never cached.
+    if start is None:
+        raw_records = read_records(file_path)
+    else:
+        raw_records = read_record_range(file_path, start, end)
+    yield from filter_records(raw_records)
+
+def decode_range(file_path, start=None, end=None):
+    # Worker entry point: one byte range (or the whole file) as a packet table.
+    return build_packet_table(_table_records(file_path, start, end))
+
+class RangeDecoder:
+    """Decodes the byte ranges of one capture in a process pool.
+
+    Only the first few ranges are submitted up front; each range taken from
+    tables() makes room for the next one, so finished tables do not pile up
+    in the parent while it writes them out.
+    """
+
+    def __init__(self, executor, file_path, ranges, ahead):
+        self.executor = executor
+        self.file_path = file_path
+        self.ranges = ranges
+        self.ahead = ahead
+        self.running = self._start()
+
+    def _start(self):
+        self.waiting = deque(self.ranges)
+        running = deque()
+        while self.waiting and len(running) < self.ahead:
+            self._submit_next(running)
+        return running
+
+    def _submit_next(self, running):
+        start, end = self.waiting.popleft()
+        running.append((start, self.executor.submit(decode_range, self.file_path, start, end)))
+
+    def tables(self):
+        # The range tables in file order. Each range is read up to where the
+        # next one starts, so a false resync point shows up as a record
+        # crossing a range end; the rest of the file is then decoded here in
+        # one piece. Calling tables() again decodes the ranges again.
+        running, self.running = self.running, None
+        if running is None:
+            running = self._start()
+        while running:
+            start, future = running.popleft()
+            try:
+                table = future.result()
+            except RecordBoundaryError:
+                for _, other in running:
+                    other.cancel()
+                self.waiting.clear()
+                yield from iter_table_chunks(_table_records(self.file_path, start, None))
+                return
+            if self.waiting:
+                self._submit_next(running)
+            yield table
+
+def stream_table(file_path, source=None, destination=None, protocol=None):
+    return build_packet_table(stream_packets(file_path, source, destination, protocol))
+
+def _cached_packet_table(file_path, cache_dir):
+    path = cache_path(file_path, cache_dir)
+    if os.path.exists(path):
+        try:
+            table = read_packet_table(path)
+        except (OSError, ValueError):
+            return None
+        STATS.add_input_bytes(table.nbytes)
+        return table
+    return None
+
+def _table_error(file_path, error):
+    if isinstance(error, FileNotFoundError):
+        print(f"File not found: {file_path}")
+    else:
+        print(f"Error reading {file_path}: {error}")
+    return np.zeros(0, dtype=PACKET_DTYPE)
 
-    return packet_info
+def _store_packet_table(file_path, cache_dir, build_chunks):
+    # Writes the table to the cache and maps it back. When the cache cannot be
+    # written (read-only, full, not a directory) the partial file is removed by
+    # write_packet_table and the table is built in memory instead.
+    read_failed = []
 
-def calculate_delays(file1_path, file2_path, source, destination, protocol=None):
-    packets1 = analyze_file(file1_path, source, destination, protocol)
-    packets2 = analyze_file(file2_path, source, destination, protocol)
+    def chunks():
+        try:
+            yield from build_chunks()
+        except Exception:
+            read_failed.append(True)
+            raise
 
-    if not packets1 or not packets2:
+    try:
+        path = cache_path(file_path, cache_dir)
+        write_packet_table(path, chunks())
+        return read_packet_table(path)
+    except OSError as e:
+        if read_failed or not os.path.exists(file_path):
+            return _table_error(file_path, e)
+    except Exception as e:
+        return _table_error(file_path, e)
+    try:
+        return build_packet_table_from_chunks(build_chunks())
+    except Exception as e:
+        return _table_error(file_path, e)
+
+def build_packet_table_from_chunks(chunks):
+    chunks = list(chunks)
+    if not chunks:
+        return np.zeros(0, dtype=PACKET_DTYPE)
+    return np.concatenate(chunks)
+
+def load_packet_table(file_path, cache_dir=None):
+    try:
+        table = _cached_packet_table(file_path, cache_dir)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        return np.zeros(0, dtype=PACKET_DTYPE)
+    if table is not None:
+        return table
+    STATS.add_input(file_path)
+    return _store_packet_table(file_path, cache_dir, lambda: iter_table_chunks(_table_records(file_path)))
+
+def packet_mask(table, source=None, destination=None, protocol=None):
+    with STATS.stage('filter'):
+        mask = np.ones(len(table), dtype=bool)
+        if source:
+            source = address_to_int(source)
+            mask &= (table['src_hi'] == source >> 64) & (table['src_lo'] == source & MASK64)
+        if destination:
+            destination = address_to_int(destination)
+            mask &= (table['dst_hi'] == destination >> 64) & (table['dst_lo'] == destination & MASK64)
+        if protocol:
+            mask &= (table['proto'] == PROTOCOL_NUMBERS[protocol]) & ~table['fragment']
+        return mask
+
+def load_packets(file_path, source=None, destination=None, protocol=None, use_cache=True, cache_dir=None):
+    # Protocols that need scapy dissection cannot be answered from the table.
+    if not use_cache or (protocol and protocol not in PROTOCOL_NUMBERS):
+        STATS.add_input(file_path)
+        table = stream_table(file_path, source, destination, protocol)
+        STATS.items += len(table)
+        return table
+    table = load_packet_table(file_path, cache_dir)
+    STATS.items += len(table)
+    return table[packet_mask(table, source, destination, protocol)]
+
+def _concatenate_tables(tables):
+    if len(tables) == 1:
+        return tables[0]
+    return build_packet_table_from_chunks(table for table in tables if len(table))
+
+def load_captures(captures, source=None, destination=None, protocol=None, use_cache=True, cache_dir=None,
+                  workers=1):
+    # captures is a list of capture points, each a list of files (see
+    # expand_capture_paths). Returns one filtered packet table per capture point.
+    with STATS.stage('parse'):
+        return _load_captures(captures, source, destination, protocol, use_cache, cache_dir, workers)
+
+def _load_captures(captures, source, destination, protocol, use_cache, cache_dir, workers):
+    if workers <= 1:
+        return [_concatenate_tables([load_packets(file_path, source, destination, protocol, use_cache, cache_dir)
+                                     for file_path in files]) for files in captures]
+
+    scapy_protocol = protocol and protocol not in PROTOCOL_NUMBERS
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Submit every file (and the first ranges of every large file) of
+        # every capture point before waiting on any of them.
+        pending = []
+        for files in captures:
+            jobs = []
+            for file_path in files:
+                if scapy_protocol:
+                    STATS.add_input(file_path)
+                    jobs.append((file_path, None, executor.submit(stream_table, file_path, source, destination, protocol)))
+                    continue
+                table = None
+                if use_cache:
+                    try:
+                        table = _cached_packet_table(file_path, cache_dir)
+                    except FileNotFoundError:
+                        print(f"File not found: {file_path}")
+                        table = np.zeros(0, dtype=PACKET_DTYPE)
+                if table is not None:
+                    jobs.append((file_path, table, None))
+                    continue
+                STATS.add_input(file_path)
+                try:
+                    ranges = split_capture(file_path, workers * RANGES_PER_WORKER)
+                except OSError:
+                    ranges = None
+                ranges = ranges or [(None, None)]
+                jobs.append((file_path, None, RangeDecoder(executor, file_path, ranges,
+                                                           workers * RANGES_AHEAD_PER_WORKER)))
+            pending.append(jobs)
+
+        results = []
+        for jobs in pending:
+            tables = []
+            for file_path, table, job in jobs:
+                if scapy_protocol:
+                    try:
+                        tables.append(job.result())
+                        STATS.items += len(tables[-1])
+                    except Exception as e:
+                        print(f"Error reading {file_path}: {e}")
+                    continue
+                if table is None and not use_cache:
+                    # Without a cache only the rows that pass the filter are kept.
+                    try:
+                        parts = []
+                        for part in job.tables():
+                            STATS.items += len(part)
+                            parts.append(part[packet_mask(part, source, destination, protocol)])
+                        tables.append(build_packet_table_from_chunks(parts))
+                    except FileNotFoundError:
+                        print(f"File not found: {file_path}")
+                    except Exception as e:
+                        print(f"Error reading {file_path}: {e}")
+                    continue
+                if table is None:
+                    table = _store_packet_table(file_path, cache_dir, job.tables)
+                STATS.items += len(table)
+                tables.append(table[packet_mask(table, source, destination, protocol)])
+            results.append(_concatenate_tables(tables) if tables else np.zeros(0, dtype=PACKET_DTYPE))
+    return results
+
+def analyze_file(file_path, source=None, destination=None, protocol=None):
+    return list(filter_packets(read_packets(file_path), source, destination, protocol))
+
+def match_by_ip_id(ids1, times1, ids2, times2):
+    # Pairs every packet of the first capture with the earliest packet of the
+    # second one that has the same IP id, using a sort-merge join.
+    ids1 = np.asarray(ids1)
+    times1 = np.asarray(times1, dtype=np.float64)
+    ids2 = np.asarray(ids2)
+    times2 = np.asarray(times2, dtype=np.float64)
+
+    order2 = np.lexsort((times2, ids2))
+    unique_ids2, first2 = np.unique(ids2[order2], return_index=True)
+    earliest2 = times2[order2][first2]
+
+    # Keep the order the intervals were always reported in for equal delays:
+    # ids by first appearance in the first capture, then capture order.
+    _, first1, inverse1 = np.unique(ids1, return_index=True, return_inverse=True)
+    order1 = np.lexsort((np.arange(len(ids1)), first1[inverse1]))
+
+    position = np.minimum(np.searchsorted(unique_ids2, ids1[order1]), max(len(unique_ids2) - 1, 0))
+    found = unique_ids2[position] == ids1[order1] if len(unique_ids2) else np.zeros(len(order1), dtype=bool)
+    order1 = order1[found]
+    matched2 = earliest2[position[found]]
+
+    intervals = (matched2 - times1[order1]) * 1000
+    return intervals, ids1[order1], times1[order1], matched2
+
+class DelayStats:
+    """Bounded-memory summary of a stream of delays in milliseconds.
+
+    Mean and standard deviation use Welford's method. Quantiles come from a
+    DDSketch: values are counted in logarithmic buckets, so any quantile is
+    within relative_accuracy of the true value, and two summaries can be
+    merged by adding their bucket counts.
+    """
+
+    # Delays closer to zero than this all land in the zero bucket.
+    MIN_INDEXED = 1e-6
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _bucket_keys(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def add(self, value):
+        self.add_many(np.array([value], dtype=np.float64))
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        count = len(values)
+        mean = float(np.mean(values))
+        m2 = float(np.sum((values - mean) ** 2))
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+        magnitudes = np.abs(values)
+        indexed = magnitudes >= self.MIN_INDEXED
+        self.zero += int(np.count_nonzero(~indexed))
+        for buckets, selected in ((self.positive, indexed & (values > 0)), (self.negative, indexed & (values < 0))):
+            keys, counts = np.unique(self._bucket_keys(magnitudes[selected]), return_counts=True)
+            for key, key_count in zip(keys.tolist(), counts.tolist()):
+                buckets[key] = buckets.get(key, 0) + key_count
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zero += other.zero
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, key_count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + key_count
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def _representative(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _ordered_buckets(self):
+        for key in sorted(self.negative, reverse=True):
+            yield -self._representative(key), self.negative[key]
+        if self.zero:
+            yield 0.0, self.zero
+        for key in sorted(self.positive):
+            yield self._representative(key), self.positive[key]
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, count in self._ordered_buckets():
+            seen += count
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def histogram(self):
+        # Bucket counts regrouped into powers of two (in ms), ordered by value;
+        # each entry is (low, high, count) with negative ranges for negative delays.
+        groups = {}
+        for value, count in self._ordered_buckets():
+            exponent = math.floor(math.log2(abs(value))) if value else None
+            sign = -1 if value < 0 else 1
+            groups[(sign, exponent)] = groups.get((sign, exponent), 0) + count
+
+        def order(group):
+            sign, exponent = group
+            return 0 if exponent is None else sign * (2.0 ** exponent)
+
+        histogram = []
+        for sign, exponent in sorted(groups, key=order):
+            if exponent is None:
+                histogram.append((0.0, 0.0, groups[(sign, exponent)]))
+            else:
+                low, high = sorted((sign * 2.0 ** exponent, sign * 2.0 ** (exponent + 1)))
+                histogram.append((low, high, groups[(sign, exponent)]))
+        return histogram
+
+class TopIntervals:
+    """Keeps the n largest delays seen so far in a bounded min-heap."""
+
+    def __init__(self, n):
+        self.n = n
+        self.heap = []
+        self.seen = 0
+
+    def add_many(self, intervals, packet_ids, times1, times2):
+        if self.n <= 0 or len(intervals) == 0:
+            return
+        # Only the chunk's own n largest can make it into the heap. Of the
+        # delays tied at the cutoff, the earliest ones are kept.
+        candidates = np.arange(len(intervals))
+        if len(intervals) > self.n:
+            cutoff = -np.partition(-intervals, self.n - 1)[self.n - 1]
+            candidates = np.flatnonzero(intervals >= cutoff)
+            candidates = np.sort(candidates[np.argsort(-intervals[candidates], kind='stable')[:self.n]])
+        for index in candidates.tolist():
+            # The negated arrival number makes earlier delays win ties, like a stable sort.
+            entry = (float(intervals[index]), -(self.seen + index), int(packet_ids[index]),
+                     float(times1[index]), float(times2[index]))
+            if len(self.heap) < self.n:
+                heapq.heappush(self.heap, entry)
+            elif entry > self.heap[0]:
+                heapq.heapreplace(self.heap, entry)
+        self.seen += len(intervals)
+
+    def descending(self):
+        return [(interval, packet_id, time1, time2)
+                for interval, _, packet_id, time1, time2 in sorted(self.heap, reverse=True)]
+
+class HopJoiner:
+    """Follows packets across any number of capture points in one pass.
+
+    Packets from every capture point are added in time order. A packet joins
+    the oldest open journey with the same key that has not been seen at its
+    capture point yet and started at most max_delay seconds earlier; otherwise
+    it starts a new journey. Journeys are handed back once they are older than
+    the window, so memory follows the window rather than the captures.
+    """
+
+    def __init__(self, hops, max_delay):
+        self.hops = hops
+        self.max_delay = max_delay
+        self.open = {}
+        self.started = deque()
+
+    def expire(self, now):
+        finished = []
+        limit = now - self.max_delay
+        while self.started and self.started[0][0] < limit:
+            _, key, journey = self.started.popleft()
+            journeys = self.open[key]
+            journeys.remove(journey)
+            if not journeys:
+                del self.open[key]
+            finished.append(journey)
+        return finished
+
+    def add(self, hop, key, time):
+        # Returns the journeys that left the window; each is a list holding the
+        # time seen at every capture point, or None where it was not seen.
+        finished = self.expire(time)
+        journeys = self.open.setdefault(key, [])
+        for journey in journeys:
+            if journey[hop] is None:
+                journey[hop] = time
+                return finished
+        journey = [None] * self.hops
+        journey[hop] = time
+        journeys.append(journey)
+        self.started.append((time, key, journey))
+        return finished
+
+    def flush(self):
+        return self.expire(math.inf)
+
+def time_order(packets):
+    # The rows of a table in time order (ties keep their order), or None when
+    # they already are. Captures are usually written in time order, but
+    # nothing guarantees it, and the merges below depend on it.
+    times = packets['time']
+    if len(times) < 2 or np.all(times[1:] >= times[:-1]):
+        return None
+    return np.argsort(times, kind='stable')
+
+def iter_match_keys(packets, side):
+    # (time, side, key) of every packet in time order, for heapq.merge.
+    order = time_order(packets)
+    for start in range(0, len(packets), TABLE_CHUNK_ROWS):
+        if order is None:
+            chunk = packets[start:start + TABLE_CHUNK_ROWS]
+        else:
+            chunk = packets[order[start:start + TABLE_CHUNK_ROWS]]
+        keys = zip(*(chunk[name].tolist() for name in MATCH_KEY_COLUMNS))
+        for timestamp, key in zip(chunk['time'].tolist(), keys):
+            yield timestamp, side, key
+
+def _match_chunk(packet_ids, times1, times2):
+    times1 = np.array(times1, dtype=np.float64)
+    times2 = np.array(times2, dtype=np.float64)
+    return (times2 - times1) * 1000, np.array(packet_ids, dtype=np.uint32), times1, times2
+
+def iter_window_matches(packets1, packets2, max_delay):
+    # Two-pointer merge of both captures in time order; max_delay is in seconds.
+    # Yields (intervals, packet_ids, times1, times2) arrays a chunk at a time.
+    matcher = WindowedMatcher(max_delay)
+    packet_ids = []
+    times1 = []
+    times2 = []
+    for timestamp, side, key in heapq.merge(iter_match_keys(packets1, 0), iter_match_keys(packets2, 1)):
+        pair = matcher.add(side, key, timestamp)
+        if pair:
+            packet_ids.append(key[0])
+            times1.append(pair[0])
+            times2.append(pair[1])
+            if len(packet_ids) == TABLE_CHUNK_ROWS:
+                yield _match_chunk(packet_ids, times1, times2)
+                packet_ids = []
+                times1 = []
+                times2 = []
+    if packet_ids:
+        yield _match_chunk(packet_ids, times1, times2)
+
+def match_within_window(packets1, packets2, max_delay):
+    chunks = list(iter_window_matches(packets1, packets2, max_delay))
+    if not chunks:
+        return _match_chunk([], [], [])
+    return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+def delay_summary(intervals):
+    intervals = np.asarray(intervals, dtype=np.float64)
+    return np.min(intervals), np.max(intervals), np.mean(intervals), np.std(intervals)
+
+def print_top_intervals(top):
+    print(f"\nTop {top.n} intervals in descending order:")
+    for interval, packet_id, time1, time2 in top.descending():
+        print(f"Packet ID {packet_id}: {interval:.2f} ms - Start: {time1:.6f}, End: {time2:.6f}")
+
+def report_streaming_delays(file1_path, file2_path, matches, top=None):
+    stats = DelayStats()
+    top = TopIntervals(top) if top else None
+    # matches may be lazy, so the matching itself happens in this loop.
+    with STATS.stage('match'):
+        for intervals, packet_ids, times1, times2 in matches:
+            stats.add_many(intervals)
+            if top:
+                top.add_many(intervals, packet_ids, times1, times2)
+
+    if stats.count == 0:
+        print("Not enough matching packets to calculate intervals.")
+        return
+
+    print(f"\nResults for packets from {file1_path} to {file2_path}")
+    print(f"Total matched packets: {stats.count}")
+    print(f"Min. delay: {stats.min:.2f} ms")
+    print(f"Max. delay: {stats.max:.2f} ms")
+    print(f"Avg. delay: {stats.mean:.2f} ms")
+    print(f"Std. dev.: {stats.std:.2f} ms")
+    for percentile in REPORTED_PERCENTILES:
+        print(f"p{percentile} delay: {stats.quantile(percentile / 100):.2f} ms")
+
+    print("\nDelay histogram:")
+    for low, high, count in stats.histogram():
+        label = "0 ms" if low == high else f"[{low:g}, {high:g}) ms"
+        print(f"{label}: {count}")
+
+    if top:
+        print_top_intervals(top)
+
+    return stats.min, stats.max, stats.mean, stats.std
+
+def join_hops(tables, max_delay):
+    # Yields an array of per-hop times (NaN where unseen), a chunk of journeys at a time.
+    joiner = HopJoiner(len(tables), max_delay)
+    journeys = []
+    merged = heapq.merge(*(iter_match_keys(table, hop) for hop, table in enumerate(tables)))
+    for timestamp, hop, key in merged:
+        journeys.extend(joiner.add(hop, key, timestamp))
+        if len(journeys) >= TABLE_CHUNK_ROWS:
+            yield np.array(journeys, dtype=np.float64)
+            journeys = []
+    journeys.extend(joiner.flush())
+    if journeys:
+        yield np.array(journeys, dtype=np.float64)
+
+def hop_delay_stats(tables, max_delay, offsets=None):
+    # DelayStats for every hop (capture point i to i + 1) and end to end, in ms,
+    # with each hop's clock offset taken off before the delays are summarised.
+    offsets = offsets or [0.0] * (len(tables) - 1)
+    hops = [DelayStats() for _ in range(len(tables) - 1)]
+    end_to_end = DelayStats()
+    with STATS.stage('match'):
+        for times in join_hops(tables, max_delay):
+            for hop, stats in enumerate(hops):
+                delays = (times[:, hop + 1] - times[:, hop]) * 1000 - offsets[hop]
+                stats.add_many(delays[~np.isnan(delays)])
+            delays = (times[:, -1] - times[:, 0]) * 1000 - sum(offsets)
+            end_to_end.add_many(delays[~np.isnan(delays)])
+    return hops, end_to_end
+
+def estimate_clock_offset(forward, reverse):
+    # Offset of the later capture point's clock, in ms. Assuming the fastest
+    # packet took equally long in both directions, the offset adds to the
+    # forward minimum and subtracts from the reverse one.
+    if forward.count == 0 or reverse.count == 0:
+        return None
+    return (forward.min - reverse.min) / 2
+
+def print_delay_stats(stats):
+    print(f"  Matched packets: {stats.count}")
+    if stats.count == 0:
+        return
+    print(f"  Min. delay: {stats.min:.2f} ms")
+    print(f"  Max. delay: {stats.max:.2f} ms")
+    print(f"  Avg. delay: {stats.mean:.2f} ms")
+    print(f"  Std. dev.: {stats.std:.2f} ms")
+    for percentile in REPORTED_PERCENTILES:
+        print(f"  p{percentile} delay: {stats.quantile(percentile / 100):.2f} ms")
+
+def calculate_hop_delays(file_paths, source, destination, protocol=None, use_cache=True, cache_dir=None,
+                         max_delay=None, workers=1):
+    # Every capture is parsed once; both directions are masked out of the same tables.
+    captures = [expand_capture_paths(file_path) for file_path in file_paths]
+    tables = load_captures(captures, protocol=protocol, use_cache=use_cache, cache_dir=cache_dir, workers=workers)
+    window = (max_delay if max_delay is not None else DEFAULT_HOP_WINDOW) / 1000
+
+    forward_tables = [table[packet_mask(table, source, destination)] for table in tables]
+    if not all(len(table) for table in forward_tables):
+        print("No matching packets found in the specified criteria.")
+        return
+    raw_hops, _ = hop_delay_stats(forward_tables, window)
+
+    # Replies cross the capture points in the opposite order.
+    reverse_tables = [table[packet_mask(table, destination, source)] for table in reversed(tables)]
+    reverse_hops, _ = hop_delay_stats(reverse_tables, window)
+    reverse_hops.reverse()
+    offsets = [estimate_clock_offset(forward, reverse) for forward, reverse in zip(raw_hops, reverse_hops)]
+
+    # The join is repeated with the offsets applied so the quantile sketches
+    # see corrected delays and keep their relative accuracy.
+    hops, end_to_end = hop_delay_stats(forward_tables, window, [offset or 0.0 for offset in offsets])
+
+    print(f"\nResults for packets from {source} to {destination} across {len(file_paths)} capture points")
+    for hop, stats in enumerate(hops):
+        print(f"\nHop {hop + 1}: {file_paths[hop]} -> {file_paths[hop + 1]}")
+        if offsets[hop] is None:
+            print("  Clock offset: not estimated (no matched packets in the reverse direction)")
+        else:
+            print(f"  Clock offset: {offsets[hop]:+.2f} ms "
+                  f"(from {stats.count} forward and {reverse_hops[hop].count} reverse packets)")
+        print_delay_stats(stats)
+
+    print(f"\nEnd to end: {file_paths[0]} -> {file_paths[-1]}")
+    print_delay_stats(end_to_end)
+
+    return hops, end_to_end, offsets
+
+def iter_table_records(table):
+    for start in range(0, len(table), TABLE_CHUNK_ROWS):
+        chunk = table[start:start + TABLE_CHUNK_ROWS]
+        columns = [chunk[name].tolist() for name in PACKET_DTYPE.names]
+        for (timestamp, src_hi, src_lo, dst_hi, dst_lo, ip_id, proto, fragment, sport, dport, digest,
+             length) in zip(*columns):
+            yield PacketRecord(timestamp, (src_hi << 64) | src_lo, (dst_hi << 64) | dst_lo, ip_id, proto, fragment,
+                               sport, dport, digest, length)
+
+def summarize_flows(records, capacity=DEFAULT_FLOW_CAPACITY):
+    # One pass over the records into two bounded summaries weighted by bytes:
+    # talkers keyed by source address and conversations keyed by 5-tuple.
+    talkers = SpaceSaving(capacity)
+    conversations = SpaceSaving(capacity)
+    packets = 0
+    for record in records:
+        packets += 1
+        talkers.add(record.src, record.length, time=record.time)
+        key = (record.proto, record.src, record.sport, record.dst, record.dport)
+        conversations.add(key, record.length, time=record.time)
+    return packets, talkers, conversations
+
+def _format_bytes(weight, error):
+    return f"{weight} bytes" + (f" (±{error})" if error else "")
+
+def _format_endpoint(address, port, proto):
+    address = int_to_address(address)
+    if proto not in PORT_PROTOCOLS:
+        return address
+    return f"[{address}]:{port}" if ':' in address else f"{address}:{port}"
+
+def report_flows(file_path, source=None, destination=None, protocol=None, use_cache=True, cache_dir=None,
+                 workers=1, top=DEFAULT_FLOW_TOP, capacity=DEFAULT_FLOW_CAPACITY, geo=None):
+    # geo: an ipfind CountryDatabase to show the countries of addresses with.
+    files = expand_capture_paths(file_path)
+    streamed = not use_cache or (protocol and protocol not in PROTOCOL_NUMBERS)
+    if not streamed:
+        table, = load_captures([files], source, destination, protocol, use_cache, cache_dir, workers)
+        records = iter_table_records(table)
+    else:
+        for path in files:
+            STATS.add_input(path)
+        records = (record for path in files for record in stream_packets(path, source, destination, protocol))
+    # Streamed records are decoded while they are summarised, so within this stage.
+    with STATS.stage('match'):
+        packets, talkers, conversations = summarize_flows(records, capacity)
+    if streamed:
+        STATS.items += packets
+
+    print(f"Total packets: {packets}")
+    print(f"Total bytes: {talkers.total}")
+
+    def countries(addresses):
+        if geo is None:
+            return ['' for _ in addresses]
+        return [f" ({country})" for country in address_countries(addresses, geo)]
+
+    print(f"\nTop {top} talkers by bytes:")
+    top_talkers = talkers.top(top)
+    for (address, (weight, error, count, first, last)), country in zip(
+            top_talkers, countries([address for address, _ in top_talkers])):
+        print(f"{int_to_address(address)}{country}: {_format_bytes(weight, error)}, {count} packets")
+
+    print(f"\nTop {top} conversations by bytes:")
+    top_conversations = conversations.top(top)
+    src_countries = countries([key[1] for key, _ in top_conversations])
+    dst_countries = countries([key[3] for key, _ in top_conversations])
+    for ((proto, src, sport, dst, dport), (weight, error, count, first, last)), src_country, dst_country in zip(
+            top_conversations, src_countries, dst_countries):
+        name = PROTOCOL_NAMES.get(proto, f"proto {proto}")
+        print(f"{name} {_format_endpoint(src, sport, proto)}{src_country} -> "
+              f"{_format_endpoint(dst, dport, proto)}{dst_country}: "
+              f"{_format_bytes(weight, error)}, {count} packets, first {first:.6f}, last {last:.6f}, "
+              f"duration {last - first:.3f} s")
+    return packets, talkers, conversations
+
+def _print_peers(label, total, peers, heading):
+    print(f"{label}: {total}")
+    print(heading)
+    for peer in peers:
+        print(int_to_address(peer))
+
+def follow_captures(file_paths, source=None, destination=None, protocol=None, max_delay=None,
+                    interval=DEFAULT_FOLLOW_INTERVAL, iterations=None):
+    # Live counterpart of main(): one capture point keeps a running peer list,
+    # two keep running delay statistics. iterations bounds the number of
+    # updates (None follows until interrupted).
+    followers = [CaptureFollower(file_path) for file_path in file_paths]
+    if len(followers) == 1 and source:
+        destination = None
+    window = (max_delay if max_delay is not None else DEFAULT_HOP_WINDOW) / 1000
+    matcher = WindowedMatcher(window)
+    stats = DelayStats()
+    pending = [[] for _ in followers]
+    latest = [None for _ in followers]
+    last_active = [time.monotonic() for _ in followers]
+    released = None
+    late = 0
+    total = 0
+    peers = set()
+
+    def consume(side, record):
+        nonlocal total
+        if len(followers) == 1:
+            total += 1
+            peers.add(record.dst if source else record.src)
+            return
+        key = (record.ip_id, record.src, record.dst, record.proto, record.digest)
+        pair = matcher.add(side, key, record.time)
+        if pair:
+            stats.add((pair[1] - pair[0]) * 1000)
+
+    updates = 0
+    try:
+        while iterations is None or updates < iterations:
+            now = time.monotonic()
+            for side, follower in enumerate(followers):
+                raw_records = follower.poll()
+                if raw_records:
+                    last_active[side] = now
+                for record in filter_records(raw_records, source, destination, protocol):
+                    if released is not None and record.time < released:
+                        # Behind what the matcher has already seen: it would
+                        # arrive out of order, so it is counted and skipped.
+                        late += 1
+                        continue
+                    pending[side].append((record.time, side, record))
+                    latest[side] = record.time
+
+            # The matcher needs both captures in time order, so records are only
+            # released up to the point every active capture has reached. A
+            # capture that has written nothing for FOLLOW_QUIET_SECONDS does
+            # not hold the others back.
+            active = [side for side in range(len(followers)) if now - last_active[side] < FOLLOW_QUIET_SECONDS]
+            seen = [value for value in latest if value is not None]
+            if seen:
+                if not active:
+                    watermark = max(seen)
+                elif all(latest[side] is not None for side in active):
+                    watermark = min(latest[side] for side in active)
+                else:
+                    watermark = None
+                if watermark is not None:
+                    ready = []
+                    for side in range(len(followers)):
+                        ready.extend(entry for entry in pending[side] if entry[0] <= watermark)
+                        pending[side] = [entry for entry in pending[side] if entry[0] > watermark]
+                    ready.sort(key=lambda entry: (entry[0], entry[1]))
+                    for _, side, record in ready:
+                        consume(side, record)
+                    released = watermark if released is None else max(released, watermark)
+
+            updates += 1
+            print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}]")
+            if len(followers) == 1 and source:
+                _print_peers(f"Total packets from source {source}", total, peers, "Destination addresses:")
+            elif len(followers) == 1:
+                _print_peers(f"Total packets to destination {destination}", total, peers, "Source addresses:")
+            else:
+                print(f"Results for packets from {file_paths[0]} to {file_paths[1]}")
+                print_delay_stats(stats)
+                if late:
+                    print(f"  Late packets skipped: {late} (written after their capture was "
+                          f"{FOLLOW_QUIET_SECONDS} s quiet)")
+            if iterations is None or updates < iterations:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return (total, peers) if len(followers) == 1 else stats
+
+def calculate_delays(file1_path, file2_path, source, destination, protocol=None, use_cache=True, cache_dir=None,
+                     max_delay=None, streaming=False, top=None, workers=1):
+    # Both captures are parsed at the same time when workers > 1.
+    captures = [expand_capture_paths(file1_path), expand_capture_paths(file2_path)]
+    packets1, packets2 = load_captures(captures, source, destination, protocol, use_cache, cache_dir, workers)
+
+    if len(packets1) == 0 or len(packets2) == 0:
         print("No matching packets found in the specified criteria.")
         return
 
-    packet_times1 = {}
-    packet_times2 = {}
-
-    for packet in packets1:
-        packet_id = packet['IP'].id
-        if packet_id not in packet_times1:
-            packet_times1[packet_id] = []
-        packet_times1[packet_id].append(float(packet.time))
-
-    for packet in packets2:
-        packet_id = packet['IP'].id
-        if packet_id not in packet_times2:
-            packet_times2[packet_id] = []
-        packet_times2[packet_id].append(float(packet.time))
-
-    intervals = []
-    for packet_id in packet_times1:
-        if packet_id in packet_times2:
-            for time1 in packet_times1[packet_id]:
-                matching_times = [time2 for time2 in packet_times2[packet_id]]
-                if matching_times:
-                    time2 = min(matching_times)
-                    interval = (time2 - time1) * 1000  
-                    intervals.append((interval, packet_id, time1, time2))
-
-    if not intervals:
+    if streaming:
+        if max_delay is not None:
+            matches = iter_window_matches(packets1, packets2, max_delay / 1000)
+        else:
+            matches = [match_by_ip_id(packets1['ip_id'], packets1['time'], packets2['ip_id'], packets2['time'])]
+        return report_streaming_delays(file1_path, file2_path, matches, top)
+
+    with STATS.stage('match'):
+        if max_delay is not None:
+            intervals, packet_ids, times1, times2 = match_within_window(packets1, packets2, max_delay / 1000)
+        else:
+            intervals, packet_ids, times1, times2 = match_by_ip_id(packets1['ip_id'], packets1['time'],
+                                                                   packets2['ip_id'], packets2['time'])
+
+    if len(intervals) == 0:
         print("Not enough matching packets to calculate intervals.")
         return
 
-    intervals.sort(reverse=True, key=lambda x: x[0])  
+    with STATS.stage('output'):
+        min_time, max_time, avg_time, std_dev = delay_summary(intervals)
 
-    min_time = np.min([interval[0] for interval in intervals])
-    max_time = np.max([interval[0] for interval in intervals])
-    avg_time = np.mean([interval[0] for interval in intervals])
-    std_dev = np.std([interval[0] for interval in intervals])
+        print(f"\nResults for packets from {file1_path} to {file2_path}")
+        print(f"Total matched packets: {len(intervals)}")
+        print(f"Min. delay: {min_time:.2f} ms")
+        print(f"Max. delay: {max_time:.2f} ms")
+        print(f"Avg. delay: {avg_time:.2f} ms")
+        print(f"Std. dev.: {std_dev:.2f} ms")
+
+        if top is not None:
+            top_intervals = TopIntervals(top)
+            top_intervals.add_many(intervals, packet_ids, times1, times2)
+            print_top_intervals(top_intervals)
+            return min_time, max_time, avg_time, std_dev
+
+        print("\nAll intervals in descending order:")
+        order = np.argsort(-intervals, kind='stable')
+        for interval, packet_id, time1, time2 in zip(intervals[order].tolist(), packet_ids[order].tolist(),
+                                                     times1[order].tolist(), times2[order].tolist()):
+            print(f"Packet ID {packet_id}: {interval:.2f} ms - Start: {time1:.6f}, End: {time2:.6f}")
 
-    print(f"\nResults for packets from {file1_path} to {file2_path}")
-    print(f"Total matched packets: {len(intervals)}")
-    print(f"Min. delay: {min_time:.2f} ms")
-    print(f"Max. delay: {max_time:.2f} ms")
-    print(f"Avg. delay: {avg_time:.2f} ms")
-    print(f"Std. dev.: {std_dev:.2f} ms")
-    
-    print("\nAll intervals in descending order:")
-    for i, (interval, packet_id, time1, time2) in enumerate(intervals, 1):
-        print(f"Packet ID {packet_id}: {interval:.2f} ms - Start: {time1:.6f}, End: {time2:.6f}")
-        
     return min_time, max_time, avg_time, std_dev
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Analyze PCAP files and calculate packet delays.")
-    parser.add_argument("file_paths", nargs='+', help="Path to the PCAP file(s)")
+    parser.add_argument("file_paths", nargs='+',
+                        help="Path to the PCAP file(s); more than two are treated as capture points along one path")
     parser.add_argument("--source", help="Source IP address to filter packets")
     parser.add_argument("--destination", help="Destination IP address to filter packets")
     parser.add_argument("--protocol", help="Protocol to filter packets (e.g., TCP, UDP)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the per-capture packet table cache")
+    parser.add_argument("--max-delay", type=float,
+                        help="Only pair packets at most this many ms apart, matching on IP id, addresses, "
+                             "protocol and payload")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Summarise delays with bounded memory: percentiles and a log-scale histogram "
+                             "instead of every interval (needs --max-delay)")
+    parser.add_argument("--top", type=int, metavar="N",
+                        help="Only list the N largest intervals")
+    parser.add_argument("--flows", action="store_true",
+                        help="Summarise the capture's top talkers and conversations (5-tuple flows) by bytes")
+    parser.add_argument("--flow-capacity", type=int, default=DEFAULT_FLOW_CAPACITY,
+                        help="Entries kept per summary in --flows mode; counts are exact below this many flows")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep reading packets as they are appended to the capture(s), including newly "
+                             "rotated files, and print updated results periodically")
+    parser.add_argument("--interval", type=float, default=DEFAULT_FOLLOW_INTERVAL,
+                        help="Seconds between updates in --follow mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to parse captures (0 uses every CPU)")
+    parser.add_argument("--cache-dir", help=f"Directory for packet table caches (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--geo", metavar="DB",
+                        help="Show the country of listed addresses from an offline ipfind country database")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print wall and CPU time per stage, packets per second, input bytes and peak "
+                             "memory to stderr when done")
+    parser.add_argument("--stats-format", choices=['text', 'json'], default='text',
+                        help="Format of the --stats report (default: text)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Write a cProfile dump of the run to FILE (read it with python -m pstats FILE)")
+    parser.add_argument("--trace-memory", type=int, metavar="N",
+                        help="Trace allocations with tracemalloc and print the N largest allocation sites")
 
     args = parser.parse_args()
 
-    valid_formats = ['.pcap', '.cap', '.pcang']
-    
-    for file_path in args.file_paths:
-        if not any(file_path.endswith(fmt) for fmt in valid_formats):
-            raise ArgumentException(f"{file_path} is not a valid file format. Supported formats are: {', '.join(valid_formats)}")
-        
-        if not os.path.isfile(file_path):
-            raise ArgumentException(f"The file path '{file_path}' does not exist or is not a file.")
+    valid_formats = CAPTURE_FORMATS + [fmt + compressed for fmt in CAPTURE_FORMATS for compressed in COMPRESSED_FORMATS]
+
+    for capture in args.file_paths:
+        file_paths = expand_capture_paths(capture)
+        if not file_paths:
+            raise ArgumentException(f"No capture files match '{capture}'.")
+
+        for file_path in file_paths:
+            if not is_capture_file(file_path):
+                raise ArgumentException(f"{file_path} is not a valid file format. Supported formats are: {', '.join(valid_formats)}, "
+                                        f"optionally followed by a tcpdump -C file number")
+
+            if not os.path.isfile(file_path):
+                raise ArgumentException(f"The file path '{file_path}' does not exist or is not a file.")
 
-    if not args.source and not args.destination:
+            if args.follow and not is_pcap_file(file_path):
+                raise ArgumentException(f"{file_path}: --follow reads uncompressed pcap files only, not pcapng "
+                                        f"or compressed captures.")
+
+    if args.streaming and args.max_delay is None:
+        # Without a window every packet is kept until the captures are matched.
+        raise ArgumentException("--streaming needs --max-delay to keep memory bounded.")
+
+    if args.geo and not os.path.isfile(args.geo):
+        raise ArgumentException(f"The country database '{args.geo}' does not exist or is not a file.")
+
+    if not args.source and not args.destination and not args.flows:
         raise ArgumentException("Please provide source or destination IP address.")
 
-    if len(args.file_paths) == 1:
+    for address in (args.source, args.destination):
+        if address:
+            try:
+                address_to_int(address)
+            except ValueError:
+                raise ArgumentException(f"'{address}' is not a valid IP address.")
+
+    if args.flows:
+        if len(args.file_paths) != 1:
+            raise ArgumentException("--flows takes a single capture.")
+    elif len(args.file_paths) == 1:
         if not (args.source or args.destination):
             raise ArgumentException("Please provide either a source or destination IP address.")
     elif len(args.file_paths) == 2:
         if not (args.source and args.destination):
             raise ArgumentException("When providing two PCAP files, you must provide both source and destination IP addresses.")
     else:
-        raise ArgumentException("Please provide one or two PCAP files.")
+        if not (args.source and args.destination):
+            raise ArgumentException("When providing more than two PCAP files, you must provide both source and destination IP addresses.")
 
     return args
 
 def main():
     args = parse_arguments()
+    with instrumented(STATS, args.stats, args.stats_format, args.profile, args.trace_memory):
+        run(args)
+
+def run(args):
+    workers = args.workers or os.cpu_count()
+    geo = open_country_database(args.geo) if args.geo else None
 
-    if not args.source and not args.destination:
+    if args.flows:
+        report_flows(args.file_paths[0], args.source, args.destination, args.protocol, args.use_cache,
+                     args.cache_dir, workers, args.top or DEFAULT_FLOW_TOP, args.flow_capacity, geo)
+    elif not args.source and not args.destination:
         print("Please provide source or destination IP address.")
+    elif args.follow and len(args.file_paths) > 2:
+        print("--follow supports one or two capture points.")
+    elif args.follow:
+        try:
+            follow_captures(args.file_paths, args.source, args.destination, args.protocol, args.max_delay,
+                            args.interval)
+        except ValueError as e:
+            # A file rotated in after the arguments were checked is not a pcap.
+            print(e)
     elif len(args.file_paths) == 1:
         file_path = args.file_paths[0]
         if args.source:
-            packets = analyze_file(file_path, source=args.source, protocol=args.protocol)
-            destinations = {packet['IP'].dst for packet in packets}
-            print(f"Total packets from source {args.source}: {len(packets)}")
-            print("Destination addresses:")
-            for dst in destinations:
-                print(dst)
+            packets, = load_captures([expand_capture_paths(file_path)], source=args.source, protocol=args.protocol,
+                                     use_cache=args.use_cache, cache_dir=args.cache_dir, workers=workers)
+            with STATS.stage('output'):
+                destinations = np.unique(packets[['dst_hi', 'dst_lo']])
+                print(f"Total packets from source {args.source}: {len(packets)}")
+                print("Destination addresses:")
+                _print_addresses(destinations, 'dst', geo)
+                if geo:
+                    print("Packets by destination country:")
+                    for country, count in country_counts(packets, 'dst', geo):
+                        print(f"{country}: {count}")
         elif args.destination:
-            packets = analyze_file(file_path, destination=args.destination, protocol=args.protocol)
-            sources = {packet['IP'].src for packet in packets}
-            print(f"Total packets to destination {args.destination}: {len(packets)}")
-            print("Source addresses:")
-            for src in sources:
-                print(src)
+            packets, = load_captures([expand_capture_paths(file_path)], destination=args.destination,
+                                     protocol=args.protocol, use_cache=args.use_cache, cache_dir=args.cache_dir,
+                                     workers=workers)
+            with STATS.stage('output'):
+                sources = np.unique(packets[['src_hi', 'src_lo']])
+                print(f"Total packets to destination {args.destination}: {len(packets)}")
+                print("Source addresses:")
+                _print_addresses(sources, 'src', geo)
+                if geo:
+                    print("Packets by source country:")
+                    for country, count in country_counts(packets, 'src', geo):
+                        print(f"{country}: {count}")
     elif len(args.file_paths) == 2 and args.source and args.destination:
         file1_path = args.file_paths[0]
         file2_path = args.file_paths[1]
-        calculate_delays(file1_path, file2_path, args.source, args.destination, args.protocol)
+        calculate_delays(file1_path, file2_path, args.source, args.destination, args.protocol,
+                         args.use_cache, args.cache_dir, args.max_delay, args.streaming, args.top,
+                         workers)
+    elif len(args.file_paths) > 2 and args.source and args.destination:
+        calculate_hop_delays(args.file_paths, args.source, args.destination, args.protocol, args.use_cache,
+                             args.cache_dir, args.max_delay, workers)
     else:
-        print("Please provide one or two PCAP files along with the necessary parameters.")
+        print("Please provide PCAP files along with the necessary parameters.")
 
 if __name__ == "__main__":
     main()
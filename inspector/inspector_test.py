@@ -1,15 +1,30 @@
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+from concurrent.futures import Future
 import os
-from scapy.all import IP, wrpcap
-from inspector import analyze_file, calculate_delays, parse_arguments, ArgumentException
+import shutil
+import struct
+import gzip
+import lzma
+import bz2
+import numpy as np
+import sys
+from scapy.all import IP, IPv6, TCP, UDP, Ether, wrpcap
+from inspector import read_records, analyze_file, calculate_delays, parse_arguments, stream_packets, load_packet_table, load_packets, match_by_ip_id, WindowedMatcher, HopJoiner, CaptureFollower, follow_captures, calculate_hop_delays, split_capture, decode_range, load_captures, expand_capture_paths, DelayStats, TopIntervals, SpaceSaving, report_flows, address_to_int, int_to_address, ArgumentException, open_country_database, table_countries, address_countries, country_counts, IPFIND_DIR, STATS, instrumented, RecordBoundaryError, RangeDecoder, match_within_window, PACKET_DTYPE
 import argparse
+import io
+import json
 
 class TestInspector(unittest.TestCase):
 
     def setUp(self):
         self.test_dir = 'test_files'
         os.makedirs(self.test_dir, exist_ok=True)
+        # The cache is on by default; keep it out of ~/.cache.
+        self.default_cache_dir = os.path.join(self.test_dir, 'default_cache')
+        cache_patch = patch('inspector.DEFAULT_CACHE_DIR', self.default_cache_dir)
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
 
         self.file1_path = os.path.join(self.test_dir, 'file1.pcap')
         self.file2_path = os.path.join(self.test_dir, 'file2.pcap')
@@ -23,6 +38,7 @@ class TestInspector(unittest.TestCase):
         wrpcap(self.file2_path, packets)
 
     def tearDown(self):
+        shutil.rmtree(self.default_cache_dir, ignore_errors=True)
         for path in [self.file1_path, self.file2_path, self.file_path]:
             if os.path.exists(path):
                 os.remove(path)
@@ -57,6 +73,30 @@ class TestInspector(unittest.TestCase):
                 parse_arguments()
             self.assertIn(".asd is not a valid file format", str(cm.exception))
 
+        test_args = ['inspector.py', self.file1_path, self.file2_path, '--source', '192.168.1.105',
+                     '--destination', '192.168.1.111', '--streaming']
+        with patch('sys.argv', test_args):
+            with self.assertRaises(ArgumentException) as cm:
+                parse_arguments()
+            self.assertIn("--max-delay", str(cm.exception))
+
+        # --follow reads uncompressed pcap files only.
+        pcapng_path = os.path.join(self.test_dir, 'live.pcapng')
+        gzip_path = os.path.join(self.test_dir, 'live.pcap.gz')
+        with open(pcapng_path, 'wb') as file:
+            file.write(b'\x0a\x0d\x0d\x0a' + bytes(24))
+        with open(self.file_path, 'rb') as source, gzip.open(gzip_path, 'wb') as file:
+            file.write(source.read())
+        try:
+            for capture in (pcapng_path, gzip_path):
+                with patch('sys.argv', ['inspector.py', capture, '--source', '192.168.1.105', '--follow']):
+                    with self.assertRaises(ArgumentException) as cm:
+                        parse_arguments()
+                    self.assertIn("--follow", str(cm.exception))
+        finally:
+            os.remove(pcapng_path)
+            os.remove(gzip_path)
+
     def test_packet_time_difference(self):
         min_delay, max_delay, avg_delay, std_dev_delay = calculate_delays(self.file1_path, self.file2_path, source='192.168.1.105', destination='192.168.1.111')
 
@@ -70,12 +110,217 @@ class TestInspector(unittest.TestCase):
         self.assertAlmostEqual(avg_delay, expected_avg, delta=1, msg=f"Expected avg delay {expected_avg}, got {avg_delay}")
         self.assertAlmostEqual(std_dev_delay, expected_std_dev, delta=1, msg=f"Expected std dev {expected_std_dev}, got {std_dev_delay}")
 
+    def test_match_by_ip_id(self):
+        intervals, packet_ids, times1, times2 = match_by_ip_id(
+            np.array([5, 7, 5, 9]), np.array([1.0, 2.0, 3.0, 4.0]),
+            np.array([7, 5, 5, 8]), np.array([2.5, 1.5, 1.2, 0.0]))
+        self.assertEqual(packet_ids.tolist(), [5, 5, 7])
+        self.assertEqual(times1.tolist(), [1.0, 3.0, 2.0])
+        self.assertEqual(times2.tolist(), [1.2, 1.2, 2.5])
+        np.testing.assert_allclose(intervals, [200.0, -1800.0, 500.0])
+
+    def test_windowed_matcher(self):
+        matcher = WindowedMatcher(max_delay=1.0)
+        self.assertIsNone(matcher.add(0, 'a', 0.0))
+        self.assertIsNone(matcher.add(0, 'b', 0.1))
+        self.assertEqual(matcher.add(1, 'a', 0.5), (0.0, 0.5))
+        self.assertIsNone(matcher.add(1, 'a', 0.6))
+        self.assertEqual(matcher.add(0, 'a', 0.7), (0.7, 0.6))
+        self.assertIsNone(matcher.add(1, 'b', 1.5))
+        self.assertEqual(matcher.pending, ({}, {'b': matcher.pending[1]['b']}))
+
+    def test_match_within_window_out_of_order(self):
+        # Captures need not be written in time order.
+        packets1 = np.zeros(4, dtype=PACKET_DTYPE)
+        packets1['time'] = [0.0, 2.0, 1.0, 3.0]
+        packets1['ip_id'] = [1, 2, 3, 4]
+        packets2 = np.zeros(4, dtype=PACKET_DTYPE)
+        packets2['time'] = [0.1, 1.1, 3.1, 2.1]
+        packets2['ip_id'] = [1, 3, 4, 2]
+        intervals, packet_ids, times1, times2 = match_within_window(packets1, packets2, 0.5)
+        self.assertEqual(sorted(packet_ids.tolist()), [1, 2, 3, 4])
+        self.assertTrue(np.allclose(intervals, 100))
+
+    def test_delay_stats(self):
+        values = np.random.default_rng(1).lognormal(mean=2.0, sigma=1.0, size=20000)
+        values[:100] = -values[:100]
+        values[100:110] = 0.0
+        stats = DelayStats(relative_accuracy=0.01)
+        other = DelayStats(relative_accuracy=0.01)
+        stats.add_many(values[:5000])
+        other.add_many(values[5000:])
+        stats.merge(other)
+
+        self.assertEqual(stats.count, len(values))
+        self.assertAlmostEqual(stats.mean, np.mean(values), places=6)
+        self.assertAlmostEqual(stats.std, np.std(values), places=6)
+        self.assertEqual(stats.min, np.min(values))
+        self.assertEqual(stats.max, np.max(values))
+        for q in (0.5, 0.9, 0.99, 0.999):
+            expected = np.quantile(values, q, method='lower')
+            self.assertLessEqual(abs(stats.quantile(q) - expected), 0.011 * abs(expected))
+        self.assertEqual(sum(count for _, _, count in stats.histogram()), len(values))
+
+    def test_top_intervals(self):
+        top = TopIntervals(3)
+        top.add_many(np.array([5.0, 1.0, 9.0]), np.array([1, 2, 3]), np.zeros(3), np.zeros(3))
+        top.add_many(np.array([5.0, 7.0, 0.5, 2.0]), np.array([4, 5, 6, 7]), np.zeros(4), np.zeros(4))
+        self.assertEqual([packet_id for _, packet_id, _, _ in top.descending()], [3, 5, 1])
+
+        # Ties at the cutoff go to the earliest delays, as with a stable sort.
+        rng = np.random.default_rng(7)
+        for _ in range(200):
+            chunks = [rng.integers(0, 6, size=rng.integers(1, 40)).astype(float) for _ in range(3)]
+            intervals = np.concatenate(chunks)
+            ids = np.arange(len(intervals))
+            top = TopIntervals(5)
+            offset = 0
+            for chunk in chunks:
+                top.add_many(chunk, ids[offset:offset + len(chunk)], np.zeros(len(chunk)), np.zeros(len(chunk)))
+                offset += len(chunk)
+            self.assertEqual([packet_id for _, packet_id, _, _ in top.descending()],
+                             ids[np.argsort(-intervals, kind='stable')][:5].tolist())
+
+    def test_space_saving(self):
+        summary = SpaceSaving(2)
+        for key, weight in [('a', 10), ('b', 1), ('a', 10), ('c', 2), ('a', 10)]:
+            summary.add(key, weight)
+        self.assertEqual(summary.total, 33)
+        (heavy, (weight, error, *_)), (light, (light_weight, light_error, *_)) = summary.top(2)
+        self.assertEqual((heavy, weight, error), ('a', 30, 0))
+        # 'c' took over 'b' and inherits its weight as an error bound.
+        self.assertEqual((light, light_weight, light_error), ('c', 3, 1))
+
+    def test_report_flows(self):
+        packets = []
+        for index in range(4):
+            packet = IP(src="192.168.1.105", dst="192.168.1.111")/TCP(sport=1234, dport=80)/(b"x" * 100)
+            packet.time = 10.0 + index
+            packets.append(packet)
+        packet = IP(src="192.168.1.111", dst="192.168.1.105")/UDP(sport=53, dport=5353)/b"y"
+        packet.time = 11.5
+        packets.append(packet)
+        wrpcap(self.file1_path, packets)
+
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        try:
+            for use_cache in (False, True):
+                count, talkers, conversations = report_flows(self.file1_path, use_cache=use_cache,
+                                                             cache_dir=cache_dir, top=2)
+                self.assertEqual(count, 5)
+                (key, (weight, error, flow_packets, first, last)), _ = conversations.top(2)
+                self.assertEqual(key, (6, address_to_int("192.168.1.105"), 1234,
+                                       address_to_int("192.168.1.111"), 80))
+                self.assertEqual((weight, error, flow_packets, first, last), (4 * 140, 0, 4, 10.0, 13.0))
+                self.assertEqual([address for address, _ in talkers.top(2)],
+                                 [address_to_int("192.168.1.105"), address_to_int("192.168.1.111")])
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_geo(self):
+        sys.path.insert(0, IPFIND_DIR)
+        from ipfind import import_csv
+
+        packets = [IP(src="10.0.0.1", dst=dst)/UDP(sport=1, dport=2) for dst in
+                   ("81.212.1.1", "81.212.1.1", "8.8.8.8", "192.168.1.1")]
+        packets.append(IPv6(src="2001:db8::1", dst="2a02:e0::5")/UDP(sport=1, dport=2))
+        wrpcap(self.file1_path, packets)
+        csv_path = os.path.join(self.test_dir, 'countries.csv')
+        database_path = os.path.join(self.test_dir, 'countries.db')
+        try:
+            with open(csv_path, 'w') as file:
+                file.write("network,country\n81.212.0.0/14,TR\n8.8.8.0/24,US\n2a02:e0::/32,TR\n")
+            import_csv(csv_path, database_path)
+            geo = open_country_database(database_path)
+
+            table, = load_captures([[self.file1_path]], use_cache=False)
+            self.assertEqual(table_countries(table, 'dst', geo).tolist(), [b'TR', b'TR', b'US', b'', b'TR'])
+            self.assertEqual(country_counts(table, 'dst', geo), [('TR', 3), ('??', 1), ('US', 1)])
+            self.assertEqual(address_countries([address_to_int("8.8.8.8"), address_to_int("2001:db8::1")], geo),
+                             ['US', '??'])
+        finally:
+            for path in (csv_path, database_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_calculate_delays_with_id_wraparound(self):
+        packets1 = []
+        packets2 = []
+        for start in (100.0, 200.0):
+            for packet_id in (1, 2):
+                packet = IP(src="192.168.1.105", dst="192.168.1.111", id=packet_id)/UDP()/b"data"
+                packet.time = start + packet_id
+                packets1.append(packet)
+                packet = packet.copy()
+                packet.time = start + packet_id + 0.010
+                packets2.append(packet)
+        wrpcap(self.file1_path, packets1)
+        wrpcap(self.file2_path, packets2)
+
+        min_delay, max_delay, avg_delay, std_dev_delay = calculate_delays(
+            self.file1_path, self.file2_path, source='192.168.1.105', destination='192.168.1.111',
+            use_cache=False, max_delay=50)
+        self.assertAlmostEqual(min_delay, 10.0, places=3)
+        self.assertAlmostEqual(max_delay, 10.0, places=3)
+        self.assertAlmostEqual(std_dev_delay, 0.0, places=3)
+
+        min_delay, max_delay, avg_delay, std_dev_delay = calculate_delays(
+            self.file1_path, self.file2_path, source='192.168.1.105', destination='192.168.1.111',
+            use_cache=False)
+        self.assertAlmostEqual(min_delay, -99990.0, places=3)
+
+        min_delay, max_delay, avg_delay, std_dev_delay = calculate_delays(
+            self.file1_path, self.file2_path, source='192.168.1.105', destination='192.168.1.111',
+            use_cache=False, max_delay=50, streaming=True, top=2)
+        self.assertAlmostEqual(min_delay, 10.0, places=3)
+        self.assertAlmostEqual(avg_delay, 10.0, places=3)
+
+    def test_hop_joiner(self):
+        joiner = HopJoiner(3, max_delay=1.0)
+        self.assertEqual(joiner.add(0, 'a', 0.0), [])
+        self.assertEqual(joiner.add(2, 'a', 0.2), [])
+        self.assertEqual(joiner.add(1, 'a', 0.1), [])
+        self.assertEqual(joiner.add(1, 'b', 0.5), [])
+        self.assertEqual(joiner.add(0, 'a', 1.5), [[0.0, 0.1, 0.2]])
+        self.assertEqual(joiner.flush(), [[None, 0.5, None], [1.5, None, None]])
+
+    def test_calculate_hop_delays(self):
+        # Clocks at the second and third capture points run 100 ms and 50 ms
+        # ahead; the hops really take 5 ms and 7 ms in both directions.
+        paths = [os.path.join(self.test_dir, f'hop{i}.pcap') for i in range(3)]
+        offsets = [0.0, 0.100, 0.050]
+        forward = [0.0, 0.005, 0.012]
+        captures = [[], [], []]
+        for i in range(20):
+            start = 1000.0 + i
+            for hop in range(3):
+                packet = IP(src="10.0.0.1", dst="10.0.0.2", id=i)/UDP()/b"request"
+                packet.time = start + forward[hop] + offsets[hop]
+                captures[hop].append(packet)
+                reply = IP(src="10.0.0.2", dst="10.0.0.1", id=100 + i)/UDP()/b"reply"
+                reply.time = start + 0.5 + forward[2] - forward[hop] + offsets[hop]
+                captures[hop].append(reply)
+        for path, packets in zip(paths, captures):
+            wrpcap(path, sorted(packets, key=lambda packet: packet.time))
+        try:
+            hops, end_to_end, estimated = calculate_hop_delays(paths, "10.0.0.1", "10.0.0.2", use_cache=False,
+                                                               max_delay=500)
+            self.assertAlmostEqual(estimated[0], 100.0, places=3)
+            self.assertAlmostEqual(estimated[1], -50.0, places=3)
+            self.assertEqual([stats.count for stats in hops], [20, 20])
+            self.assertAlmostEqual(hops[0].mean, 5.0, places=3)
+            self.assertAlmostEqual(hops[1].mean, 7.0, places=3)
+            self.assertAlmostEqual(end_to_end.quantile(0.5), 12.0, delta=0.2)
+        finally:
+            for path in paths:
+                os.remove(path)
+
     def test_analyze_file_with_correct_path(self):
         packets = analyze_file(self.file_path)
         self.assertEqual(len(packets), 1, "Expected one packet in the test file.")
 
     def test_file_format(self):
-        valid_formats = ['.pcap', '.cap', '.pcang']
+        valid_formats = ['.pcap', '.cap', '.pcapng']
         file_name = "test_data.pcap"
         self.assertTrue(any(file_name.endswith(fmt) for fmt in valid_formats), 
                         f"File format should be one of {valid_formats}")
@@ -86,12 +331,319 @@ class TestInspector(unittest.TestCase):
         self.assertEqual(packets[0]['IP'].src, "192.168.1.105")
         self.assertEqual(packets[0]['IP'].dst, "192.168.1.111")
 
+    def test_stream_packets(self):
+        records = list(stream_packets(self.file_path, source="192.168.1.105"))
+        self.assertEqual(len(records), 1, "Expected to stream one packet.")
+        self.assertEqual(int_to_address(records[0].src), "192.168.1.105")
+        self.assertEqual(int_to_address(records[0].dst), "192.168.1.111")
+        self.assertEqual(records[0].length, 24)
+
+        records = list(stream_packets(self.file_path, source="192.168.1.111"))
+        self.assertEqual(records, [])
+
+    def test_compressed_captures(self):
+        expected = list(read_records(self.file_path))
+        for extension, opener in (('.gz', gzip.open), ('.xz', lzma.open), ('.bz2', bz2.open)):
+            path = self.file_path + extension
+            try:
+                with open(self.file_path, 'rb') as source, opener(path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                self.assertEqual(list(read_records(path)), expected)
+                self.assertIsNone(split_capture(path, 4))
+            finally:
+                os.remove(path)
+
+    def test_pcapng_timestamp_resolution(self):
+        packet = bytes(IP(src="192.168.1.105", dst="192.168.1.111", id=7)/UDP()/b"data")
+
+        def block(block_type, body):
+            body += b'\0' * (-len(body) % 4)
+            return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+        section = block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+        # if_tsresol 9: nanosecond timestamps; the second interface uses 2^-10 seconds.
+        nanoseconds = block(1, struct.pack('<HHI', 101, 0, 0) + struct.pack('<HHB', 9, 1, 9) + b'\0' * 3
+                            + struct.pack('<HH', 0, 0))
+        binary = block(1, struct.pack('<HHI', 101, 0, 0) + struct.pack('<HHB', 9, 1, 0x80 | 10) + b'\0' * 3)
+        ticks = 1500000000 * 10 ** 9 + 250000000
+        first = block(6, struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xffffffff, len(packet), len(packet)) + packet)
+        second = block(6, struct.pack('<IIIII', 1, 0, 3 * 1024 + 512, len(packet), len(packet)) + packet)
+        simple = block(3, struct.pack('<I', len(packet)) + packet)
+        with open(self.file1_path, 'wb') as file:
+            file.write(section + nanoseconds + binary + first + second + simple)
+
+        records = list(read_records(self.file1_path))
+        self.assertEqual([(time, length, linktype) for time, length, linktype, _ in records],
+                         [(1500000000.25, len(packet), 101), (3.5, len(packet), 101), (3.5, len(packet), 101)])
+        self.assertEqual(records[2][3], packet)
+        self.assertEqual(next(stream_packets(self.file1_path)).ip_id, 7)
+
+    def test_stream_packets_matches_scapy(self):
+        path = os.path.join(self.test_dir, 'mixed.pcap')
+        packets = [
+            Ether()/IP(src="10.0.0.1", dst="10.0.0.2", id=7)/TCP(),
+            Ether()/IP(src="10.0.0.1", dst="10.0.0.3", id=8)/UDP(),
+            Ether()/IP(src="10.0.0.1", dst="10.0.0.2", id=9, frag=10)/b"fragment",
+            Ether()/IPv6(src="2001:db8::1", dst="2001:db8::2")/TCP(),
+        ]
+        wrpcap(path, packets)
+        try:
+            for protocol in (None, 'TCP', 'UDP', 'Raw'):
+                expected = [(packet['IP'].id, packet['IP'].dst) for packet in analyze_file(path, source="10.0.0.1", protocol=protocol)]
+                records = stream_packets(path, source="10.0.0.1", protocol=protocol)
+                self.assertEqual([(record.ip_id, int_to_address(record.dst)) for record in records], expected)
+
+            records = list(stream_packets(path, destination="2001:db8::2", protocol='TCP'))
+            self.assertEqual(len(records), 1)
+            self.assertEqual(int_to_address(records[0].src), "2001:db8::1")
+        finally:
+            os.remove(path)
+
+    def test_address_round_trip(self):
+        for address in ("192.168.1.105", "2001:db8::1", "::1"):
+            self.assertEqual(int_to_address(address_to_int(address)), address)
+        self.assertNotEqual(address_to_int("0.0.0.1"), address_to_int("::1"))
+
+    def test_packet_table_cache(self):
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        try:
+            table = load_packet_table(self.file_path, cache_dir)
+            self.assertIsInstance(table, np.memmap)
+            self.assertEqual(len(table), 1)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached = os.listdir(cache_dir)[0]
+
+            table = load_packet_table(self.file_path, cache_dir)
+            self.assertEqual(int(table['ip_id'][0]), 1)
+            self.assertEqual(os.listdir(cache_dir), [cached])
+
+            wrpcap(self.file_path, [IP(src="192.168.1.105", dst="192.168.1.111")/TCP()] * 3)
+            table = load_packet_table(self.file_path, cache_dir)
+            self.assertEqual(len(table), 3)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertNotEqual(os.listdir(cache_dir), [cached])
+
+            self.assertEqual(len(load_packets(self.file_path, protocol='TCP', cache_dir=cache_dir)), 3)
+            self.assertEqual(len(load_packets(self.file_path, protocol='UDP', cache_dir=cache_dir)), 0)
+            self.assertEqual(len(load_packets(self.file_path, source="192.168.1.111", cache_dir=cache_dir)), 0)
+            self.assertEqual(len(load_packets(self.file_path, protocol='TCP', use_cache=False)), 3)
+
+            # A cache that cannot be written falls back to an in-memory table.
+            unwritable = os.path.join(self.file_path, 'cache')
+            self.assertEqual(len(load_packets(self.file_path, protocol='TCP', cache_dir=unwritable)), 3)
+            packets, = load_captures([[self.file_path]], protocol='TCP', cache_dir=unwritable, workers=2)
+            self.assertEqual(len(packets), 3)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    @patch('inspector.MIN_SPLIT_BYTES', 1000)
+    def test_split_capture(self):
+        packets = [IP(src="10.0.0.1", dst="10.0.0.2", id=i)/UDP()/(b"\xd4\xc3\xb2\xa1" * (i % 40)) for i in range(300)]
+        wrpcap(self.file_path, packets)
+
+        ranges = split_capture(self.file_path, 4)
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], 24)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.file_path))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+        parts = np.concatenate([decode_range(self.file_path, start, end) for start, end in ranges])
+        self.assertEqual(parts['ip_id'].tolist(), list(range(300)))
+
+        serial, = load_captures([[self.file_path]], source="10.0.0.1", use_cache=False)
+        parallel, = load_captures([[self.file_path]], source="10.0.0.1", use_cache=False, workers=2)
+        self.assertTrue(np.array_equal(serial, parallel))
+
+        # Runs of zero bytes in payloads are not taken for record headers.
+        packets = [Ether()/IP(src="10.0.0.1", dst="10.0.0.2", id=i)/UDP()/(b"\0" * 600) for i in range(300)]
+        wrpcap(self.file_path, packets)
+        ranges = split_capture(self.file_path, 4)
+        parts = np.concatenate([decode_range(self.file_path, start, end) for start, end in ranges])
+        self.assertEqual(parts['ip_id'].tolist(), list(range(300)))
+        parallel, = load_captures([[self.file_path]], source="10.0.0.1", use_cache=False, workers=2)
+        self.assertEqual(parallel['ip_id'].tolist(), list(range(300)))
+
+        # A range that does not end on a record boundary is an error, and a
+        # split capture with one is decoded again in one piece.
+        with self.assertRaises(RecordBoundaryError):
+            decode_range(self.file_path, 24, 24 + 100)
+        with patch('inspector.split_capture', return_value=[(24, 124), (124, os.path.getsize(self.file_path))]):
+            parallel, = load_captures([[self.file_path]], use_cache=False, workers=2)
+        self.assertEqual(parallel['ip_id'].tolist(), list(range(300)))
+
+        # Ranges are submitted as earlier ones are taken, and a false boundary
+        # after the first range only decodes the rest of the file again.
+        submitted = []
+        def submit(function, *args):
+            submitted.append(args[1:])
+            future = Future()
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        executor = Mock(submit=submit)
+        ranges = split_capture(self.file_path, 4)
+        decoder = RangeDecoder(executor, self.file_path, ranges, 2)
+        self.assertEqual(submitted, ranges[:2])
+        tables = decoder.tables()
+        next(tables)
+        self.assertEqual(submitted, ranges[:3])
+        # Taken again, the tables are decoded again.
+        self.assertEqual(np.concatenate(list(decoder.tables()))['ip_id'].tolist(), list(range(300)))
+        start = ranges[1][0]
+        decoder = RangeDecoder(executor, self.file_path,
+                               [ranges[0], (start, start + 100), (start + 100, ranges[-1][1])], 2)
+        self.assertEqual(np.concatenate(list(decoder.tables()))['ip_id'].tolist(), list(range(300)))
+
+    def test_expand_capture_paths(self):
+        rotated = [os.path.join(self.test_dir, f'rotated{i}.pcap') for i in (10, 2, 1)]
+        for path in rotated:
+            wrpcap(path, [IP(src="10.0.0.1", dst="10.0.0.2")])
+        try:
+            expected = sorted(rotated, key=lambda path: int(path[len(self.test_dir) + 8:-5]))
+            self.assertEqual(expand_capture_paths(os.path.join(self.test_dir, 'rotated*.pcap')), expected)
+            self.assertEqual(expand_capture_paths(self.file_path), [self.file_path])
+
+            packets, = load_captures([expected], source="10.0.0.1", use_cache=False, workers=2)
+            self.assertEqual(len(packets), 3)
+        finally:
+            for path in rotated:
+                os.remove(path)
+
+        # tcpdump -C rotation: cap.pcap, cap.pcap1, cap.pcap2, ...
+        rotation_dir = os.path.join(self.test_dir, 'rotation')
+        os.makedirs(rotation_dir)
+        try:
+            names = ['cap.pcap', 'cap.pcap1', 'cap.pcap2', 'cap.pcap10', 'cap.pcap11.gz']
+            for name in names:
+                wrpcap(os.path.join(rotation_dir, name), [IP(src="10.0.0.1", dst="10.0.0.2")])
+            expected = [os.path.join(rotation_dir, name) for name in names]
+            self.assertEqual(expand_capture_paths(rotation_dir), expected)
+            self.assertEqual(expand_capture_paths(os.path.join(rotation_dir, 'cap.pcap*')), expected)
+            with patch('sys.argv', ['inspector.py', os.path.join(rotation_dir, 'cap.pcap*'), '--source', '10.0.0.1']):
+                self.assertEqual(parse_arguments().file_paths, [os.path.join(rotation_dir, 'cap.pcap*')])
+        finally:
+            shutil.rmtree(rotation_dir)
+
+    def test_capture_follower(self):
+        source_path = os.path.join(self.test_dir, 'source.pcap')
+        live_path = os.path.join(self.test_dir, 'live1.pcap')
+        rotated_path = os.path.join(self.test_dir, 'live2.pcap')
+        wrpcap(source_path, [IP(src="10.0.0.1", dst="10.0.0.2", id=i)/UDP() for i in range(3)])
+        with open(source_path, 'rb') as file:
+            data = file.read()
+        record_size = (len(data) - 24) // 3
+        try:
+            follower = CaptureFollower(os.path.join(self.test_dir, 'live*.pcap'))
+            with open(live_path, 'wb') as file:
+                file.write(data[:10])
+            self.assertEqual(follower.poll(), [])
+
+            with open(live_path, 'ab') as file:
+                file.write(data[10:24 + record_size + 5])
+            self.assertEqual(len(follower.poll()), 1)
+
+            with open(live_path, 'ab') as file:
+                file.write(data[24 + record_size + 5:])
+            self.assertEqual(len(follower.poll()), 2)
+            self.assertEqual(follower.poll(), [])
+
+            with open(rotated_path, 'wb') as file:
+                file.write(data)
+            self.assertEqual(len(follower.poll()), 3)
+            self.assertEqual(follower.current, rotated_path)
+        finally:
+            for path in (source_path, live_path, rotated_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_follow_captures(self):
+        with patch('builtins.print'):
+            total, peers = follow_captures([self.file_path], source="192.168.1.105", iterations=1)
+            self.assertEqual(total, 1)
+            self.assertEqual({int_to_address(peer) for peer in peers}, {"192.168.1.111"})
+
+            stats = follow_captures([self.file1_path, self.file2_path], source="192.168.1.105",
+                                    destination="192.168.1.111", iterations=2, interval=0)
+            self.assertEqual(stats.count, 1)
+            self.assertAlmostEqual(stats.mean, 0.0, places=3)
+
+    def test_follow_captures_lagging_tap(self):
+        # The second tap writes nothing on the first poll, while the first has
+        # already moved ten seconds on. The second tap's packets are still
+        # matched, because it has not been quiet for long.
+        first = IP(src="192.168.1.105", dst="192.168.1.111")/b"data"
+        first.time = 1000.0
+        later = IP(src="192.168.1.105", dst="192.168.1.111")/b"more"
+        later.time = 1010.0
+        wrpcap(self.file1_path, [first, later])
+        first.time = 1000.001
+        wrpcap(self.file2_path, [first])
+        poll = CaptureFollower.poll
+        calls = []
+        def lagging_poll(follower):
+            calls.append(follower.path)
+            if follower.path == self.file2_path and calls.count(self.file2_path) == 1:
+                return []
+            return poll(follower)
+
+        with patch('builtins.print'), patch.object(CaptureFollower, 'poll', lagging_poll):
+            stats = follow_captures([self.file1_path, self.file2_path], source="192.168.1.105",
+                                    destination="192.168.1.111", iterations=2, interval=0)
+        self.assertEqual(stats.count, 1)
+
+        # Once a tap has been quiet for FOLLOW_QUIET_SECONDS it no longer holds
+        # the other back, and its older packets are skipped as late.
+        packet = IP(src="192.168.1.105", dst="192.168.1.111")/b"data"
+        packet.time = 1000.002
+        wrpcap(self.file1_path, [packet])
+        packet.time = 1000.001
+        wrpcap(self.file2_path, [packet])
+        calls.clear()
+        output = io.StringIO()
+        with patch('sys.stdout', output), patch.object(CaptureFollower, 'poll', lagging_poll), \
+                patch('inspector.FOLLOW_QUIET_SECONDS', 0):
+            stats = follow_captures([self.file1_path, self.file2_path], source="192.168.1.105",
+                                    destination="192.168.1.111", iterations=2, interval=0)
+        self.assertEqual(stats.count, 0)
+        self.assertIn("Late packets skipped: 1", output.getvalue())
+
+    def test_stats(self):
+        stderr = io.StringIO()
+        with patch('sys.stdout', io.StringIO()), patch('sys.stderr', stderr):
+            with instrumented(STATS, True, 'json'):
+                calculate_delays(self.file1_path, self.file2_path, "192.168.1.105", "192.168.1.111", use_cache=False)
+        self.assertFalse(STATS.enabled)
+        report = json.loads(stderr.getvalue())
+        self.assertEqual(report['packets'], 2)
+        self.assertEqual(report['input_bytes'], os.path.getsize(self.file1_path) + os.path.getsize(self.file2_path))
+        self.assertLessEqual({'parse', 'match', 'output'}, set(report['stages']))
+        self.assertAlmostEqual(sum(stage['wall_seconds'] for stage in report['stages'].values()),
+                               report['wall_seconds'])
+
+        # Disabled, stages record nothing.
+        with STATS.stage('parse'):
+            pass
+        self.assertEqual(STATS.report()['packets'], 2)
+        self.assertEqual(set(STATS.stages), set(report['stages']))
+
+    def test_stream_packets_missing_file(self):
+        records = list(stream_packets(os.path.join(self.test_dir, 'missing.pcap')))
+        self.assertEqual(records, [])
+
     @patch('argparse.ArgumentParser.parse_args')
     def test_calculate_delays_with_one_file(self, mock_parse_args):
         mock_parse_args.return_value = argparse.Namespace(
             file_paths=[self.file_path],
             source=None,
-            destination=None
+            destination=None,
+            flows=False,
+            geo=None,
+            streaming=False,
+            max_delay=None,
+            follow=False
         )
         
         with self.assertRaises(ArgumentException) as cm:
@@ -103,7 +655,12 @@ class TestInspector(unittest.TestCase):
         mock_parse_args.return_value = argparse.Namespace(
             file_paths=[self.file1_path, self.file2_path],
             source='192.168.1.105',
-            destination='192.168.1.111'
+            destination='192.168.1.111',
+            flows=False,
+            geo=None,
+            streaming=False,
+            max_delay=None,
+            follow=False
         )
         
         args = parse_arguments()
@@ -1,25 +1,445 @@
-from urllib import request
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+import argparse
+import csv
+import http.client
+import ipaddress
 import json
+import os
+import sqlite3
+import struct
 import sys
+import threading
+import time
 
-def ipfind(ip_address):
-    url = f"https://api.country.is/{ip_address}/"
+API_URL = "https://api.country.is"
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 10
+# Rate limited (429) or overloaded (503) requests are retried this many times,
+# after Retry-After or an exponential backoff starting at BACKOFF_SECONDS.
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30
+# Answers are cached for this long; errors other than an unknown or invalid
+# address are never cached.
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ipfind',
+                                  'countries.sqlite')
+# SQLite limits the number of parameters in one query.
+CACHE_QUERY_ADDRESSES = 500
+CACHE_SCHEMA = "CREATE TABLE IF NOT EXISTS countries (ip TEXT PRIMARY KEY, country TEXT, status INTEGER, time REAL)"
+
+# Offline country database: a header, then sorted, disjoint address ranges as
+# arrays of first and last addresses: IPv6 by /64 prefix (the high 64 bits) as
+# uint64, then IPv4 as uint32, then the two-letter country codes of the IPv4
+# and of the IPv6 ranges. The file is memory-mapped, so loading it is instant.
+DATABASE_MAGIC = b'IPFINDDB'
+DATABASE_VERSION = 1
+DATABASE_HEADER = struct.Struct('<8sI4xQQ')
+IPV4_MAPPED = 0xffff << 32
+
+def _result(ip_address, country=None, status=None, error=None, cached=False):
+    # A lookup result: the country code, or the HTTP status and error why there is none.
+    return {'ip': ip_address, 'country': country, 'status': status, 'error': error, 'cached': cached}
+
+class CountryClient:
+    """Looks up the country codes of IP addresses from a country.is style API.
+
+    Every thread keeps its own keep-alive connection to base_url. When the
+    API answers 429 or 503 every thread waits for the Retry-After time (or a
+    doubling backoff) before its next request.
+    """
+
+    def __init__(self, base_url=API_URL, timeout=REQUEST_TIMEOUT, retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+        url = parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.path = url.path.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.resume_at = 0
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.host, timeout=self.timeout)
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def _wait(self):
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def _get(self, ip_address):
+        # (status, headers, body) of one request. A keep-alive connection the
+        # server has closed in the meantime is replaced once.
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('GET', f"{self.path}/{parse.quote(ip_address)}/")
+                response = connection.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt:
+                    raise
+
+    def lookup(self, ip_address):
+        try:
+            ipaddress.ip_address(ip_address)
+        except ValueError:
+            return _result(ip_address, error="invalid address")
+
+        for attempt in range(self.retries + 1):
+            self._wait()
+            try:
+                status, headers, body = self._get(ip_address)
+            except (http.client.HTTPException, OSError) as e:
+                return _result(ip_address, error=str(e) or type(e).__name__)
+            if status in RETRY_STATUSES and attempt < self.retries:
+                retry_after = headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                self._pause(min(delay, MAX_BACKOFF_SECONDS))
+                continue
+            if status != 200:
+                return _result(ip_address, status=status, error=http.client.responses.get(status, 'error'))
+            try:
+                country = json.loads(body).get('country')
+            except (ValueError, AttributeError):
+                return _result(ip_address, status=status, error="invalid response")
+            if not country:
+                return _result(ip_address, status=status, error="no country")
+            return _result(ip_address, country=country, status=status)
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
+
+class LookupCache:
+    """SQLite cache of lookup results that expire after ttl seconds.
+
+    Only answers about an address are kept: a country, or a 4xx status for
+    an address the API does not know. Network errors and rate limits are not.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(CACHE_SCHEMA)
+
+    def get(self, ip_addresses):
+        # {ip: result} of the addresses with a fresh entry.
+        results = {}
+        oldest = time.time() - self.ttl
+        ip_addresses = list(ip_addresses)
+        for start in range(0, len(ip_addresses), CACHE_QUERY_ADDRESSES):
+            chunk = ip_addresses[start:start + CACHE_QUERY_ADDRESSES]
+            placeholders = ', '.join('?' * len(chunk))
+            for ip_address, country, status in self.connection.execute(
+                    f"SELECT ip, country, status FROM countries WHERE time >= ? AND ip IN ({placeholders})",
+                    [oldest, *chunk]):
+                error = None if country else http.client.responses.get(status, 'error')
+                results[ip_address] = _result(ip_address, country, status, error, cached=True)
+        return results
+
+    def put(self, results):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO countries VALUES (?, ?, ?, ?)",
+                [(result['ip'], result['country'], result['status'], now) for result in results
+                 if result['country'] or (result['status'] and 400 <= result['status'] < 500
+                                          and result['status'] not in RETRY_STATUSES)])
+
+    def close(self):
+        self.connection.close()
+
+def bulk_lookup(ip_addresses, workers=DEFAULT_WORKERS, base_url=API_URL, cache_path=DEFAULT_CACHE_PATH,
+                ttl=DEFAULT_CACHE_TTL):
+    # {ip: result} for every distinct address, in the order first seen.
+    # Cached answers are used as they are; the rest are looked up by up to
+    # workers threads and cached. cache_path=None disables the cache.
+    ip_addresses = list(dict.fromkeys(ip_address.strip() for ip_address in ip_addresses if ip_address.strip()))
+    cache = LookupCache(cache_path, ttl) if cache_path else None
     try:
-        response = request.urlopen(url)
-        if response.getcode() == 200:                   #200 değeri sunucu isteği alınımış demek#
-            data = response.read()
-            json_data = json.loads(data)
-            if 'country' in json_data:
-               print("IP adresi ülke kodu:",json_data['country']) 
+        results = cache.get(ip_addresses) if cache else {}
+        missing = [ip_address for ip_address in ip_addresses if ip_address not in results]
+        if missing:
+            client = CountryClient(base_url)
+            try:
+                with ThreadPoolExecutor(max(1, min(workers, len(missing)))) as executor:
+                    found = list(executor.map(client.lookup, missing))
+            finally:
+                client.close()
+            results.update((result['ip'], result) for result in found)
+            if cache:
+                cache.put(found)
+    finally:
+        if cache:
+            cache.close()
+    return {ip_address: results[ip_address] for ip_address in ip_addresses}
+
+def _csv_address(field):
+    # CSV address columns may also hold the address as an integer.
+    return ipaddress.ip_address(int(field) if field.isdigit() else field)
+
+def read_ranges(csv_path):
+    # (IPv4 ranges, IPv6 ranges) of (first, last, country) from CSV rows of
+    # network,country (e.g. 81.212.0.0/14,TR) or first,last,country with
+    # addresses or integers. Columns after these are ignored, and so is a
+    # header line. IPv6 ranges are rounded out to /64 prefixes.
+    ranges = ([], [])
+    with open(csv_path, 'r', newline='') as file:
+        for number, row in enumerate(csv.reader(file), 1):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            try:
+                try:
+                    first, last = _csv_address(row[0]), _csv_address(row[1])
+                    country = row[2]
+                except ValueError:
+                    network = ipaddress.ip_network(row[0], strict=False)
+                    first, last, country = network.network_address, network.broadcast_address, row[1]
+                if first.version != last.version or first > last:
+                    raise ValueError("invalid range")
+                country = country.upper().encode('ascii')
+                if len(country) > 2:
+                    raise ValueError("invalid country code")
+            except (ValueError, IndexError, UnicodeEncodeError) as e:
+                if number == 1:
+                    continue
+                raise ValueError(f"{csv_path}:{number}: {e}")
+            if first.version == 4:
+                ranges[0].append((int(first), int(last), country))
+            else:
+                ranges[1].append((int(first) >> 64, int(last) >> 64, country))
+    return ranges
+
+def flatten_ranges(ranges):
+    # Sorted, disjoint (first, last, country) ranges. Where ranges overlap
+    # the more specific (nested) one wins, and neighbouring ranges of the
+    # same country are joined.
+    flat = []
+    starts = []
+    for first, last, country in sorted(ranges, key=lambda item: (item[0], -item[1])):
+        index = bisect_right(starts, first) - 1
+        if index >= 0 and flat[index][1] >= first:
+            outer_first, outer_last, outer_country = flat[index]
+            if last > outer_last:
+                raise ValueError(f"overlapping ranges {outer_first}-{outer_last} and {first}-{last}")
+            pieces = [(first, last, country)]
+            if outer_first < first:
+                pieces.insert(0, (outer_first, first - 1, outer_country))
+            if last < outer_last:
+                pieces.append((last + 1, outer_last, outer_country))
+            flat[index:index + 1] = pieces
+            starts[index:index + 1] = [piece[0] for piece in pieces]
         else:
-            print('Hatali bir IP adresi girdiniz!: ', response.getcode())
-    except Exception as e:
-        print(f"Hatali bir IP adresi girdiniz! ",e)
+            flat.append((first, last, country))
+            starts.append(first)
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Kullanim: python script.py <ip_address>")
+    joined = []
+    for first, last, country in flat:
+        if joined and joined[-1][2] == country and joined[-1][1] + 1 == first:
+            joined[-1] = (joined[-1][0], last, country)
+        else:
+            joined.append((first, last, country))
+    return joined
+
+def import_csv(csv_path, database_path):
+    # Builds the offline database from a CSV file (see read_ranges) and
+    # returns the number of IPv4 and IPv6 ranges in it.
+    import numpy as np
+
+    v4, v6 = (flatten_ranges(ranges) for ranges in read_ranges(csv_path))
+    if os.path.dirname(database_path):
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    temporary_path = f"{database_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(DATABASE_HEADER.pack(DATABASE_MAGIC, DATABASE_VERSION, len(v4), len(v6)))
+        for ranges, dtype in ((v6, '<u8'), (v4, '<u4')):
+            for column in range(2):
+                file.write(np.array([item[column] for item in ranges], dtype=dtype).tobytes())
+        for ranges in (v4, v6):
+            file.write(np.array([item[2] for item in ranges], dtype='S2').tobytes())
+    os.replace(temporary_path, database_path)
+    return len(v4), len(v6)
+
+class CountryDatabase:
+    """The offline database, memory-mapped, answering lookups by binary search.
+
+    The bulk lookups take arrays and return arrays of two-letter country
+    codes as bytes, b'' where no range holds the address.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.np = np
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(data) < DATABASE_HEADER.size:
+            raise ValueError(f"{path} is not an ipfind country database")
+        magic, version, v4_count, v6_count = DATABASE_HEADER.unpack(bytes(data[:DATABASE_HEADER.size]))
+        if magic != DATABASE_MAGIC or version != DATABASE_VERSION:
+            raise ValueError(f"{path} is not an ipfind country database")
+        offset = DATABASE_HEADER.size
+        arrays = []
+        for count, dtype in ((v6_count, '<u8'), (v6_count, '<u8'), (v4_count, '<u4'), (v4_count, '<u4'),
+                             (v4_count, 'S2'), (v6_count, 'S2')):
+            size = count * np.dtype(dtype).itemsize
+            arrays.append(data[offset:offset + size].view(dtype))
+            offset += size
+        self.v6_first, self.v6_last, self.v4_first, self.v4_last, self.v4_countries, self.v6_countries = arrays
+
+    def _search(self, firsts, lasts, countries, values):
+        np = self.np
+        values = np.asarray(values, dtype=firsts.dtype)
+        if not len(firsts) or not len(values):
+            return np.zeros(len(values), dtype='S2')
+        # Packets repeat a few addresses many times, and a binary search in
+        # sorted order stays in cache, so each distinct value is searched once.
+        values, inverse = np.unique(values, return_inverse=True)
+        index = np.maximum(np.searchsorted(firsts, values, side='right') - 1, 0)
+        found = (firsts[index] <= values) & (values <= lasts[index])
+        return np.where(found, countries[index], b'')[inverse]
+
+    def lookup_v4(self, addresses):
+        # addresses: IPv4 addresses as integers.
+        return self._search(self.v4_first, self.v4_last, self.v4_countries, addresses)
+
+    def lookup_v6(self, prefixes):
+        # prefixes: the high 64 bits of IPv6 addresses.
+        return self._search(self.v6_first, self.v6_last, self.v6_countries, prefixes)
+
+    def lookup_words(self, high, low):
+        # Addresses as 128-bit integers split into high and low 64-bit words,
+        # with IPv4 addresses in their IPv4-mapped form (::ffff:a.b.c.d).
+        np = self.np
+        high = np.asarray(high, dtype=np.uint64)
+        low = np.asarray(low, dtype=np.uint64)
+        v4 = (high == 0) & ((low >> np.uint64(32)) == np.uint64(0xffff))
+        countries = np.zeros(len(high), dtype='S2')
+        countries[v4] = self.lookup_v4((low[v4] & np.uint64(0xffffffff)).astype(np.uint32))
+        countries[~v4] = self.lookup_v6(high[~v4])
+        return countries
+
+    def lookup_many(self, ip_addresses):
+        # The country code (or None) of each address string.
+        np = self.np
+        values = [int(address) if address.version == 6 else IPV4_MAPPED | int(address)
+                  for address in map(ipaddress.ip_address, ip_addresses)]
+        countries = self.lookup_words(np.array([value >> 64 for value in values], dtype=np.uint64),
+                                      np.array([value & 0xffffffffffffffff for value in values], dtype=np.uint64))
+        return [country.decode() or None for country in countries.tolist()]
+
+    def lookup(self, ip_address):
+        return self.lookup_many([ip_address])[0]
+
+def offline_lookup(ip_addresses, database_path):
+    # bulk_lookup from the offline database instead of the API.
+    ip_addresses = list(dict.fromkeys(ip_address.strip() for ip_address in ip_addresses if ip_address.strip()))
+    database = CountryDatabase(database_path)
+    results = {}
+    valid = []
+    for ip_address in ip_addresses:
+        try:
+            ipaddress.ip_address(ip_address)
+            valid.append(ip_address)
+        except ValueError:
+            results[ip_address] = _result(ip_address, error="invalid address")
+    for ip_address, country in zip(valid, database.lookup_many(valid)):
+        results[ip_address] = _result(ip_address, country, error=None if country else "not found")
+    return {ip_address: results[ip_address] for ip_address in ip_addresses}
+
+def read_addresses(file):
+    # One address per line; blank lines and lines starting with # are skipped.
+    return [line.strip() for line in file if line.strip() and not line.lstrip().startswith('#')]
+
+def format_result(result):
+    if result['country']:
+        return f"IP adresi ülke kodu: {result['country']}"
+    return f"Hatali bir IP adresi girdiniz!: {result['status'] or result['error']}"
+
+def ipfind(ip_address, base_url=API_URL):
+    client = CountryClient(base_url)
+    try:
+        print(format_result(client.lookup(ip_address)))
+    finally:
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="IP adreslerinin ülke kodlarini bulur.")
+    parser.add_argument('ip_addresses', nargs='*', help="IP adresleri")
+    parser.add_argument('--file', help="Her satirinda bir IP adresi olan dosya (- ise standart girdi)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Ayni anda yapilan sorgu sayisi (varsayilan: {DEFAULT_WORKERS})")
+    parser.add_argument('--base-url', default=API_URL, help=f"Sorgulanan API adresi (varsayilan: {API_URL})")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help=f"Sonuclarin saklandigi SQLite dosyasi (varsayilan: {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help="Onbellegi kullanma")
+    parser.add_argument('--ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help="Onbellekteki sonuclarin gecerlilik suresi, saniye")
+    parser.add_argument('--json', action='store_true', help="Sonuclari JSON olarak yaz")
+    parser.add_argument('--offline', metavar='DB', help="API yerine bu çevrimdışı veritabanini kullan")
+    parser.add_argument('--import-csv', metavar='CSV',
+                        help="--offline veritabanini ag,ülke veya ilk,son,ülke satirlari olan CSV dosyasindan oluştur")
+    args = parser.parse_args()
+
+    if args.import_csv:
+        if not args.offline:
+            parser.error("--import-csv için --offline DB gerekli")
+        try:
+            v4_count, v6_count = import_csv(args.import_csv, args.offline)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{args.offline}: {v4_count} IPv4, {v6_count} IPv6 aralik")
+        if not args.ip_addresses and not args.file:
+            return
+
+    ip_addresses = list(args.ip_addresses)
+    if args.file == '-':
+        ip_addresses.extend(read_addresses(sys.stdin))
+    elif args.file:
+        with open(args.file, 'r') as file:
+            ip_addresses.extend(read_addresses(file))
+    if not ip_addresses:
+        print("Kullanim: python ipfind.py <ip_address> [...] | --file <dosya>")
         sys.exit(1)
 
-    ip_address = sys.argv[1]
-    ipfind(ip_address)
+    if args.offline:
+        results = offline_lookup(ip_addresses, args.offline)
+    else:
+        results = bulk_lookup(ip_addresses, args.workers, args.base_url, args.cache if args.use_cache else None,
+                              args.ttl)
+    if args.json:
+        json.dump(list(results.values()), sys.stdout, indent=2)
+        print()
+    elif len(results) == 1 and not args.file:
+        result, = results.values()
+        print(format_result(result))
+    else:
+        for ip_address, result in results.items():
+            print(f"{ip_address}\t{format_result(result)}")
+
+if __name__ == "__main__":
+    main()
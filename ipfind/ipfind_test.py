@@ -0,0 +1,159 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from ipfind import CountryClient, CountryDatabase, bulk_lookup, flatten_ranges, import_csv, ipfind, offline_lookup
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # country.is look-alike: /<ip>/ answers {"ip": ..., "country": ...}.
+    # 10.x addresses are unknown (404); 192.0.2.x addresses are rate limited
+    # on their first request.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        ip_address = self.path.strip('/')
+        with self.server.lock:
+            self.server.requests.append(ip_address)
+            self.server.clients.add(self.client_address)
+            first = self.server.requests.count(ip_address) == 1
+        if ip_address.startswith('192.0.2.') and first:
+            self._reply(429, {'error': 'rate limited'}, {'Retry-After': '0'})
+        elif ip_address.startswith('10.'):
+            self._reply(404, {'error': 'not found'})
+        else:
+            self._reply(200, {'ip': ip_address, 'country': 'TR' if ip_address.startswith('85.') else 'US'})
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class IpFindTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.clients = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'countries.sqlite')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_lookup(self):
+        client = CountryClient(self.base_url, backoff=0)
+        try:
+            self.assertEqual(client.lookup('85.1.2.3')['country'], 'TR')
+            self.assertEqual(client.lookup('2001:db8::1')['country'], 'US')
+            result = client.lookup('10.0.0.1')
+            self.assertEqual((result['country'], result['status']), (None, 404))
+            # Rate limited once, then answered.
+            self.assertEqual(client.lookup('192.0.2.1')['country'], 'US')
+            self.assertEqual(client.lookup('not an address')['error'], 'invalid address')
+        finally:
+            client.close()
+        # One thread, one keep-alive connection.
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(self.server.requests, ['85.1.2.3', '2001%3Adb8%3A%3A1', '10.0.0.1', '192.0.2.1',
+                                                '192.0.2.1'])
+
+    def test_bulk_lookup(self):
+        ip_addresses = ['85.0.0.1', '8.8.8.8', '85.0.0.1', ' 10.1.1.1 ', '192.0.2.7', '', 'bogus',
+                        *(f'1.1.1.{n}' for n in range(20))]
+        results = bulk_lookup(ip_addresses, workers=4, base_url=self.base_url, cache_path=self.cache_path)
+        self.assertEqual(list(results)[:5], ['85.0.0.1', '8.8.8.8', '10.1.1.1', '192.0.2.7', 'bogus'])
+        self.assertEqual(len(results), 25)
+        self.assertEqual(results['85.0.0.1'], {'ip': '85.0.0.1', 'country': 'TR', 'status': 200, 'error': None,
+                                               'cached': False})
+        self.assertEqual(results['10.1.1.1']['status'], 404)
+        self.assertEqual(results['192.0.2.7']['country'], 'US')
+        # Each address is asked for once (twice for the rate limited one),
+        # over at most one connection per worker.
+        self.assertEqual(len(self.server.requests), 25)
+        self.assertLessEqual(len(self.server.clients), 4)
+
+        # Answers, including the unknown address, come from the cache next time.
+        results = bulk_lookup(ip_addresses, base_url=self.base_url, cache_path=self.cache_path)
+        self.assertEqual(len(self.server.requests), 25)
+        self.assertTrue(results['10.1.1.1']['cached'])
+        self.assertEqual(results['85.0.0.1']['country'], 'TR')
+        # Expired entries are looked up again.
+        bulk_lookup(['85.0.0.1'], base_url=self.base_url, cache_path=self.cache_path, ttl=-1)
+        self.assertEqual(len(self.server.requests), 26)
+
+    def test_ipfind(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            ipfind('85.1.2.3', self.base_url)
+            ipfind('10.0.0.1', self.base_url)
+        self.assertEqual(output.getvalue().splitlines(),
+                         ["IP adresi ülke kodu: TR", "Hatali bir IP adresi girdiniz!: 404"])
+
+class OfflineDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.directory.name, 'countries.csv')
+        self.database_path = os.path.join(self.directory.name, 'countries.db')
+        with open(self.csv_path, 'w') as file:
+            file.write("network,country\n"
+                       "81.212.0.0/14,tr\n"
+                       "81.212.5.0/24,DE\n"
+                       "8.8.8.0/24,US\n"
+                       "8.8.9.0/24,US\n"
+                       "2a02:e0::/32,TR\n"
+                       "2001:db8:1::/48,NL\n"
+                       "16777216,16777471,AU\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_flatten_ranges(self):
+        self.assertEqual(flatten_ranges([(0, 100, b'A'), (10, 20, b'B'), (15, 18, b'C'), (0, 5, b'D'),
+                                         (101, 110, b'A')]),
+                         [(0, 5, b'D'), (6, 9, b'A'), (10, 14, b'B'), (15, 18, b'C'), (19, 20, b'B'),
+                          (21, 110, b'A')])
+        with self.assertRaises(ValueError):
+            flatten_ranges([(0, 10, b'A'), (5, 15, b'B')])
+
+    def test_lookup(self):
+        # The nested DE network splits TR in two; the two US networks join.
+        self.assertEqual(import_csv(self.csv_path, self.database_path), (5, 2))
+        database = CountryDatabase(self.database_path)
+        self.assertEqual(database.lookup_many(["81.212.1.1", "81.212.5.9", "81.216.0.1", "8.8.9.255", "1.0.0.7",
+                                               "2a02:e0:1::5", "2001:db8:1:ff::1", "2001:db8:2::1",
+                                               "::ffff:8.8.8.8"]),
+                         ["TR", "DE", None, "US", "AU", "TR", "NL", None, "US"])
+        addresses = np.array([0x51d40101, 0x08080808, 0x7f000001] * 1000, dtype=np.uint32)
+        self.assertEqual(database.lookup_v4(addresses).tolist(), [b'TR', b'US', b''] * 1000)
+
+        results = offline_lookup(["8.8.8.8", "bogus", "8.8.8.8", "127.0.0.1"], self.database_path)
+        self.assertEqual([(result['country'], result['error']) for result in results.values()],
+                         [("US", None), (None, "invalid address"), (None, "not found")])
+
+        with open(self.csv_path, 'a') as file:
+            file.write("1.2.3.0/24,XYZ\n")
+        with self.assertRaises(ValueError) as cm:
+            import_csv(self.csv_path, self.database_path)
+        self.assertIn("countries.csv:9", str(cm.exception))
+        with self.assertRaises(ValueError):
+            CountryDatabase(self.csv_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,96 @@
 import argparse
+from bisect import bisect_right
+import bz2
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+import csv
+import glob
+import gzip
+import hashlib
+import io
+from itertools import accumulate, chain, islice
+import json
+import locale
+import lzma
+import mmap
+import os
 import re
+import shlex
+import sqlite3
+import sys
+import time
+
+# The --stats, --profile and --trace-memory instrumentation is shared with inspector.
+RUNSTATS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'runstats')
+if RUNSTATS_DIR not in sys.path:
+    sys.path.insert(0, RUNSTATS_DIR)
+from runstats import RunStats, instrumented
+
+# "YYYY-MM-DD HH:MM:SS SEVERITY:" and the whitespace after it, parsed once per line.
+LINE_PREFIX = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} ([A-Z]+):\s*')
+
+# The timestamp of a line, as bytes, for binary searches over the raw file.
+# Timestamps compare correctly as strings.
+LINE_TIME = re.compile(rb'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) [A-Z]+:')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# --since/--until also look this far outside the window for lines logged
+# slightly out of order.
+DEFAULT_TIME_TOLERANCE = 60
+# Below this many bytes the binary search gives way to a linear scan.
+TIME_SCAN_BYTES = 64 * 1024
+
+# histogram --bucket sizes: a number of seconds, minutes, hours or days.
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+DEFAULT_BUCKET = '1m'
+RECENT_MINUTES = 1024
+
+# batch looks for the queries' patterns in groups of this many lines first,
+# then line by line only for the patterns found in the group.
+BATCH_GROUP_LINES = 1024
+
+# "last" reads the file backwards in blocks of about this size.
+REVERSE_BLOCK_BYTES = 1024 * 1024
+# With --workers the log is split into newline-aligned ranges of at least this
+# size; each worker gets a few ranges so uneven ones balance out.
+MIN_RANGE_BYTES = 16 * 1024 * 1024
+RANGES_PER_WORKER = 4
+
+# --index keeps a SQLite file next to the log. It maps each severity to the
+# blocks (runs of whole lines of about INDEX_BLOCK_BYTES) holding it, with
+# line counts and first/last line offsets, and each word of the log text to
+# the blocks containing it.
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 1
+INDEX_BLOCK_BYTES = 64 * 1024
+# Appending keeps the head of the file; a different head means a new file.
+INDEX_HEAD_BYTES = 64 * 1024
+TOKEN = re.compile(r'\w+')
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, start INTEGER, end INTEGER);
+CREATE TABLE IF NOT EXISTS severities (severity TEXT, block INTEGER, count INTEGER, first INTEGER, last INTEGER,
+                                       PRIMARY KEY (severity, block)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tokens (token TEXT, block INTEGER, PRIMARY KEY (token, block)) WITHOUT ROWID;
+"""
+
+# Rotated logs may be compressed; they are decompressed while being read.
+COMPRESSED_LOGS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+# logrotate numbers rotated files from the newest (app.log.1) up; a suffix of
+# this many digits or more is a date (app.log-20240101) and sorts the other way.
+DATE_SUFFIX_DIGITS = 8
+# --follow checks the live log for new lines this often, in seconds.
+DEFAULT_FOLLOW_INTERVAL = 5
+# Filled in by the stages of a run when --stats is given.
+STATS = RunStats('lines')
 
 def clean_line(line):
-    line = re.sub(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [A-Z]+:\s*', '', line)
+    line = LINE_PREFIX.sub('', line)
     return line.strip()
 
 def extract_severity(line):
-    match = re.match(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} ([A-Z]+):', line)
+    match = LINE_PREFIX.match(line)
     return match.group(1) if match else ''
 
 def create_regex(pattern):
@@ -29,108 +113,1017 @@ def check_pattern_match(pattern, line):
         return pattern == line
 
     if not pattern.startswith('*') and pattern.endswith('*'):
-        return line.endswith(pattern[:-1])
+        return line.startswith(pattern[:-1])
 
     if pattern.startswith('*') and not pattern.endswith('*'):
-        return line.startswith(pattern[1:])
+        return line.endswith(pattern[1:])
 
     if pattern.startswith('*') and pattern.endswith('*'):
         return pattern[1:-1] in line
 
     return False
 
-def count_occurrences(pattern=None, severity=None, file_path=None):
-    count = 0
-    pattern_regex = create_regex(pattern) if pattern else None
-    severity_regex = create_regex(severity) if severity else None
+def compile_pattern(pattern):
+    # The same wildcard semantics as create_regex, as a plain string check.
+    # Also returns the literal part, which every matching line must contain.
+    if pattern.startswith('*') and pattern.endswith('*'):
+        needle = pattern[1:-1]
+        return needle, lambda line: needle in line
+    if pattern.startswith('*'):
+        needle = pattern[1:]
+        return needle, lambda line: line.endswith(needle)
+    if pattern.endswith('*'):
+        needle = pattern[:-1]
+        return needle, lambda line: line.startswith(needle)
+    return pattern, lambda line: line == pattern
 
-    with open(file_path, 'r') as file:
-        for line in file:
-            line = line.strip()
-            line_severity = extract_severity(line)
-            cleaned_line = clean_line(line)
+def parse_time(value):
+    # A --since/--until value (an ISO date, with or without the time) as a log timestamp.
+    try:
+        return datetime.fromisoformat(value).strftime(TIME_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid time "{value}", expected YYYY-MM-DD [HH:MM:SS]')
 
-            if pattern_regex and severity_regex:
-                if pattern_regex.search(cleaned_line) and severity_regex.search(line_severity):
-                    count += 1
-                continue
+def parse_bucket(value):
+    # A --bucket value such as 30s, 5m, 1h or 1d (a bare number is seconds) in seconds.
+    match = re.fullmatch(r'(\d+)([smhd]?)', value)
+    if not match or not int(match.group(1)):
+        raise argparse.ArgumentTypeError(f'invalid bucket "{value}", expected e.g. 30s, 5m, 1h or 1d')
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2) or 's']
+
+def shift_time(timestamp, seconds):
+    return (datetime.strptime(timestamp, TIME_FORMAT) + timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+
+def matching_lines(lines, pattern=None, severity=None, since=None, until=None):
+    # Yields the stripped lines whose text (the line without its timestamp and
+    # severity prefix) matches pattern and whose severity matches severity.
+    # With since/until, only lines with a timestamp in [since, until] match.
+    timed = since is not None or until is not None
+    if not pattern and not severity and not timed:
+        return
+    since = since or ''
+    until = until or '\uffff'
+    needle, text_match = compile_pattern(pattern) if pattern else ('', None)
+    severity_needle, severity_match = compile_pattern(severity) if severity else ('', None)
+    # A log has only a handful of severities, so each is matched once.
+    severities = {}
+    match_prefix = LINE_PREFIX.match
+    if STATS.enabled:
+        lines = STATS.counted(lines)
 
-            if severity_regex:
-                if severity_regex.search(line_severity):
-                    count += 1
+    for line in lines:
+        # Text and severity are both part of the line, so lines without the
+        # literal parts of the patterns are skipped before any parsing.
+        if needle not in line or severity_needle not in line:
+            continue
+        line = line.strip()
+        prefix = match_prefix(line)
+        if timed and not (prefix and since <= line[:19] <= until):
+            continue
+        if severity_match:
+            line_severity = prefix.group(1) if prefix else ''
+            matched = severities.get(line_severity)
+            if matched is None:
+                matched = severities[line_severity] = severity_match(line_severity)
+            if not matched:
                 continue
+        if text_match and not text_match(line[prefix.end():] if prefix else line):
+            continue
+        yield line
+
+def compression_opener(file_path):
+    return COMPRESSED_LOGS.get(os.path.splitext(file_path)[1].lower())
+
+@contextmanager
+def open_log(file_path):
+    # A text stream over a plain or compressed log. The bytes read through it
+    # (compressed ones for a compressed log) count as input for --stats; those
+    # read through map_log are counted by the line readers instead.
+    opener = compression_opener(file_path)
+    with open(file_path, 'rb' if opener else 'r') as file:
+        stream = opener(file, 'rt') if opener else file
+        try:
+            yield stream
+        finally:
+            if STATS.enabled:
+                STATS.add_input_bytes(file.tell() if opener else file.buffer.tell())
+            stream.close()
+
+def map_log(file_path, file):
+    # A read-only mmap of an open log, or None when it cannot be mapped: a
+    # compressed, empty or not regular file is read as a stream instead.
+    if compression_opener(file_path):
+        return None
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, TypeError, ValueError, OSError, io.UnsupportedOperation):
+        return None
+
+def _rotation_key(file_path):
+    # Oldest first: numbered files from the highest number down, then dated
+    # files by date, then the live file (no suffix).
+    name = os.path.basename(file_path)
+    if compression_opener(name):
+        name = os.path.splitext(name)[0]
+    match = re.search(r'[.-](\d+)$', name)
+    if not match:
+        return 2, 0, name
+    if len(match.group(1)) < DATE_SUFFIX_DIGITS:
+        return 0, -int(match.group(1)), name
+    return 1, int(match.group(1)), name
+
+def expand_log_paths(path):
+    # A log is a file, a directory of rotated logs or a glob (e.g. "app.log*");
+    # the files come back oldest first. Index sidecars are left out.
+    if os.path.isfile(path):
+        return [path]
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in os.listdir(path)]
+    elif glob.has_magic(path):
+        files = glob.glob(path)
+    else:
+        return [path]
+    files = [name for name in files if os.path.isfile(name) and not name.endswith(INDEX_SUFFIX)]
+    return sorted(files, key=_rotation_key)
+
+def _block_lines(data, start, end, encoding):
+    STATS.add_input_bytes(end - start)
+    text = data[start:end].decode(encoding).replace('\r\n', '\n')
+    lines = text.split('\n')
+    if text.endswith('\n'):
+        lines.pop()
+    return lines
+
+def reverse_lines(data, encoding='utf-8', block_size=REVERSE_BLOCK_BYTES, start=0, end=None):
+    # Yields the lines of data (bytes or an mmap) from last to first, without
+    # their line endings. Blocks start at a line start and end with a line's
+    # newline, so no line or multi-byte character is ever cut; a line longer
+    # than a block makes its block longer. start/end must be line starts.
+    end = len(data) if end is None else end
+    while end > start:
+        block_start = data.rfind(b'\n', start, max(start, end - 1 - block_size)) + 1 or start
+        yield from reversed(_block_lines(data, block_start, end, encoding))
+        end = block_start
+
+def forward_lines(data, encoding='utf-8', block_size=REVERSE_BLOCK_BYTES, start=0, end=None):
+    # reverse_lines in file order.
+    end = len(data) if end is None else end
+    while start < end:
+        block_end = data.find(b'\n', min(start + block_size, end) - 1, end) + 1 or end
+        yield from _block_lines(data, start, block_end, encoding)
+        start = block_end
+
+def split_ranges(data, parts):
+    # (start, end) byte ranges of data, each starting at a line start.
+    boundaries = [0]
+    for part in range(1, parts):
+        boundary = data.find(b'\n', len(data) * part // parts) + 1
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    if boundaries[-1] < len(data):
+        boundaries.append(len(data))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def scan_range(file_path, start, end, pattern, severity, command, stats=False):
+    # Worker entry point: the count, or the first or last matching line, of one
+    # range, and the lines and bytes read when stats is set (0 otherwise).
+    if stats:
+        STATS.start()
+    with open(file_path, 'r') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if command == 'count':
+            result = sum(1 for _ in matching_lines(forward_lines(data, file.encoding, start=start, end=end),
+                                                   pattern, severity))
+        else:
+            lines = reverse_lines if command == 'last' else forward_lines
+            result = next(matching_lines(lines(data, file.encoding, start=start, end=end), pattern, severity),
+                          None)
+    if stats:
+        STATS.stop()
+        return result, STATS.items, STATS.input_bytes
+    return result, 0, 0
+
+def _parallel_ranges(file_path, workers):
+    # The ranges to scan in parallel, or None when a single pass is the better choice.
+    if workers < 2 or compression_opener(file_path):
+        return None
+    try:
+        size = os.path.getsize(file_path)
+        parts = min(workers * RANGES_PER_WORKER, size // MIN_RANGE_BYTES)
+        if parts < 2:
+            return None
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return split_ranges(data, parts)
+    except (AttributeError, TypeError, ValueError, OSError, io.UnsupportedOperation):
+        return None
+
+def scan_parallel(file_path, ranges, pattern, severity, command, workers):
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(scan_range, file_path, start, end, pattern, severity, command, STATS.enabled)
+                   for start, end in ranges]
+        if command == 'count':
+            total = 0
+            for future in futures:
+                count, lines, read = future.result()
+                total += count
+                STATS.items += lines
+                STATS.add_input_bytes(read)
+            return total
+        # The answer is in the first (or last) range with a match; ranges
+        # beyond it are cancelled as soon as it is known.
+        if command == 'last':
+            futures.reverse()
+        for future in futures:
+            result_line, lines, read = future.result()
+            STATS.items += lines
+            STATS.add_input_bytes(read)
+            if result_line is not None:
+                executor.shutdown(cancel_futures=True)
+                return result_line
+    return None
+
+def index_path(file_path):
+    return file_path + INDEX_SUFFIX
+
+def _extend_index(connection, data, start, encoding):
+    # Indexes the complete lines after start and returns where they end; a
+    # line still being written is left for the next run.
+    end = data.rfind(b'\n') + 1
+    block = connection.execute('SELECT COALESCE(MAX(id), -1) + 1 FROM blocks').fetchone()[0]
+    match_prefix = LINE_PREFIX.match
+    find_tokens = TOKEN.findall
+    while start < end:
+        block_end = data.find(b'\n', min(start + INDEX_BLOCK_BYTES, end) - 1, end) + 1
+        severities = {}
+        tokens = set()
+        offset = start
+        STATS.add_input_bytes(block_end - start)
+        for raw in data[start:block_end - 1].split(b'\n'):
+            line = raw.decode(encoding).strip()
+            prefix = match_prefix(line)
+            line_severity = prefix.group(1) if prefix else ''
+            stats = severities.get(line_severity)
+            if stats is None:
+                severities[line_severity] = [1, offset, offset]
+            else:
+                stats[0] += 1
+                stats[2] = offset
+            tokens.update(find_tokens(line[prefix.end():] if prefix else line))
+            offset += len(raw) + 1
+
+        connection.execute('INSERT INTO blocks VALUES (?, ?, ?)', (block, start, block_end))
+        connection.executemany('INSERT INTO severities VALUES (?, ?, ?, ?, ?)',
+                               [(line_severity, block, *stats) for line_severity, stats in severities.items()])
+        connection.executemany('INSERT INTO tokens VALUES (?, ?)', [(token, block) for token in tokens])
+        block += 1
+        start = block_end
+    return max(start, end)
+
+def open_index(file_path, data, encoding):
+    # The up-to-date index of the mapped log and how many bytes it covers.
+    # An unchanged log is used as is, an appended one is extended, and a
+    # truncated or replaced one is indexed again from scratch. Raises
+    # sqlite3.Error when the index cannot be opened or written.
+    with STATS.stage('index'):
+        connection = sqlite3.connect(index_path(file_path))
+        try:
+            return connection, _update_index(connection, file_path, data, encoding)
+        except BaseException:
+            connection.close()
+            raise
+
+def _update_index(connection, file_path, data, encoding):
+    stat = os.stat(file_path)
+    connection.execute('PRAGMA case_sensitive_like = ON')
+    connection.executescript(INDEX_SCHEMA)
+    meta = dict(connection.execute('SELECT key, value FROM meta'))
+    indexed_bytes = meta.get('indexed_bytes', 0)
+    if meta.get('size') == stat.st_size and meta.get('mtime') == stat.st_mtime_ns:
+        return indexed_bytes
+
+    head_bytes = min(len(data), INDEX_HEAD_BYTES)
+    head = hashlib.sha1(data[:meta.get('head_bytes', head_bytes)]).hexdigest()
+    with connection:
+        if (meta.get('version') != INDEX_VERSION or indexed_bytes > len(data)
+                or meta.get('head') not in (None, head)):
+            for table in ('blocks', 'severities', 'tokens'):
+                connection.execute(f'DELETE FROM {table}')
+            indexed_bytes = 0
+        indexed_bytes = _extend_index(connection, data, indexed_bytes, encoding)
+        meta = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'indexed_bytes': indexed_bytes, 'head_bytes': head_bytes,
+                'head': hashlib.sha1(data[:head_bytes]).hexdigest()}
+        connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', meta.items())
+    return indexed_bytes
+
+def _token_queries(pattern):
+    # (SQL condition, argument) pairs a token of every matching line satisfies.
+    # Words inside the literal part are whole tokens; one touching an unanchored
+    # end of the pattern may be the end or the start of a longer token.
+    needle, _ = compile_pattern(pattern)
+    open_start = pattern.startswith('*')
+    open_end = pattern.endswith('*')
+    queries = []
+    for word in TOKEN.finditer(needle):
+        escaped = word.group().replace('\\', '\\\\').replace('_', '\\_')
+        prefix = '%' if open_start and word.start() == 0 else ''
+        suffix = '%' if open_end and word.end() == len(needle) else ''
+        if prefix or suffix:
+            queries.append(("token LIKE ? ESCAPE '\\'", prefix + escaped + suffix))
+        else:
+            queries.append(('token = ?', word.group()))
+    # Exact words first: they are the cheapest and usually the most selective.
+    return sorted(queries, key=lambda query: query[0] != 'token = ?')
+
+def _candidate_blocks(connection, pattern, severities):
+    # Ids of the blocks that may hold matching lines.
+    blocks = None
+    if severities is not None:
+        placeholders = ', '.join('?' * len(severities))
+        blocks = {block for block, in connection.execute(
+            f'SELECT block FROM severities WHERE severity IN ({placeholders})', severities)}
+    for condition, argument in _token_queries(pattern) if pattern else []:
+        if blocks is not None and not blocks:
+            break
+        found = {block for block, in connection.execute(f'SELECT block FROM tokens WHERE {condition}', (argument,))}
+        blocks = found if blocks is None else blocks & found
+    if blocks is None:
+        return [block for block, in connection.execute('SELECT id FROM blocks')]
+    return sorted(blocks)
+
+def _line_at(data, offset, encoding):
+    end = data.find(b'\n', offset)
+    end = end if end >= 0 else len(data)
+    STATS.add_input_bytes(end - offset)
+    return data[offset:end].decode(encoding).strip()
 
-            if pattern_regex:
-                if pattern_regex.search(cleaned_line):
-                    count += 1
+def indexed_scan(file_path, pattern, severity, command):
+    # count/first/last through the sidecar index: severity-only queries are
+    # answered from the index itself, text queries read candidate blocks only.
+    # The unindexed tail (a line still being written) is always scanned.
+    if not pattern and not severity:
+        return 0 if command == 'count' else None
+    with open(file_path, 'r') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        try:
+            connection, indexed_bytes = open_index(file_path, data, file.encoding)
+        except sqlite3.Error as e:
+            # e.g. the log's directory is read-only: answer without the index.
+            print(f'Cannot use the index {index_path(file_path)} ({e}); scanning the log instead.', file=sys.stderr)
+            lines = (reverse_lines if command == 'last' else forward_lines)(data, file.encoding)
+            matches = matching_lines(lines, pattern, severity)
+            if command == 'count':
+                return sum(1 for _ in matches)
+            return next(matches, None)
+        with closing(connection):
+            severities = None
+            if severity:
+                _, severity_match = compile_pattern(severity)
+                severities = [level for level, in connection.execute('SELECT DISTINCT severity FROM severities')
+                              if severity_match(level)]
+            placeholders = ', '.join('?' * len(severities or ()))
+            tail = matching_lines(forward_lines(data, file.encoding, start=indexed_bytes), pattern, severity)
+
+            if not pattern and command == 'count':
+                count, = connection.execute(f'SELECT COALESCE(SUM(count), 0) FROM severities '
+                                            f'WHERE severity IN ({placeholders})', severities).fetchone()
+                return count + sum(1 for _ in tail)
+            if not pattern and command == 'first':
+                offset, = connection.execute(f'SELECT MIN(first) FROM severities WHERE severity IN ({placeholders})',
+                                             severities).fetchone()
+                return _line_at(data, offset, file.encoding) if offset is not None else next(tail, None)
+            if not pattern:
+                offset, = connection.execute(f'SELECT MAX(last) FROM severities WHERE severity IN ({placeholders})',
+                                             severities).fetchone()
+                result_line = None
+                for result_line in tail:
+                    pass
+                if result_line is None and offset is not None:
+                    result_line = _line_at(data, offset, file.encoding)
+                return result_line
+
+            # Neighbouring candidate blocks are read as one range.
+            ranges = []
+            for block in _candidate_blocks(connection, pattern, severities):
+                start, end = connection.execute('SELECT start, end FROM blocks WHERE id = ?', (block,)).fetchone()
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+            ranges.append((indexed_bytes, len(data)))
+            if command == 'last':
+                lines = chain.from_iterable(reverse_lines(data, file.encoding, start=start, end=end)
+                                            for start, end in reversed(ranges))
+            else:
+                lines = chain.from_iterable(forward_lines(data, file.encoding, start=start, end=end)
+                                            for start, end in ranges)
+            matches = matching_lines(lines, pattern, severity)
+            if command == 'count':
+                return sum(1 for _ in matches)
+            return next(matches, None)
+
+def _line_time(data, offset, end):
+    # (timestamp, line end) of the first line in [offset, end) that has one.
+    while offset < end:
+        line_end = data.find(b'\n', offset, end)
+        line_end = end if line_end < 0 else line_end + 1
+        match = LINE_TIME.match(data, offset, line_end)
+        if match:
+            return match.group(1).decode(), line_end
+        offset = line_end
+    return None, end
+
+def seek_time(data, timestamp):
+    # The start of the first line logged at or after timestamp, by binary
+    # search on byte offsets, assuming lines are in time order. Each probe
+    # resyncs to the next line start; lines without a timestamp are skipped.
+    low, high = 0, len(data)
+    while high - low > TIME_SCAN_BYTES:
+        middle = data.find(b'\n', (low + high) // 2, high) + 1
+        if not middle or middle == high:
+            break
+        line_time, line_end = _line_time(data, middle, high)
+        if line_time is None or line_time >= timestamp:
+            high = middle
+        else:
+            low = line_end
+    while low < high:
+        line_time, line_end = _line_time(data, low, high)
+        if line_time is None:
+            break
+        if line_time >= timestamp:
+            return data.rfind(b'\n', 0, line_end - 1) + 1
+        low = line_end
+    # The answer is the first line from high on that has a timestamp.
+    line_time, line_end = _line_time(data, high, len(data))
+    return len(data) if line_time is None else data.rfind(b'\n', 0, line_end - 1) + 1
+
+def time_slice(data, since, until, tolerance=DEFAULT_TIME_TOLERANCE):
+    # The byte range holding every line logged in [since, until], widened by
+    # tolerance seconds on both sides for lines logged out of order.
+    with STATS.stage('seek'):
+        start = seek_time(data, shift_time(since, -tolerance)) if since else 0
+        end = seek_time(data, shift_time(until, tolerance + 1)) if until else len(data)
+    return start, end
+
+def windowed_scan(file_path, pattern, severity, command, since, until, tolerance=DEFAULT_TIME_TOLERANCE):
+    # count/first/last over the lines logged in [since, until]. Only the
+    # time_slice of the file is read.
+    with open_log(file_path) as file:
+        data = map_log(file_path, file)
+        if data is None:
+            # Compressed, or not a regular file (or an empty one): scan all of it.
+            matches = matching_lines(file, pattern, severity, since, until)
+            if command == 'count':
+                return sum(1 for _ in matches)
+            result_line = next(matches, None)
+            if command == 'last':
+                for result_line in chain([result_line], matches):
+                    pass
+            return result_line
+
+        with data:
+            start, end = time_slice(data, since, until, tolerance)
+            lines = (reverse_lines if command == 'last' else forward_lines)(data, file.encoding, start=start, end=end)
+            matches = matching_lines(lines, pattern, severity, since, until)
+            if command == 'count':
+                return sum(1 for _ in matches)
+            return next(matches, None)
+
+def _bucket_counts(lines, bucket_seconds, pattern, severity, since, until):
+    counts = {}
+    # Lines come mostly in time order, so each minute is converted once and
+    # only the recent ones are remembered.
+    minutes = {}
+    # Every line needs a timestamp, so since is never None here.
+    for line in matching_lines(lines, pattern or '*', severity, since or '', until):
+        minute_start = minutes.get(line[:16])
+        if minute_start is None:
+            if len(minutes) >= RECENT_MINUTES:
+                minutes.clear()
+            minute_start = minutes[line[:16]] = calendar.timegm(
+                (int(line[:4]), int(line[5:7]), int(line[8:10]), int(line[11:13]), int(line[14:16]), 0))
+        seconds = minute_start + int(line[17:19])
+        bucket = seconds - seconds % bucket_seconds
+        line_severity = line[20:line.index(':', 20)]
+        by_severity = counts.get(bucket)
+        if by_severity is None:
+            by_severity = counts[bucket] = {}
+        by_severity[line_severity] = by_severity.get(line_severity, 0) + 1
+    return {time.strftime(TIME_FORMAT, time.gmtime(bucket)): counts[bucket] for bucket in sorted(counts)}
+
+def histogram(file_path, bucket_seconds, pattern=None, severity=None, since=None, until=None,
+              tolerance=DEFAULT_TIME_TOLERANCE):
+    # Line counts per time bucket and severity, {bucket start: {severity: count}},
+    # in one streaming pass. Buckets are aligned to multiples of their size
+    # since the epoch, and buckets without lines are left out.
+    files = expand_log_paths(file_path)
+    if len(files) != 1:
+        buckets = {}
+        for path in files:
+            for bucket, counts in histogram(path, bucket_seconds, pattern, severity, since, until, tolerance).items():
+                merged = buckets.setdefault(bucket, {})
+                for line_severity, count in counts.items():
+                    merged[line_severity] = merged.get(line_severity, 0) + count
+        return dict(sorted(buckets.items()))
+
+    with open_log(file_path) as file:
+        data = map_log(file_path, file)
+        if data is None:
+            return _bucket_counts(file, bucket_seconds, pattern, severity, since, until)
+
+        with data:
+            start, end = time_slice(data, since, until, tolerance)
+            return _bucket_counts(forward_lines(data, file.encoding, start=start, end=end), bucket_seconds, pattern,
+                                  severity, since, until)
+
+def write_histogram(buckets, output_format='csv', file=None):
+    # CSV has one column per severity plus a total; JSON is a list of buckets.
+    file = file or sys.stdout
+    if output_format == 'json':
+        json.dump([{'bucket': bucket, 'counts': counts, 'total': sum(counts.values())}
+                   for bucket, counts in buckets.items()], file, indent=2)
+        file.write('\n')
+        return
+    severities = sorted({line_severity for counts in buckets.values() for line_severity in counts})
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(['bucket', *severities, 'total'])
+    for bucket, counts in buckets.items():
+        writer.writerow([bucket, *(counts.get(line_severity, 0) for line_severity in severities),
+                         sum(counts.values())])
+
+class QueryParser(argparse.ArgumentParser):
+    # Reports a bad query instead of exiting.
+    def error(self, message):
+        raise ValueError(message)
+
+def read_queries(query_path):
+    # (command, pattern, severity) for each line of a batch query file, written
+    # like the command line: count|first|last [--text TEXT] [--severity SEVERITY].
+    # Blank lines and lines starting with # are skipped.
+    parser = QueryParser(prog='query', add_help=False)
+    parser.add_argument('command', choices=['count', 'first', 'last'])
+    parser.add_argument('--text')
+    parser.add_argument('--severity')
+    queries = []
+    with open(query_path, 'r') as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
                 continue
+            try:
+                query = parser.parse_args(shlex.split(line))
+            except ValueError as e:
+                raise ValueError(f'{query_path}:{number}: {e}')
+            if not query.text and not query.severity:
+                raise ValueError(f'{query_path}:{number}: a query needs --text or --severity')
+            queries.append((query.command, query.text, query.severity))
+    return queries
 
-    return count
+def _needle_regex(needles):
+    # One regex that finds, at every position, the longest needle starting
+    # there. The needles are merged into a trie first, so each position costs
+    # about one character comparison per character matched, however many
+    # needles there are.
+    trie = {}
+    for needle in needles:
+        node = trie
+        for char in needle:
+            node = node.setdefault(char, {})
+        node[''] = None
 
-def find_first_or_last(pattern=None, severity=None, file_path=None, find_last=False):
-    pattern_regex = create_regex(pattern) if pattern else None
-    severity_regex = create_regex(severity) if severity else None
+    def build(node):
+        # Single-child chains are walked without recursing, so long needles
+        # do not run into the recursion limit.
+        parts = []
+        while True:
+            branches = [char for char in node if char]
+            if '' in node or len(branches) != 1:
+                break
+            parts.append(re.escape(branches[0]))
+            node = node[branches[0]]
+        alternatives = [re.escape(char) + build(node[char]) for char in sorted(branches)]
+        if alternatives:
+            body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+            parts.append(f'(?:{body})?' if '' in node else body)
+        return ''.join(parts)
 
-    result_line = None
+    return re.compile(f'(?=({build(trie)}))')
 
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
+def _batch_results(lines, queries, since, until):
+    # Matching lines are tallied per (text pattern, severity) pair rather than
+    # per query, so the work per line grows with the patterns it matches, not
+    # with the number of queries. Severity patterns are applied at the end.
+    patterns = {}
+    for _, pattern, _ in queries:
+        if pattern:
+            patterns.setdefault(pattern, len(patterns))
+    by_needle = {}
+    exact = {}
+    for pattern, pattern_id in patterns.items():
+        needle, text_match = compile_pattern(pattern)
+        if not pattern.startswith('*') and not pattern.endswith('*'):
+            # Looked up by the text, once the line is known to hold the pattern.
+            exact[pattern] = pattern_id
+            by_needle.setdefault(needle, [])
+        else:
+            by_needle.setdefault(needle, []).append((pattern_id, text_match))
+    unfiltered = by_needle.pop('', [])
+    # The regex reports only the longest needle at each position; the shorter
+    # needles inside it are there too.
+    needle_regex = _needle_regex(by_needle) if by_needle else None
+    implied = {needle: [other for other in by_needle if other in needle] for needle in by_needle}
+    # Severity-only queries are tallied under the pattern id None.
+    severity_only = [None] if any(severity and not pattern for _, pattern, severity in queries) else []
+    scan_every_line = bool(unfiltered or severity_only)
+    keep_last = any(command == 'last' for command, _, _ in queries)
+    # When every query is a first query, the scan stops once all are answered.
+    open_firsts = None
+    if all(command == 'first' for command, _, _ in queries):
+        open_firsts = [(patterns.get(pattern), compile_pattern(severity)[1] if severity else None)
+                       for _, pattern, severity in queries if pattern or severity]
 
-        if find_last:
-            lines.reverse()
+    counts = {}
+    firsts = {}
+    lasts = {}
+    timed = since is not None or until is not None
+    since = since or ''
+    until = until or '\uffff'
+    match_prefix = LINE_PREFIX.match
+    lines = iter(lines)
+    number = 0
 
-        for line in lines:
+    while True:
+        group = list(islice(lines, BATCH_GROUP_LINES))
+        if not group:
+            break
+        STATS.items += len(group)
+        # Each group is searched once for all the needles together, and only
+        # the lines holding one are looked at more closely.
+        found_by_line = {}
+        if needle_regex:
+            group_text = '\n'.join(group)
+            starts = list(accumulate((len(line) + 1 for line in group[:-1]), initial=0))
+            for match in needle_regex.finditer(group_text):
+                found = found_by_line.setdefault(bisect_right(starts, match.start()) - 1, set())
+                found.update(implied[match.group(1)])
+        if scan_every_line:
+            candidates = enumerate(group)
+        else:
+            candidates = ((index, group[index]) for index in sorted(found_by_line))
+
+        for index, line in candidates:
             line = line.strip()
-            line_severity = extract_severity(line)
-            cleaned_line = clean_line(line)
+            prefix = match_prefix(line)
+            if timed and not (prefix and since <= line[:19] <= until):
+                continue
+            line_severity = prefix.group(1) if prefix else ''
+            text = line[prefix.end():] if prefix else line
+
+            matched = list(severity_only)
+            for needle in found_by_line.get(index, ()):
+                for pattern_id, text_match in by_needle[needle]:
+                    if text_match(text):
+                        matched.append(pattern_id)
+            for pattern_id, text_match in unfiltered:
+                if text_match(text):
+                    matched.append(pattern_id)
+            if text in exact:
+                matched.append(exact[text])
+            for pattern_id in matched:
+                key = (pattern_id, line_severity)
+                counts[key] = counts.get(key, 0) + 1
+                if keep_last:
+                    lasts[key] = (number + index, line)
+                if key not in firsts:
+                    firsts[key] = (number + index, line)
+                    if open_firsts is not None:
+                        open_firsts = [(first_id, severity_match) for first_id, severity_match in open_firsts
+                                       if first_id != pattern_id or
+                                       (severity_match and not severity_match(line_severity))]
+                        if not open_firsts:
+                            return _batch_answers(queries, patterns, counts, firsts, lasts)
+        number += len(group)
+    return _batch_answers(queries, patterns, counts, firsts, lasts)
+
+def _batch_answers(queries, patterns, counts, firsts, lasts):
+    results = []
+    for command, pattern, severity in queries:
+        keys = []
+        if pattern or severity:
+            pattern_id = patterns.get(pattern) if pattern else None
+            severity_match = compile_pattern(severity)[1] if severity else None
+            keys = [key for key in counts
+                    if key[0] == pattern_id and (not severity_match or severity_match(key[1]))]
+        if command == 'count':
+            results.append(sum(counts[key] for key in keys))
+        elif command == 'first':
+            results.append(min(firsts[key] for key in keys)[1] if keys else None)
+        else:
+            results.append(max(lasts[key] for key in keys)[1] if keys else None)
+    return results
+
+def batch_queries(file_path, queries, since=None, until=None, tolerance=DEFAULT_TIME_TOLERANCE):
+    # Results of many (command, pattern, severity) queries, all answered in
+    # one pass over the log.
+    files = expand_log_paths(file_path)
+    if len(files) != 1:
+        # Counts add up over a rotated set; a first answer comes from the
+        # oldest file that has one, a last answer from the newest.
+        results = [0 if command == 'count' else None for command, _, _ in queries]
+        for path in files:
+            for query_id, result in enumerate(batch_queries(path, queries, since, until, tolerance)):
+                command = queries[query_id][0]
+                if command == 'count':
+                    results[query_id] += result
+                elif result is not None and (command == 'last' or results[query_id] is None):
+                    results[query_id] = result
+        return results
 
-            if pattern_regex and severity_regex:
-                if pattern_regex.search(cleaned_line) and severity_regex.search(line_severity):
-                    result_line = line
-                    break
+    with open_log(file_path) as file:
+        data = map_log(file_path, file)
+        if data is None:
+            return _batch_results(file, queries, since, until)
+        with data:
+            start, end = time_slice(data, since, until, tolerance)
+            return _batch_results(forward_lines(data, file.encoding, start=start, end=end), queries, since, until)
 
-            elif severity_regex:
-                if severity_regex.search(line_severity):
-                    result_line = line
-                    break
+def format_result(command, pattern, severity, result):
+    # What main prints for a count, first or last query.
+    if command == 'first':
+        return f'First matched log: {result}'
+    if command == 'last':
+        return f'Last matched log: {result}'
+    if pattern and severity:
+        return f'Matched logs with severity "{severity}" and text "{pattern}": {result}'
+    if pattern:
+        return f'Matched logs with text "{pattern}": {result}'
+    return f'Matched logs with severity "{severity}": {result}'
 
-            elif pattern_regex:
-                if pattern_regex.search(cleaned_line):
-                    result_line = line
-                    break
+def count_occurrences(pattern=None, severity=None, file_path=None, workers=1, use_index=False, since=None,
+                      until=None, tolerance=DEFAULT_TIME_TOLERANCE):
+    files = expand_log_paths(file_path)
+    if len(files) != 1:
+        return sum(count_occurrences(pattern, severity, path, workers, use_index, since, until, tolerance)
+                   for path in files)
+    if since or until:
+        return windowed_scan(file_path, pattern, severity, 'count', since, until, tolerance)
+    if use_index and not compression_opener(file_path):
+        return indexed_scan(file_path, pattern, severity, 'count')
+    ranges = _parallel_ranges(file_path, workers)
+    if ranges:
+        return scan_parallel(file_path, ranges, pattern, severity, 'count', workers)
+
+    with open_log(file_path) as file:
+        return sum(1 for _ in matching_lines(file, pattern, severity))
+
+def find_first_or_last(pattern=None, severity=None, file_path=None, find_last=False, workers=1, use_index=False,
+                       since=None, until=None, tolerance=DEFAULT_TIME_TOLERANCE):
+    command = 'last' if find_last else 'first'
+    files = expand_log_paths(file_path)
+    if len(files) != 1:
+        # The oldest file with a match has the first one, the newest the last one.
+        for path in reversed(files) if find_last else files:
+            result_line = find_first_or_last(pattern, severity, path, find_last, workers, use_index, since, until,
+                                             tolerance)
+            if result_line is not None:
+                return result_line
+        return None
+    if since or until:
+        return windowed_scan(file_path, pattern, severity, command, since, until, tolerance)
+    if use_index and not compression_opener(file_path):
+        return indexed_scan(file_path, pattern, severity, 'last' if find_last else 'first')
+    result_line = None
+    ranges = _parallel_ranges(file_path, workers)
+    if ranges:
+        return scan_parallel(file_path, ranges, pattern, severity, 'last' if find_last else 'first', workers)
+
+    with open_log(file_path) as file:
+        if not find_last:
+            return next(matching_lines(file, pattern, severity), None)
+
+        data = map_log(file_path, file)
+        if data is None:
+            # Compressed, or not a regular file (or an empty one): scan forward and keep the last match.
+            for result_line in matching_lines(file, pattern, severity):
+                pass
+            return result_line
+
+        with data:
+            result_line = next(matching_lines(reverse_lines(data, file.encoding), pattern, severity), None)
 
     return result_line
 
+class LogFollower:
+    """Reads the lines appended to a live log since the last poll.
+
+    path may be a file, a directory or a glob of rotated logs; the live file
+    is the newest of them and is read from its start. The open file is kept
+    across polls, so when the log is rotated (the live name now belongs to a
+    new file) the rest of the old file is read before moving on to the new
+    one. A truncated log is read again from its start. Only complete lines
+    are returned; a partly written line is picked up by the next poll.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.current = None
+        self.file = None
+        self.inode = None
+        self.partial = b''
+        self.encoding = locale.getpreferredencoding(False)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _open(self, file_path):
+        if compression_opener(file_path):
+            raise ValueError(f'{file_path}: only uncompressed logs can be followed')
+        self.close()
+        self.current = file_path
+        self.file = open(file_path, 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.partial = b''
+
+    def _read_new(self, complete=False):
+        # complete: the file will not grow any more, so a last line without a
+        # newline is returned too.
+        new = self.file.read()
+        STATS.add_input_bytes(len(new))
+        data = self.partial + new
+        end = len(data) if complete else data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        return data[:end].decode(self.encoding).splitlines()
+
+    def poll(self):
+        # Returns the new lines, without their line endings.
+        if self.file is None:
+            files = expand_log_paths(self.path)
+            if not files or not os.path.isfile(files[-1]):
+                return []
+            self._open(files[-1])
+
+        lines = self._read_new()
+        try:
+            stat = os.stat(self.current)
+        except FileNotFoundError:
+            # Rotated away and the new file is not there yet.
+            return lines
+        if stat.st_ino != self.inode:
+            # Rotated: whatever was written to the old file before the new one
+            # appeared is already there.
+            lines.extend(self._read_new(complete=True))
+            self._open(self.current)
+            lines.extend(self._read_new())
+        elif stat.st_size < self.file.tell():
+            # Truncated in place (copytruncate).
+            self.file.seek(0)
+            self.partial = b''
+            lines.extend(self._read_new())
+        return lines
+
+def follow_log(file_path, command, pattern=None, severity=None, since=None, until=None,
+               interval=DEFAULT_FOLLOW_INTERVAL, iterations=None):
+    # Live counterpart of count/first/last. The rotated files are read once,
+    # then the live file is followed and the result is updated from the new
+    # lines only, and printed whenever it changes. iterations bounds the
+    # number of polls (None follows until interrupted, or for first until a
+    # match). Returns the last result.
+    rotated = expand_log_paths(file_path)[:-1]
+    result = None
+    if command == 'count':
+        result = sum(count_occurrences(pattern, severity, path, since=since, until=until) for path in rotated)
+    else:
+        for path in reversed(rotated) if command == 'last' else rotated:
+            result = find_first_or_last(pattern, severity, path, find_last=command == 'last', since=since,
+                                        until=until)
+            if result is not None:
+                break
+
+    follower = LogFollower(file_path)
+    printed = None
+    polls = 0
+    try:
+        while iterations is None or polls < iterations:
+            if command != 'first' or result is None:
+                matches = matching_lines(follower.poll(), pattern, severity, since, until)
+                if command == 'count':
+                    result += sum(1 for _ in matches)
+                elif command == 'first':
+                    result = next(matches, None)
+                else:
+                    for result in matches:
+                        pass
+            polls += 1
+            if polls == 1 or result != printed:
+                print(format_result(command, pattern, severity, result), flush=True)
+                printed = result
+            if command == 'first' and result is not None:
+                break
+            if iterations is None or polls < iterations:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        follower.close()
+    return result
+
 
 def main():
     parser = argparse.ArgumentParser(description="Counts or finds specific patterns in the log file.")
-    parser.add_argument('command', choices=['count', 'first', 'last'], help='The action you want to perform')
+    parser.add_argument('command', choices=['count', 'first', 'last', 'histogram', 'batch'],
+                        help='The action you want to perform')
     parser.add_argument('--text', help='The text or pattern you want to search for')
     parser.add_argument('--severity', help='The severity level you want to search for')
-    parser.add_argument('log_file', help='The path to the log file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes scanning the log in parallel (0 uses every CPU)')
+    parser.add_argument('--index', action='store_true',
+                        help=f'Build or update a sidecar index (log_file{INDEX_SUFFIX}) and answer from it')
+    parser.add_argument('--since', type=parse_time, help='Only match lines logged at or after this time')
+    parser.add_argument('--until', type=parse_time, help='Only match lines logged at or before this time')
+    parser.add_argument('--time-tolerance', type=float, default=DEFAULT_TIME_TOLERANCE,
+                        help='Seconds outside --since/--until to look for lines logged out of order')
+    parser.add_argument('--bucket', type=parse_bucket, default=DEFAULT_BUCKET,
+                        help='Bucket size for histogram, e.g. 30s, 5m, 1h or 1d (default: 1m)')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='Output format for histogram')
+    parser.add_argument('--queries', help='File of count/first/last queries for batch, one per line, '
+                                           'e.g. count --text "*failed*" --severity ERROR')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep following the live log and print count/first/last again when it changes')
+    parser.add_argument('--interval', type=float, default=DEFAULT_FOLLOW_INTERVAL,
+                        help=f'Seconds between checks for new lines with --follow (default: {DEFAULT_FOLLOW_INTERVAL})')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print wall and CPU time per stage, lines per second, input bytes and peak memory '
+                             'to stderr when done')
+    parser.add_argument('--stats-format', choices=['text', 'json'], default='text',
+                        help='Format of the --stats report (default: text)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write a cProfile dump of the run to FILE (read it with python -m pstats FILE)')
+    parser.add_argument('--trace-memory', type=int, metavar='N',
+                        help='Trace allocations with tracemalloc and print the N largest allocation sites')
+    parser.add_argument('log_file', help='The path to the log file, or a directory or quoted glob of rotated logs')
 
     args = parser.parse_args()
+    if not expand_log_paths(args.log_file):
+        parser.error(f'no log files match {args.log_file}')
+    with instrumented(STATS, args.stats, args.stats_format, args.profile, args.trace_memory):
+        with STATS.stage('scan'):
+            run(parser, args)
+
+def run(parser, args):
+    if args.follow:
+        if args.command not in ('count', 'first', 'last'):
+            parser.error('--follow works with count, first and last')
+        if not args.text and not args.severity:
+            parser.error('--follow needs --text or --severity')
+        try:
+            follow_log(args.log_file, args.command, args.text, args.severity, since=args.since, until=args.until,
+                       interval=args.interval)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    options = dict(workers=args.workers or os.cpu_count(), use_index=args.index, since=args.since,
+                   until=args.until, tolerance=args.time_tolerance)
 
     if args.command == 'count':
         pattern = args.text
         severity = args.severity
         log_file = args.log_file
 
-        if pattern and severity:
-            count_combined = count_occurrences(pattern=pattern, severity=severity, file_path=log_file)
-            print(f'Matched logs with severity "{severity}" and text "{pattern}": {count_combined}')
-        elif pattern:
-            count_text = count_occurrences(pattern=pattern, file_path=log_file)
-            print(f'Matched logs with text "{pattern}": {count_text}')
-        elif severity:
-            count_severity = count_occurrences(severity=severity, file_path=log_file)
-            print(f'Matched logs with severity "{severity}": {count_severity}')
+        if pattern or severity:
+            count = count_occurrences(pattern=pattern, severity=severity, file_path=log_file, **options)
+            with STATS.stage('output'):
+                print(format_result('count', pattern, severity, count))
+        elif args.since or args.until:
+            count_window = count_occurrences(file_path=log_file, **options)
+            with STATS.stage('output'):
+                print(f'Matched logs between {args.since or "start"} and {args.until or "end"}: {count_window}')
     elif args.command == 'first':
-        result = find_first_or_last(pattern=args.text, severity=args.severity, file_path=args.log_file, find_last=False)
-        print(f'First matched log: {result}')
+        result = find_first_or_last(pattern=args.text, severity=args.severity, file_path=args.log_file, find_last=False,
+                                    **options)
+        with STATS.stage('output'):
+            print(format_result('first', args.text, args.severity, result))
     elif args.command == 'last':
-        result = find_first_or_last(pattern=args.text, severity=args.severity, file_path=args.log_file, find_last=True)
-        print(f'Last matched log: {result}')
+        result = find_first_or_last(pattern=args.text, severity=args.severity, file_path=args.log_file, find_last=True,
+                                    **options)
+        with STATS.stage('output'):
+            print(format_result('last', args.text, args.severity, result))
+    elif args.command == 'histogram':
+        buckets = histogram(args.log_file, args.bucket, pattern=args.text, severity=args.severity, since=args.since,
+                            until=args.until, tolerance=args.time_tolerance)
+        with STATS.stage('output'):
+            write_histogram(buckets, args.format)
+    elif args.command == 'batch':
+        if not args.queries:
+            parser.error('batch needs --queries')
+        try:
+            queries = read_queries(args.queries)
+        except ValueError as e:
+            parser.error(str(e))
+        results = batch_queries(args.log_file, queries, since=args.since, until=args.until,
+                                tolerance=args.time_tolerance)
+        with STATS.stage('output'):
+            for (command, pattern, severity), result in zip(queries, results):
+                print(format_result(command, pattern, severity, result))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
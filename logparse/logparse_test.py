@@ -1,7 +1,17 @@
 import unittest
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import shutil
+import sqlite3
+import tempfile
 from os import path
+from contextlib import redirect_stdout
 from unittest.mock import patch, mock_open
-from logparse import count_occurrences, find_first_or_last
+from logparse import count_occurrences, find_first_or_last, check_pattern_match, compile_pattern, create_regex, reverse_lines, index_path, seek_time, histogram, write_histogram, batch_queries, read_queries, expand_log_paths, LogFollower, follow_log, main, STATS
 
 class LogParseTest(unittest.TestCase):
     def setUp(self):
@@ -157,5 +167,296 @@ class LogParseTest(unittest.TestCase):
         result = find_first_or_last(severity="*INFO*", file_path=self.log_file_path, find_last=True)
         self.assertEqual(result, "2024-09-09 12:03:00 INFO: System started")
 
+    def test_first_and_last_with_real_file(self):
+        result = find_first_or_last(severity="DEBUG", file_path=self.log_file_path, find_last=True)
+        self.assertEqual(result, "2024-11-27 13:10:01 DEBUG: System is analyzing login patterns.")
+
+        result = find_first_or_last(pattern="*locked*", file_path=self.log_file_path, find_last=True)
+        self.assertEqual(result, "2024-08-27 17:15:22 FATAL: User tried an incorrect key again; system is now locked.")
+
+        result = find_first_or_last(severity="DEBUG", file_path=self.log_file_path, find_last=False)
+        self.assertEqual(result, "2024-09-27 01:05:56 DEBUG: The system is opening.")
+
+    def test_parallel_scan(self):
+        queries = [dict(pattern="User*"), dict(severity="INFO"), dict(pattern="*system*", severity="*R*"),
+                   dict(pattern="*asdasda*")]
+        with patch('logparse.MIN_RANGE_BYTES', 64):
+            for query in queries:
+                self.assertEqual(count_occurrences(file_path=self.log_file_path, workers=2, **query),
+                                 count_occurrences(file_path=self.log_file_path, **query))
+                for find_last in (False, True):
+                    self.assertEqual(
+                        find_first_or_last(file_path=self.log_file_path, find_last=find_last, workers=2, **query),
+                        find_first_or_last(file_path=self.log_file_path, find_last=find_last, **query))
+
+    def test_index(self):
+        queries = [dict(pattern="User*"), dict(severity="INFO"), dict(severity="*R*"), dict(pattern="*system*"),
+                   dict(pattern="*key again*", severity="FATAL"), dict(pattern="*ser"), dict(severity="TRACE")]
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = path.join(directory, 'app.log')
+            shutil.copy(self.log_file_path, log_path)
+
+            def check():
+                for query in queries:
+                    self.assertEqual(count_occurrences(file_path=log_path, use_index=True, **query),
+                                     count_occurrences(file_path=log_path, **query), query)
+                    for find_last in (False, True):
+                        self.assertEqual(
+                            find_first_or_last(file_path=log_path, find_last=find_last, use_index=True, **query),
+                            find_first_or_last(file_path=log_path, find_last=find_last, **query), query)
+
+            def blocks():
+                with sqlite3.connect(index_path(log_path)) as connection:
+                    return connection.execute('SELECT COUNT(*) FROM blocks').fetchone()[0]
+
+            check()
+            indexed = blocks()
+            # Appended lines extend the index, including a line still being written.
+            with open(log_path, 'a') as file:
+                file.write("2024-11-27 13:25:00 TRACE: User key check.\n2024-11-27 13:26:00 INFO: User left")
+            check()
+            self.assertEqual(blocks(), indexed + 1)
+            # A replaced log is indexed from scratch.
+            with open(log_path, 'w') as file:
+                file.write("2024-11-28 00:00:00 ERROR: Disk full.\n")
+            check()
+            self.assertEqual(blocks(), 1)
+
+            # An index that cannot be created (e.g. a read-only directory) falls back to a plain scan.
+            stderr = io.StringIO()
+            unwritable = path.join(directory, 'missing', 'app.log.index')
+            with patch('logparse.index_path', return_value=unwritable), patch('sys.stderr', stderr):
+                check()
+            self.assertIn('scanning the log instead', stderr.getvalue())
+            self.assertFalse(path.exists(path.dirname(unwritable)))
+
+    def test_time_window(self):
+        since, until = "2024-09-27 01:05:00", "2024-09-27 01:10:00"
+        self.assertEqual(count_occurrences(file_path=self.log_file_path, since=since, until=until), 2)
+        # 01:05:08 is logged after 01:05:56; the tolerance still finds it.
+        self.assertEqual(find_first_or_last(severity="INFO", file_path=self.log_file_path, since=since, until=until),
+                         "2024-09-27 01:05:08 INFO: User attempted to log in with the correct key; system is opening.")
+        self.assertEqual(find_first_or_last(pattern="*system*", file_path=self.log_file_path, find_last=True,
+                                            until="2024-09-27 01:20:01"),
+                         "2024-09-27 01:20:01 INFO: User logged out of the system.")
+        self.assertEqual(count_occurrences(severity="WARN", file_path=self.log_file_path, since="2024-11-27 00:00:00"),
+                         2)
+        self.assertEqual(count_occurrences(severity="WARN", file_path=self.log_file_path, since="2025-01-01 00:00:00"),
+                         0)
+
+    def test_histogram(self):
+        buckets = histogram(self.log_file_path, 86400)
+        self.assertEqual(list(buckets), ["2024-08-27 00:00:00", "2024-09-27 00:00:00", "2024-11-27 00:00:00"])
+        self.assertEqual(buckets["2024-09-27 00:00:00"], {"INFO": 4, "DEBUG": 2, "ERROR": 1, "WARN": 1})
+
+        buckets = histogram(self.log_file_path, 600, pattern="User*", severity="*N*", since="2024-11-27 00:00:00")
+        self.assertEqual(buckets, {"2024-11-27 12:40:00": {"INFO": 1}, "2024-11-27 12:50:00": {"WARN": 2},
+                                   "2024-11-27 13:00:00": {"INFO": 1}, "2024-11-27 13:10:00": {"INFO": 1},
+                                   "2024-11-27 13:20:00": {"INFO": 1}})
+
+        output = io.StringIO()
+        write_histogram(histogram(self.log_file_path, 3600, severity="WARN"), 'csv', output)
+        self.assertEqual(output.getvalue().splitlines(),
+                         ["bucket,WARN,total", "2024-08-27 17:00:00,1,1", "2024-09-27 01:00:00,1,1",
+                          "2024-11-27 12:00:00,2,2"])
+        output = io.StringIO()
+        write_histogram({"2024-08-27 17:00:00": {"WARN": 1}}, 'json', output)
+        self.assertEqual(json.loads(output.getvalue()),
+                         [{"bucket": "2024-08-27 17:00:00", "counts": {"WARN": 1}, "total": 1}])
+
+    @patch('logparse.BATCH_GROUP_LINES', 4)
+    def test_batch_queries(self):
+        queries = [("count", "User", "INFO"), ("count", "User*", "INFO"), ("first", None, "ERROR"),
+                   ("last", "*system*", None), ("count", "*sys*", "*R*"), ("count", "*system*", None),
+                   ("count", "*system.*", None), ("last", "*key*", "WARN"), ("count", None, "*"),
+                   ("first", "*system*", "DEBUG"), ("count", "*", None), ("last", "*asdasda*", None),
+                   ("count", "System is analyzing login patterns.", None)]
+        expected = [count_occurrences(pattern, severity, self.log_file_path) if command == 'count' else
+                    find_first_or_last(pattern, severity, self.log_file_path, find_last=command == 'last')
+                    for command, pattern, severity in queries]
+        self.assertEqual(batch_queries(self.log_file_path, queries), expected)
+        self.assertEqual(expected[-1], 1)
+
+        # Needles inside other needles, and first/last queries with no count
+        # query on the same pattern, all come from the one pass.
+        queries = [("first", "*ystem*", None), ("last", "*system*", "*R*"), ("first", "*stem*", "WARN"),
+                   ("last", "*em*", None), ("last", "User*", "INFO"), ("first", "*s*", None)]
+        expected = [find_first_or_last(pattern, severity, self.log_file_path, find_last=command == 'last')
+                    for command, pattern, severity in queries]
+        with patch('logparse.find_first_or_last') as find:
+            self.assertEqual(batch_queries(self.log_file_path, queries), expected)
+            self.assertEqual(batch_queries(self.log_file_path, queries[::2]), expected[::2])
+        find.assert_not_called()
+
+        with open(self.log_file_path) as file:
+            data = file.read()
+        with patch('builtins.open', mock_open(read_data=data)):
+            self.assertEqual(batch_queries(self.log_file_path, queries), expected)
+
+    def test_rotated_log_set(self):
+        with open(self.log_file_path) as file:
+            lines = file.readlines()
+        with tempfile.TemporaryDirectory() as directory:
+            # Oldest first: app.log.3.gz, app.log.2.bz2, app.log.1.xz, app.log.
+            files = [(gzip.open, 'app.log.3.gz'), (bz2.open, 'app.log.2.bz2'), (lzma.open, 'app.log.1.xz'),
+                     (open, 'app.log')]
+            for part, (opener, name) in enumerate(files):
+                with opener(path.join(directory, name), 'wt') as file:
+                    file.writelines(lines[part * len(lines) // 4:(part + 1) * len(lines) // 4])
+            log_set = path.join(directory, 'app.log*')
+            self.assertEqual([path.basename(name) for name in expand_log_paths(log_set)],
+                             [name for _, name in files])
+            self.assertEqual([path.basename(name) for name in expand_log_paths(directory)],
+                             [name for _, name in files])
+
+            queries = [dict(pattern="User*"), dict(severity="DEBUG"), dict(pattern="*system*", severity="*R*"),
+                       dict(pattern="*asdasda*")]
+            for query in queries:
+                self.assertEqual(count_occurrences(file_path=log_set, **query),
+                                 count_occurrences(file_path=self.log_file_path, **query))
+                self.assertEqual(count_occurrences(file_path=log_set, use_index=True, workers=2, **query),
+                                 count_occurrences(file_path=self.log_file_path, **query))
+                for find_last in (False, True):
+                    self.assertEqual(find_first_or_last(file_path=log_set, find_last=find_last, **query),
+                                     find_first_or_last(file_path=self.log_file_path, find_last=find_last, **query))
+            self.assertEqual(histogram(log_set, 3600), histogram(self.log_file_path, 3600))
+            self.assertEqual(count_occurrences(severity="WARN", file_path=log_set, since="2024-11-27 00:00:00"), 2)
+            batch = [("count", "User*", None), ("first", None, "DEBUG"), ("last", "*system*", None),
+                     ("last", "*asdasda*", None)]
+            self.assertEqual(batch_queries(log_set, batch), batch_queries(self.log_file_path, batch))
+
+    def test_rotation_order(self):
+        names = ['app.log', 'app.log.10.gz', 'app.log.2', 'app.log.1', 'app.log-20240102.gz', 'app.log-20240101']
+        with tempfile.TemporaryDirectory() as directory:
+            for name in names:
+                open(path.join(directory, name), 'w').close()
+            open(path.join(directory, 'app.log.index'), 'w').close()
+            self.assertEqual([path.basename(name) for name in expand_log_paths(directory)],
+                             ['app.log.10.gz', 'app.log.2', 'app.log.1', 'app.log-20240101', 'app.log-20240102.gz',
+                              'app.log'])
+
+    def test_follow(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = path.join(directory, 'app.log')
+            with gzip.open(log_path + '.2.gz', 'wt') as file:
+                file.write("2024-01-01 00:00:00 ERROR: old\n")
+            with open(log_path, 'w') as file:
+                file.write("2024-01-01 00:01:00 INFO: start\n2024-01-01 00:02:00 ERROR: half")
+            follower = LogFollower(path.join(directory, 'app.log*'))
+            self.assertEqual(follower.poll(), ["2024-01-01 00:01:00 INFO: start"])
+            with open(log_path, 'a') as file:
+                file.write(" done\n")
+            self.assertEqual(follower.poll(), ["2024-01-01 00:02:00 ERROR: half done"])
+            self.assertEqual(follower.poll(), [])
+
+            # Rotation: the end of the old file is read before the new file.
+            with open(log_path, 'a') as file:
+                file.write("2024-01-01 00:03:00 ERROR: last words")
+            os.rename(log_path, log_path + '.1')
+            with open(log_path, 'w') as file:
+                file.write("2024-01-01 00:04:00 INFO: new file\n")
+            self.assertEqual(follower.poll(), ["2024-01-01 00:03:00 ERROR: last words",
+                                               "2024-01-01 00:04:00 INFO: new file"])
+            # Truncation starts over at the beginning of the file.
+            with open(log_path, 'w') as file:
+                file.write("2024-01-01 00:05:00 ERROR: x\n")
+            self.assertEqual(follower.poll(), ["2024-01-01 00:05:00 ERROR: x"])
+            follower.close()
+
+            output = io.StringIO()
+            with redirect_stdout(output):
+                count = follow_log(path.join(directory, 'app.log*'), 'count', severity="ERROR", iterations=1)
+                first = follow_log(path.join(directory, 'app.log*'), 'first', pattern="*words", iterations=1)
+            # app.log.2.gz and app.log hold one ERROR each, app.log.1 two.
+            self.assertEqual(count, 4)
+            self.assertEqual(first, "2024-01-01 00:03:00 ERROR: last words")
+            self.assertEqual(output.getvalue().splitlines(),
+                             ['Matched logs with severity "ERROR": 4',
+                              "First matched log: 2024-01-01 00:03:00 ERROR: last words"])
+
+    def test_stats(self):
+        with open(self.log_file_path) as file:
+            lines = sum(1 for _ in file)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        # --stats takes no value, so the log file may follow it.
+        argv = ['logparse.py', 'count', '--severity', 'ERROR', '--since', '2024-01-01 00:00:00',
+                '--stats-format', 'json', '--stats', self.log_file_path]
+        with patch('sys.argv', argv), redirect_stdout(stdout), patch('sys.stderr', stderr):
+            main()
+        self.assertFalse(STATS.enabled)
+        self.assertTrue(stdout.getvalue().startswith('Matched logs with severity "ERROR": '))
+        report = json.loads(stderr.getvalue())
+        self.assertEqual(report['lines'], lines)
+        self.assertEqual(report['input_bytes'], os.path.getsize(self.log_file_path))
+        self.assertLessEqual({'scan', 'seek', 'output'}, set(report['stages']))
+        self.assertAlmostEqual(sum(stage['wall_seconds'] for stage in report['stages'].values()),
+                               report['wall_seconds'])
+
+        # Without --stats nothing is counted.
+        count_occurrences(severity="ERROR", file_path=self.log_file_path)
+        self.assertEqual(STATS.items, lines)
+
+        # Only the bytes read count as input: --since reads the end of the log.
+        with open(self.log_file_path, 'rb') as file:
+            data = file.read()
+        stderr = io.StringIO()
+        argv = ['logparse.py', 'count', '--severity', 'INFO', '--since', '2024-11-27 13:05:00', '--time-tolerance', '0',
+                '--stats-format', 'json', '--stats', self.log_file_path]
+        with patch('sys.argv', argv), redirect_stdout(io.StringIO()), patch('sys.stderr', stderr):
+            main()
+        self.assertEqual(json.loads(stderr.getvalue())['input_bytes'], len(data) - data.index(b'2024-11-27 13:05:29'))
+
+        # Lines read by --workers processes are counted too.
+        stderr = io.StringIO()
+        argv = ['logparse.py', 'count', '--severity', 'ERROR', '--workers', '2', '--stats-format', 'json', '--stats',
+                self.log_file_path]
+        with patch('sys.argv', argv), patch('logparse.MIN_RANGE_BYTES', 64), redirect_stdout(io.StringIO()), \
+                patch('sys.stderr', stderr):
+            main()
+        report = json.loads(stderr.getvalue())
+        self.assertEqual(report['lines'], lines)
+        self.assertEqual(report['input_bytes'], os.path.getsize(self.log_file_path))
+
+    def test_read_queries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            query_path = path.join(directory, 'queries.txt')
+            with open(query_path, 'w') as file:
+                file.write('# alerts\ncount --text "*failed login*" --severity ERROR\n\nlast --severity WARN\n')
+            self.assertEqual(read_queries(query_path),
+                             [("count", "*failed login*", "ERROR"), ("last", None, "WARN")])
+            with open(query_path, 'w') as file:
+                file.write('count --text User\ncount\n')
+            with self.assertRaises(ValueError) as cm:
+                read_queries(query_path)
+            self.assertIn("queries.txt:2", str(cm.exception))
+
+    @patch('logparse.TIME_SCAN_BYTES', 16)
+    def test_seek_time(self):
+        lines = [f"2024-01-01 00:00:{second:02d} INFO: line {second}\n".encode() for second in range(0, 60, 2)]
+        data = b"".join(lines[:10]) + b"no timestamp\n" + b"".join(lines[10:])
+        self.assertEqual(seek_time(data, "2024-01-01 00:00:00"), 0)
+        self.assertEqual(seek_time(data, "2024-01-01 00:00:03"), len(b"".join(lines[:2])))
+        self.assertEqual(seek_time(data, "2024-01-01 00:00:20"), len(b"".join(lines[:10])) + len(b"no timestamp\n"))
+        self.assertEqual(seek_time(data, "2024-01-01 00:01:00"), len(data))
+
+    def test_reverse_lines(self):
+        with open(self.log_file_path, 'rb') as file:
+            data = file.read()
+        expected = data.decode().splitlines()[::-1]
+        for block_size in (1, 7, 100, len(data) + 1):
+            self.assertEqual(list(reverse_lines(data, block_size=block_size)), expected)
+        self.assertEqual(list(reverse_lines("a\n\nß\n".encode(), block_size=1)), ["ß", "", "a"])
+        self.assertEqual(list(reverse_lines(b"")), [])
+
+    def test_pattern_checks_agree_with_regex(self):
+        lines = ["User logged in", "System failure", "User", "", "in User"]
+        for pattern in ["User", "User*", "*User", "*User*", "*", "*in"]:
+            regex = create_regex(pattern)
+            _, matches = compile_pattern(pattern)
+            for line in lines:
+                expected = bool(regex.search(line))
+                self.assertEqual(matches(line), expected, (pattern, line))
+                self.assertEqual(check_pattern_match(pattern, line), expected, (pattern, line))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,160 @@
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --stats, --profile and --trace-memory for inspector and logparse. Each tool
+# keeps one module-level RunStats that its stages report to.
+
+class RunStats:
+    """Wall and CPU time spent in each stage of a run, for --stats.
+
+    Stages nest: a stage's times leave out the stages run inside it, and time
+    spent outside every stage is reported as "other". While disabled, stage()
+    returns one shared no-op context, so instrumented code costs a method call.
+    items counts the item_name (packets, lines) processed, and input_bytes
+    the bytes actually read from the inputs.
+    """
+
+    def __init__(self, item_name):
+        self.item_name = item_name
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.items = 0
+        self.input_bytes = 0
+        self._stack = []
+        self._started = self._mark = (time.perf_counter(), time.process_time())
+
+    def start(self):
+        self.reset()
+        self.enabled = True
+
+    def stop(self):
+        self._charge()
+        self.enabled = False
+
+    def stage(self, name):
+        return self._stage(name) if self.enabled else NO_STAGE
+
+    @contextmanager
+    def _stage(self, name):
+        self._charge()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self._stack.pop()
+
+    def counted(self, items):
+        # Passes items through, counting them.
+        for item in items:
+            self.items += 1
+            yield item
+
+    def add_input(self, file_path):
+        # An input read in full.
+        if self.enabled and os.path.isfile(file_path):
+            self.input_bytes += os.path.getsize(file_path)
+
+    def add_input_bytes(self, count):
+        if self.enabled:
+            self.input_bytes += count
+
+    def _charge(self):
+        # The time since the last mark goes to the innermost open stage.
+        wall, cpu = time.perf_counter(), time.process_time()
+        totals = self.stages.setdefault(self._stack[-1] if self._stack else 'other', [0.0, 0.0])
+        totals[0] += wall - self._mark[0]
+        totals[1] += cpu - self._mark[1]
+        self._mark = (wall, cpu)
+
+    def report(self):
+        wall = self._mark[0] - self._started[0]
+        report = {
+            'wall_seconds': wall,
+            'cpu_seconds': self._mark[1] - self._started[1],
+            'stages': {name: {'wall_seconds': stage_wall, 'cpu_seconds': stage_cpu}
+                       for name, (stage_wall, stage_cpu) in self.stages.items()},
+            self.item_name: self.items,
+            f'{self.item_name}_per_second': self.items / wall if wall > 0 else None,
+            'input_bytes': self.input_bytes,
+        }
+        if resource is not None:
+            # Child processes (--workers) only count once they have exited.
+            # ru_maxrss is in KiB on Linux and in bytes on macOS.
+            scale = 1 if sys.platform == 'darwin' else 1024
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            report['children_cpu_seconds'] = children.ru_utime + children.ru_stime
+            report['peak_rss_bytes'] = own.ru_maxrss * scale
+            report['children_peak_rss_bytes'] = children.ru_maxrss * scale
+        return report
+
+NO_STAGE = nullcontext()
+
+def write_stats(stats, output_format='text', file=None):
+    file = file or sys.stderr
+    report = stats.report()
+    if output_format == 'json':
+        print(json.dumps(report, indent=2), file=file)
+        return
+    print(f"Wall time: {report['wall_seconds']:.3f} s", file=file)
+    print(f"CPU time: {report['cpu_seconds']:.3f} s", file=file)
+    if 'children_cpu_seconds' in report:
+        print(f"Child process CPU time: {report['children_cpu_seconds']:.3f} s", file=file)
+    for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['wall_seconds']):
+        print(f"  {name}: {stage['wall_seconds']:.3f} s wall, {stage['cpu_seconds']:.3f} s CPU", file=file)
+    rate = report[f'{stats.item_name}_per_second']
+    print(f"{stats.item_name.capitalize()}: {report[stats.item_name]} ({rate or 0:.0f} per second)", file=file)
+    print(f"Input bytes: {report['input_bytes']}", file=file)
+    if 'peak_rss_bytes' in report:
+        print(f"Peak memory: {report['peak_rss_bytes'] / 1024 ** 2:.1f} MiB "
+              f"(child processes: {report['children_peak_rss_bytes'] / 1024 ** 2:.1f} MiB)", file=file)
+
+def write_allocations(snapshot, top, file=None):
+    # The top lines of code by memory still allocated, from tracemalloc.
+    file = file or sys.stderr
+    print(f"Top {top} allocation sites:", file=file)
+    for statistic in snapshot.statistics('lineno')[:top]:
+        frame = statistic.traceback[0]
+        print(f"  {frame.filename}:{frame.lineno}: {statistic.size / 1024:.1f} KiB in {statistic.count} blocks",
+              file=file)
+
+@contextmanager
+def instrumented(stats, show_stats=False, stats_format='text', profile_path=None, trace_memory=None):
+    # --stats, --profile and --trace-memory around one run; nothing is
+    # measured unless asked for.
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if show_stats:
+        stats.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if show_stats:
+            stats.stop()
+            write_stats(stats, stats_format)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Peak traced memory: {peak / 1024 ** 2:.1f} MiB", file=sys.stderr)
+            write_allocations(snapshot, trace_memory)
@@ -0,0 +1,54 @@
+import unittest
+import io
+import json
+import os
+import time
+from unittest.mock import patch
+from runstats import RunStats, NO_STAGE, instrumented, write_stats
+
+class RunStatsTest(unittest.TestCase):
+    def test_nested_stages(self):
+        stats = RunStats('lines')
+        stats.start()
+        with stats.stage('scan'):
+            time.sleep(0.02)
+            with stats.stage('index'):
+                time.sleep(0.05)
+            self.assertEqual(list(stats.counted(range(7))), list(range(7)))
+        stats.stop()
+        report = stats.report()
+        # Inner stages are not counted again in the stages around them.
+        self.assertGreaterEqual(report['stages']['index']['wall_seconds'], 0.05)
+        self.assertLess(report['stages']['scan']['wall_seconds'], 0.05)
+        self.assertAlmostEqual(sum(stage['wall_seconds'] for stage in report['stages'].values()),
+                               report['wall_seconds'])
+        self.assertEqual(report['lines'], 7)
+
+        output = io.StringIO()
+        write_stats(stats, 'text', output)
+        self.assertIn('Lines: 7 (', output.getvalue())
+
+    def test_disabled(self):
+        stats = RunStats('packets')
+        self.assertIs(stats.stage('parse'), NO_STAGE)
+        stats.add_input(__file__)
+        stats.add_input_bytes(10)
+        self.assertEqual(stats.input_bytes, 0)
+        self.assertEqual(stats.stages, {})
+
+    def test_instrumented_report(self):
+        stats = RunStats('packets')
+        stderr = io.StringIO()
+        with patch('sys.stderr', stderr):
+            with instrumented(stats, True, 'json'):
+                stats.add_input(__file__)
+                stats.add_input_bytes(10)
+                with stats.stage('parse'):
+                    stats.items += 3
+        report = json.loads(stderr.getvalue())
+        self.assertEqual(report['packets'], 3)
+        self.assertEqual(set(report['stages']), {'parse', 'other'})
+        self.assertEqual(report['input_bytes'], os.path.getsize(__file__) + 10)
+
+if __name__ == '__main__':
+    unittest.main()